@@ -1,77 +1,158 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Query
-import openai
-from dotenv import load_dotenv
-import os
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 import asyncio
 import json
 import logging
+import time
 import urllib.parse
 
 from app.models import YouTubeURL, UserTakes, TranscriptionErrorResponse
 from app.utils import (
     get_video_id,
-    get_video_details,
-    get_transcription,
     calculate_cost
 )
-from app.prompts import (
-    TRANSCRIPTION_ERROR_SYSTEM_PROMPT,
-    GENERATE_OUTLINE_SYSTEM_PROMPT,
-    GENERATE_SUMMARY_SYSTEM_PROMPT,
-    GENERATE_TLDR_SYSTEM_PROMPT,
-    GENERATE_VOCABULARY_SYSTEM_PROMPT
+from app.services import generate_follow_up
+from app.cache import stage_cache, run_manifests
+from app.singleflight import single_flight
+from app.transcripts import transcript_store, VIDEO_ID_PATTERN
+from app.stages import (
+    video_details_stage,
+    transcript_segments_stage,
+    transcription_stage,
+    transcription_errors_stage,
+    outline_stage
 )
-from app.services import (
-    generate_outline,
-    generate_summary,
-    generate_tldr,
-    generate_vocabulary,
-    generate_follow_up,
-    determine_transcription_errors  # Ensure this import is present
+from app.pipeline import (
+    run_youtube_notes,
+    full_process,
+    regenerate,
+    summary_response,
+    full_process_response,
+    SUMMARY_FIELDS,
+    FULL_PROCESS_FIELDS,
+    REGENERATE_FIELDS
 )
+from app.streaming import stream_youtube_notes, sse_response, STREAMING_HEADERS
+from app.estimate import BudgetExceeded, estimate_video, plan_within_budget
+from app.llm import check_model
+from app.routing import parse_stage_models
+from app.responses import json_response
+from app.usage import usage_ledger, current_api_key, QuotaExceeded, GROUP_COLUMNS, DAY
+from app.jobs import job_queue
+from app.config import BATCH_MAX_CONCURRENT_VIDEOS, ADMIN_API_KEYS
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Suppress debug messages
-logging.getLogger("openai").setLevel(logging.WARNING)
-logging.getLogger("urllib3").setLevel(logging.WARNING)
-logging.getLogger("asyncio").setLevel(logging.WARNING)
-
-# Load environment variables
-load_dotenv()
-openai.api_key = os.getenv('OPENAI_API_KEY')
-
-# Cost per 1,000 tokens for different models
-model_costs = {
-    "gpt-4o-mini": {
-        "input": 0.000150,
-        "output": 0.000600
-    },
-    "gpt-4o": {
-        "input": 0.005,
-        "output": 0.015
-    },
-}
-
 router = APIRouter()
 
-async def generate_summaries_async(video_title, video_author, transcription, transcription_errors, outline, num_bullets, first_summary, model):
-    logger.info("Starting asynchronous summary generation")
-    tasks = []
-    for i in range(2, num_bullets + 1):
-        tasks.append(asyncio.to_thread(generate_summary, video_title, video_author, transcription, transcription_errors, outline, i, first_summary, model))
-    return await asyncio.gather(*tasks)
+ADMIN_KEY_NAMES = {name.strip() for name in ADMIN_API_KEYS.split(",") if name.strip()}
+
+MAX_COST_QUERY = Query(None, gt=0, description="Reject (or move stages to a cheaper model) if the estimated cost in dollars is higher")
+
+
+def valid_model(model: str = Query(...)):
+    """Dependency rejecting models no configured backend can serve before any work starts."""
+    try:
+        check_model(model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return model
+
+def valid_video_id(video_id: str = Query(..., description="11-character YouTube video ID")):
+    """Dependency rejecting anything that is not a YouTube video ID, since IDs name stored files."""
+    if not VIDEO_ID_PATTERN.match(video_id):
+        raise HTTPException(status_code=400, detail="Invalid YouTube video ID")
+    return video_id
+
+def stage_models(
+    model: str = Depends(valid_model),
+    stage_models: Optional[str] = Query(None, description="Per-stage models, e.g. errors=gpt-4o-mini,tldr=gpt-4o-mini,sections=gpt-4o")
+):
+    """Dependency parsing the request's per-stage routing."""
+    try:
+        return parse_stage_models(stage_models)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def is_admin():
+    return current_api_key.get() in ADMIN_KEY_NAMES
+
+async def own_job(job_id):
+    """The job, or a 404 if it does not exist or was submitted with another key."""
+    job = await asyncio.to_thread(job_queue.store.get, job_id)
+    if not job or not (is_admin() or job["api_key"] == current_api_key.get()):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+async def within_quota():
+    """Dependency refusing LLM work to keys that have used up a rolling spending limit."""
+    try:
+        usage_ledger.check_quota(current_api_key.get())
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def budget_models(video_id, model, max_cost, models=None):
+    """Per-stage models that keep the run under max_cost, or a 400 with the estimate."""
+    if max_cost is None:
+        return models
+    try:
+        models, _ = await plan_within_budget(video_id, model, max_cost, models)
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=400, detail={"message": str(e), "estimate": e.estimate})
+    return models
+
+def response_shape(allowed_fields):
+    """Dependency returning a function that trims a response dict to what the client asked for.
+
+    `fields` is checked against the endpoint's `allowed_fields` up front, so a typo is a 400 before
+    any pipeline work starts rather than after it has been paid for.
+    """
+    def dependency(
+        fields: Optional[str] = Query(None, description="Comma-separated top-level fields to return, e.g. summary,title,cost"),
+        include_transcript: bool = Query(True, description="Set to false to leave the raw transcription out of the response")
+    ):
+        selected = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        unknown = [field for field in selected or () if field not in allowed_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+        def shape(response):
+            if selected:
+                response = {field: response[field] for field in selected if field in response}
+            if not include_transcript:
+                response = {key: value for key, value in response.items() if key != "transcription"}
+            return response
+
+        return shape
+
+    return dependency
 
 # YouTube Notes Endpoints
 
+@router.get("/youtube_notes/cache/stats", tags=["Youtube notes"])
+async def cache_stats_endpoint():
+    return {**await asyncio.to_thread(stage_cache.stats), "coalesced": dict(single_flight.coalesced)}
+
+@router.delete("/youtube_notes/cache", tags=["Youtube notes"])
+async def clear_cache_endpoint():
+    await asyncio.to_thread(stage_cache.clear)
+    await asyncio.to_thread(run_manifests.clear)
+    return {"cleared": True}
+
+@router.get("/youtube_notes/search", tags=["Youtube notes"])
+async def search_transcripts_endpoint(
+    q: str = Query(..., min_length=1, description="Words to find in stored transcripts"),
+    limit: int = Query(20, ge=1, le=100)
+):
+    return {"query": q, "results": await asyncio.to_thread(transcript_store.search, q, limit)}
+
 @router.post("/youtube_notes/video_details", tags=["Youtube notes"])
 async def get_video_details_endpoint(youtube_url: YouTubeURL):
     video_id = get_video_id(str(youtube_url.url))
     if not video_id:
         raise HTTPException(status_code=400, detail="Invalid YouTube URL")
-    details = get_video_details(video_id)
+    details = await video_details_stage(video_id)
     return {"video_id": video_id, "details": details}
 
 @router.get("/youtube_notes/transcription", tags=["Youtube notes"])
@@ -84,63 +165,49 @@ async def get_transcription_endpoint(video_identifier: str = Query(..., descript
 
     if not video_id:
         raise HTTPException(status_code=400, detail="Invalid YouTube URL or ID")
-    transcription = get_transcription(video_id)
+    transcription = await transcription_stage(video_id)
     return {"transcription": transcription}
 
-@router.post("/youtube_notes/transcription_errors", tags=["Youtube notes"])
-async def determine_transcription_errors_endpoint(video_id: str, video_title: str, model: str):
-    transcription = get_transcription(video_id)
-    transcription_errors, cost = determine_transcription_errors(video_title, transcription, model)
-    return {"errors": transcription_errors.errors, "cost": cost}
-
-@router.post("/youtube_notes/generate_outline", tags=["Youtube notes"])
-async def generate_outline_endpoint(video_id: str, model: str):
-    video_details = get_video_details(video_id)
-    transcription = get_transcription(video_id)
-    errors, _ = determine_transcription_errors(video_details["title"], transcription, model)
-    outline, num_bullets, cost = generate_outline(
+@router.post("/youtube_notes/transcription_errors", tags=["Youtube notes"], dependencies=[Depends(within_quota)])
+async def determine_transcription_errors_endpoint(video_title: str, video_id: str = Depends(valid_video_id), model: str = Depends(valid_model)):
+    transcription = await transcription_stage(video_id)
+    transcription_errors, cost = await transcription_errors_stage(video_id, video_title, transcription, model)
+    return {"errors": transcription_errors.get("errors", []), "cost": cost}
+
+@router.post("/youtube_notes/generate_outline", tags=["Youtube notes"], dependencies=[Depends(within_quota)])
+async def generate_outline_endpoint(video_id: str = Depends(valid_video_id), model: str = Depends(valid_model)):
+    video_details = await video_details_stage(video_id)
+    segments = await transcript_segments_stage(video_id)
+    transcription = segments.text
+    errors, _ = await transcription_errors_stage(video_id, video_details["title"], transcription, model)
+    outline, num_bullets, cost = await outline_stage(
+        video_id,
         video_details["title"],
         video_details["channel"],
         transcription,
         errors,
-        model
+        model,
+        segments=segments
     )
     return {"outline": outline, "num_bullets": num_bullets, "cost": cost}
 
-@router.post("/youtube_notes/generate_summary", tags=["Youtube notes"])
-async def generate_summary_endpoint(video_id: str, model: str):
-    video_details = get_video_details(video_id)
-    transcription = get_transcription(video_id)
-    errors, _ = determine_transcription_errors(video_details["title"], transcription, model)
-    outline, num_bullets, _ = generate_outline(video_details["title"], video_details["channel"], transcription, errors, model)
-    
-    first_summary, first_cost = generate_summary(video_details["title"], video_details["channel"], transcription, errors, outline, 1, None, model)
-    
-    remaining_summaries = await generate_summaries_async(video_details["title"], video_details["channel"], transcription, errors, outline, num_bullets, first_summary, model)
-    
-    all_summaries = [first_summary] + [summary for summary, _ in remaining_summaries]
-    total_cost = first_cost + sum(cost for _, cost in remaining_summaries)
-    
-    combined_summaries = "\n\n".join(all_summaries)
-    
-    tldr, tldr_cost = generate_tldr(combined_summaries, model)
-    vocabulary, vocab_cost = generate_vocabulary(transcription, errors, combined_summaries, model)
-    
-    total_cost += tldr_cost + vocab_cost
-    
-    summary_content = f"# {video_details['title']}\n\n"
-    summary_content += f"<iframe width=\"560\" height=\"315\" src=\"https://www.youtube.com/embed/{video_id}\" frameborder=\"0\" allow=\"accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture\" allowfullscreen></iframe>\n\n"
-    summary_content += f"{tldr}\n\n## Key Vocabulary\n\n{vocabulary}\n\n{combined_summaries}"
-    
-    return {"summary": summary_content, "cost": total_cost}
+@router.post("/youtube_notes/generate_summary", tags=["Youtube notes"], dependencies=[Depends(within_quota)])
+async def generate_summary_endpoint(video_id: str = Depends(valid_video_id), model: str = Depends(valid_model), stream: bool = Query(False, description="Stream the summary as Server-Sent Events"), max_cost: Optional[float] = MAX_COST_QUERY, shape=Depends(response_shape(SUMMARY_FIELDS)), models=Depends(stage_models)):
+    models = await budget_models(video_id, model, max_cost, models)
+    if stream:
+        def build_response(video_id, run):
+            return shape(summary_response(video_id, run))
+        return sse_response(stream_youtube_notes(video_id, model, build_response, models=models))
+    run = await run_youtube_notes(video_id, model, models=models)
+    return json_response(shape(summary_response(video_id, run)))
 
-@router.post("/youtube_notes/generate_follow_up", tags=["Youtube notes"])
-async def generate_follow_up_endpoint(user_takes: UserTakes, model: str):
-    video_details = get_video_details(user_takes.video_id)
-    transcription = get_transcription(user_takes.video_id)
-    errors, _ = determine_transcription_errors(video_details["title"], transcription, model)
+@router.post("/youtube_notes/generate_follow_up", tags=["Youtube notes"], dependencies=[Depends(within_quota)])
+async def generate_follow_up_endpoint(user_takes: UserTakes, model: str = Depends(valid_model)):
+    video_details = await video_details_stage(user_takes.video_id)
+    transcription = await transcription_stage(user_takes.video_id)
+    errors, _ = await transcription_errors_stage(user_takes.video_id, video_details["title"], transcription, model)
     
-    follow_up_content, cost = generate_follow_up(video_details["title"], transcription, errors, user_takes.takes, model)
+    follow_up_content, cost = await generate_follow_up(video_details["title"], transcription, errors, user_takes.takes, model)
     
     title = f"RE: {video_details['title']}"
     file_name = f"RE_{video_details['title'].replace(':', '_')}.md"
@@ -152,48 +219,115 @@ async def generate_follow_up_endpoint(user_takes: UserTakes, model: str):
         "file_name": file_name
     }
 
-@router.post("/youtube_notes/full_process", tags=["Youtube notes"])
-async def full_process_endpoint(youtube_url: YouTubeURL, model: str, background_tasks: BackgroundTasks):
+@router.post("/youtube_notes/full_process", tags=["Youtube notes"], dependencies=[Depends(within_quota)])
+async def full_process_endpoint(youtube_url: YouTubeURL, model: str = Depends(valid_model), stream: bool = Query(False, description="Stream the summary as Server-Sent Events"), max_cost: Optional[float] = MAX_COST_QUERY, shape=Depends(response_shape(FULL_PROCESS_FIELDS)), models=Depends(stage_models)):
     video_id = get_video_id(str(youtube_url.url))
     if not video_id:
         raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    models = await budget_models(video_id, model, max_cost, models)
+    if stream:
+        def build_response(video_id, run):
+            return shape(full_process_response(video_id, run))
+        return sse_response(stream_youtube_notes(video_id, model, build_response, models=models))
     
-    video_details = get_video_details(video_id)
-    transcription = get_transcription(video_id)
-    errors, error_cost = determine_transcription_errors(video_details["title"], transcription, model)
-    
-    # Add this line to convert errors to a dictionary
-    errors_dict = errors.dict() if errors else {}
-    
-    outline, num_bullets, outline_cost = generate_outline(video_details["title"], video_details["channel"], transcription, errors_dict, model)
-    
-    first_summary, first_cost = generate_summary(video_details["title"], video_details["channel"], transcription, errors_dict, outline, 1, None, model)
-    
-    remaining_summaries = await generate_summaries_async(video_details["title"], video_details["channel"], transcription, errors_dict, outline, num_bullets, first_summary, model)
-    
-    all_summaries = [first_summary] + [summary for summary, _ in remaining_summaries]
-    summary_cost = first_cost + sum(cost for _, cost in remaining_summaries)
-    
-    combined_summaries = "\n\n".join(all_summaries)
-    
-    tldr, tldr_cost = generate_tldr(combined_summaries, model)
-    vocabulary, vocab_cost = generate_vocabulary(transcription, errors_dict, combined_summaries, model)
-    
-    summary_content = f"# {video_details['title']}\n\n"
-    summary_content += f"<iframe width=\"560\" height=\"315\" src=\"https://www.youtube.com/embed/{video_id}\" frameborder=\"0\" allow=\"accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture\" allowfullscreen></iframe>\n\n"
-    summary_content += f"{tldr}\n\n## Key Vocabulary\n\n{vocabulary}\n\n{combined_summaries}"
-    
-    total_cost = error_cost + outline_cost + summary_cost + tldr_cost + vocab_cost
-    
-    title = video_details['title']
-    file_name = f"{title.replace(':', '_')}.md"
-    
+    return json_response(shape(await full_process(video_id, model, models=models)))
+
+@router.get("/youtube_notes/estimate", tags=["Youtube notes"])
+async def estimate_endpoint(video_identifier: str = Query(..., description="YouTube URL or video ID"), model: str = Depends(valid_model), models=Depends(stage_models)):
+    """Predicted tokens and cost per stage of full_process, without calling the LLM."""
+    video_id = get_video_id(video_identifier)
+    if not video_id:
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL or ID")
+    return await estimate_video(video_id, model, models)
+
+@router.post("/youtube_notes/regenerate", tags=["Youtube notes"], dependencies=[Depends(within_quota)])
+async def regenerate_endpoint(youtube_url: YouTubeURL, model: str = Depends(valid_model), max_cost: Optional[float] = MAX_COST_QUERY, shape=Depends(response_shape(REGENERATE_FIELDS)), models=Depends(stage_models)):
+    video_id = get_video_id(str(youtube_url.url))
+    if not video_id:
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    models = await budget_models(video_id, model, max_cost, models)
+    return json_response(shape(await regenerate(video_id, model, models=models)))
+
+@router.post("/youtube_notes/batch", tags=["Youtube notes"], dependencies=[Depends(within_quota)])
+async def batch_process_endpoint(youtube_urls: List[YouTubeURL], model: str = Depends(valid_model), shape=Depends(response_shape(FULL_PROCESS_FIELDS))):
+    """Runs full_process for every unique video and streams one NDJSON line per video as it finishes."""
+    video_ids = []
+    invalid_urls = []
+    for youtube_url in youtube_urls:
+        video_id = get_video_id(str(youtube_url.url))
+        if not video_id:
+            invalid_urls.append(str(youtube_url.url))
+        elif video_id not in video_ids:
+            video_ids.append(video_id)
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENT_VIDEOS)
+
+    async def process(video_id):
+        async with semaphore:
+            try:
+                return {"video_id": video_id, "status": "completed", "result": shape(await full_process(video_id, model))}
+            except Exception as e:
+                logger.error(f"Batch processing failed for video {video_id}: {e}")
+                return {"video_id": video_id, "status": "failed", "error": str(e)}
+
+    async def stream_results():
+        for url in invalid_urls:
+            yield json.dumps({"url": url, "status": "failed", "error": "Invalid YouTube URL"}) + "\n"
+        for finished in asyncio.as_completed([process(video_id) for video_id in video_ids]):
+            yield json.dumps(await finished) + "\n"
+
+    logger.info(f"Starting batch of {len(video_ids)} videos ({len(youtube_urls) - len(video_ids) - len(invalid_urls)} duplicates removed)")
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson", headers=STREAMING_HEADERS)
+
+# Job Endpoints
+
+@router.post("/youtube_notes/jobs", status_code=202, tags=["Jobs"], dependencies=[Depends(within_quota)])
+async def create_job_endpoint(youtube_url: YouTubeURL, model: str = Depends(valid_model)):
+    video_id = get_video_id(str(youtube_url.url))
+    if not video_id:
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    job = await job_queue.submit(video_id, model)
+    return {"job_id": job["id"], "status": job["status"]}
+
+@router.get("/jobs/{job_id}", tags=["Jobs"])
+async def get_job_endpoint(job_id: str):
+    job = await own_job(job_id)
+    job.pop("result", None)
+    return job
+
+@router.get("/jobs/{job_id}/result", tags=["Jobs"])
+async def get_job_result_endpoint(job_id: str, shape=Depends(response_shape(FULL_PROCESS_FIELDS))):
+    job = await own_job(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Job failed: {job['error']}")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return json_response(shape(job["result"]))
+
+@router.get("/usage", tags=["Usage"])
+async def usage_endpoint(
+    days: int = Query(30, ge=1, description="How many days back to include"),
+    period: str = Query("total", regex="^(hour|day|total)$", description="Sum per hour, per day (UTC) or over the whole range"),
+    group_by: str = Query("api_key,stage,model", description="Comma-separated columns to group by: api_key, stage, model"),
+    api_key: Optional[str] = Query(None, description="Only this API key's usage, by name (admin keys only)")
+):
+    """Calls, tokens and dollars from the usage ledger, plus the calling key's rolling limits."""
+    columns = [column.strip() for column in group_by.split(",") if column.strip()]
+    unknown = [column for column in columns if column not in GROUP_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by columns: {', '.join(unknown)}")
+    if not is_admin():
+        if api_key not in (None, current_api_key.get()):
+            raise HTTPException(status_code=403, detail="Only admin keys can read another key's usage")
+        api_key = current_api_key.get()
+    # Include calls still waiting in this process's buffer
+    await usage_ledger.flush()
+    since = time.time() - days * DAY
+    rows = await asyncio.to_thread(usage_ledger.aggregate, since, None, columns, period, api_key)
     return {
-        "video_id": video_id,
-        "summary": summary_content,
-        "transcription_errors": errors_dict,
-        "transcription": transcription,
-        "cost": total_cost,
-        "title": title,
-        "file_name": file_name
+        "since": since,
+        "period": period,
+        "cost": sum(row["cost"] for row in rows),
+        "limits": usage_ledger.quota_status(current_api_key.get()),
+        "usage": rows,
     }
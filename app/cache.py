@@ -0,0 +1,245 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from app.config import CACHE_PATH, CACHE_TTL_SECONDS, CACHE_MAX_BYTES
+from app.metrics import cache_requests
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(stage, *parts):
+    """Content-addressed key: a hash of the stage name and every input that affects its output."""
+    payload = json.dumps([stage, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def prompt_hash(*prompts):
+    digest = hashlib.sha256()
+    for prompt in prompts:
+        digest.update((prompt or "").encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class StageCache:
+    """SQLite-backed cache for pipeline stage outputs with TTL and LRU eviction under a size cap."""
+
+    # Hits refresh an entry's LRU position at most this often, so reads rarely need a write
+    ACCESS_UPDATE_SECONDS = 60
+
+    def __init__(self, path, ttl_seconds, max_bytes):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        """CREATE TABLE IF NOT EXISTS stage_cache (
+                            key TEXT PRIMARY KEY,
+                            stage TEXT NOT NULL,
+                            value TEXT NOT NULL,
+                            size INTEGER NOT NULL,
+                            created_at REAL NOT NULL,
+                            accessed_at REAL NOT NULL
+                        )"""
+                    )
+                    conn.execute(
+                        "CREATE INDEX IF NOT EXISTS idx_stage_cache_accessed ON stage_cache (accessed_at)"
+                    )
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def get(self, stage, key):
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT value, created_at, accessed_at FROM stage_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM stage_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    row = None
+                if row and now - row[2] > self.ACCESS_UPDATE_SECONDS:
+                    conn.execute("UPDATE stage_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Stage cache read failed for {stage}: {e}")
+            row = None
+
+        with self._lock:
+            if row:
+                self._hits[stage] += 1
+            else:
+                self._misses[stage] += 1
+        cache_requests.inc(stage=stage, result="hit" if row else "miss")
+
+        if not row:
+            logger.debug(f"Cache miss for stage {stage}")
+            return None
+        logger.info(f"Cache hit for stage {stage}")
+        return json.loads(row[0])
+
+    def set(self, stage, key, value):
+        data = json.dumps(value)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            logger.warning(f"Not caching {stage} output of {size} bytes (exceeds cache size cap)")
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO stage_cache (key, stage, value, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, stage, data, size, now, now),
+                )
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Stage cache write failed for {stage}: {e}")
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM stage_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM stage_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are back under the cap
+        excess = total - self.max_bytes
+        rows = conn.execute("SELECT key, size FROM stage_cache ORDER BY accessed_at ASC").fetchall()
+        evicted = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM stage_cache WHERE key = ?", evicted)
+        logger.info(f"Evicted {len(evicted)} stage cache entries")
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM stage_cache")
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._hits.clear()
+            self._misses.clear()
+
+    def stats(self):
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT stage, COUNT(*), COALESCE(SUM(size), 0) FROM stage_cache GROUP BY stage"
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Stage cache stats failed: {e}")
+            rows = []
+
+        with self._lock:
+            stages = set(self._hits) | set(self._misses) | {row[0] for row in rows}
+            entries = {row[0]: (row[1], row[2]) for row in rows}
+            return {
+                "stages": {
+                    stage: {
+                        "hits": self._hits[stage],
+                        "misses": self._misses[stage],
+                        "entries": entries.get(stage, (0, 0))[0],
+                        "bytes": entries.get(stage, (0, 0))[1],
+                    }
+                    for stage in sorted(stages)
+                },
+                "hits": sum(self._hits.values()),
+                "misses": sum(self._misses.values()),
+                "entries": sum(count for count, _ in entries.values()),
+                "bytes": sum(size for _, size in entries.values()),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+class RunManifests:
+    """The fingerprinted stage outputs of the latest pipeline run per video.
+
+    Unlike stage cache entries these never expire, so `regenerate` can always tell which stages
+    changed since the last run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS run_manifests (
+                    video_id TEXT PRIMARY KEY,
+                    manifest TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, video_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT manifest FROM run_manifests WHERE video_id = ?", (video_id,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else {}
+
+    def set(self, video_id, manifest):
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO run_manifests (video_id, manifest, updated_at) VALUES (?, ?, ?)",
+                    (video_id, json.dumps(manifest), time.time()),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Saving run manifest for {video_id} failed: {e}")
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM run_manifests")
+            conn.commit()
+        finally:
+            conn.close()
+
+
+os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+stage_cache = StageCache(CACHE_PATH, CACHE_TTL_SECONDS, CACHE_MAX_BYTES)
+run_manifests = RunManifests(CACHE_PATH)
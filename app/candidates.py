@@ -0,0 +1,219 @@
+import logging
+import os
+import re
+from collections import Counter, defaultdict, deque
+from functools import lru_cache
+from itertools import islice
+
+from app.chunking import STOPWORDS
+from app.config import SPELLING_DICTIONARY_PATH
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9'-]*")
+INFLECTION_SUFFIXES = ("s", "es", "ed", "d", "ing", "er", "ly", "'s")
+
+# Candidate scores; higher is more likely to be a real transcription error
+TITLE_SIMILAR_SCORE = 3
+CLUSTER_SCORE = 2
+UNKNOWN_WORD_SCORE = 1
+
+
+@lru_cache(maxsize=1)
+def load_dictionary():
+    """Lower-cased words from SPELLING_DICTIONARY_PATH, or an empty set if there is no word list."""
+    if not SPELLING_DICTIONARY_PATH or not os.path.exists(SPELLING_DICTIONARY_PATH):
+        logger.info(f"No spelling dictionary at {SPELLING_DICTIONARY_PATH!r}, skipping dictionary checks")
+        return frozenset()
+    with open(SPELLING_DICTIONARY_PATH, encoding="utf-8", errors="ignore") as f:
+        return frozenset(line.strip().lower() for line in f if line.strip())
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance between a and b, or limit + 1 once it is known to exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _is_inflection(a, b):
+    shorter, longer = sorted((a, b), key=len)
+    return longer.startswith(shorter) and longer[len(shorter):] in INFLECTION_SUFFIXES
+
+
+def _in_dictionary(word, dictionary):
+    if word in dictionary:
+        return True
+    return any(word.endswith(suffix) and word[:-len(suffix)] in dictionary for suffix in INFLECTION_SUFFIXES)
+
+
+def _similar_title_terms(word, title_terms):
+    matches = []
+    for term in title_terms:
+        if term == word or _is_inflection(term, word):
+            continue
+        limit = max(1, round(len(term) * 0.3))
+        if edit_distance(word, term, limit) <= limit:
+            matches.append(term)
+    return matches
+
+
+def _clusters(counts):
+    """Group words one edit apart using shared single-deletion keys, so no pairwise comparison is needed."""
+    buckets = defaultdict(set)
+    for word in counts:
+        if len(word) < 5:
+            continue
+        buckets[word].add(word)
+        for i in range(len(word)):
+            buckets[word[:i] + word[i + 1:]].add(word)
+
+    neighbours = defaultdict(set)
+    for words in buckets.values():
+        if len(words) < 2:
+            continue
+        for word in words:
+            for other in words:
+                if other != word and not _is_inflection(word, other) and edit_distance(word, other, 1) <= 1:
+                    neighbours[word].add(other)
+    return neighbours
+
+
+def _words(text):
+    return (match.group() for match in WORD_PATTERN.finditer(text))
+
+
+def _attach_contexts(transcription, wanted, window):
+    """Add up to two excerpts to each wanted candidate (keyed by word or "first second" pair).
+
+    The transcript is scanned once holding only the words around the current one.
+    """
+    pair_starts = {key.split(" ")[0] for key in wanted if " " in key}
+    buffer, lowered, first, count = deque(), deque(), 0, 0
+
+    def visit(center):
+        index = center - first
+        word = lowered[index]
+        keys = [word]
+        if word in pair_starts and index + 1 < len(lowered):
+            keys.append(f"{word} {lowered[index + 1]}")
+        for key in keys:
+            candidate = wanted.get(key)
+            if candidate and len(candidate["contexts"]) < 2:
+                context = " ".join(islice(buffer, max(0, index - window), index + window + 1))
+                if context not in candidate["contexts"]:
+                    candidate["contexts"].append(context)
+
+    for word in _words(transcription):
+        buffer.append(word)
+        lowered.append(word.lower())
+        count += 1
+        center = count - 1 - window
+        if center >= 0:
+            if lowered[center - first] in wanted or lowered[center - first] in pair_starts:
+                visit(center)
+            if center - window == first:
+                buffer.popleft()
+                lowered.popleft()
+                first += 1
+    for center in range(max(0, count - window), count):
+        visit(center)
+
+
+def find_candidates(video_title, transcription, max_candidates, context_words=8):
+    """Find words in an auto-generated transcript that look like transcription errors.
+
+    Three local signals are combined: near-misses of words in the video title (including two
+    transcript words that run together into a title word), rare spellings one edit away from a
+    more common word in the same transcript, and rare words missing from the spelling dictionary.
+    Returns at most `max_candidates` dicts with the word, why it was flagged, similar words and
+    short excerpts, strongest first.
+    """
+    # Long transcripts are streamed rather than held as word lists; only per-word counts are kept
+    transcription = transcription or ""
+    counts = Counter(word.lower() for word in _words(transcription))
+    title_terms = {term.lower() for term in WORD_PATTERN.findall(video_title or "") if len(term) >= 4}
+    title_terms -= STOPWORDS
+    dictionary = load_dictionary()
+
+    found = {}
+
+    def flag(word, score, reason, similar=()):
+        candidate = found.setdefault(word, {"word": word, "score": 0, "reasons": [], "similar": set()})
+        candidate["score"] += score
+        if reason not in candidate["reasons"]:
+            candidate["reasons"].append(reason)
+        candidate["similar"].update(similar)
+
+    for word in counts:
+        if len(word) < 3 or word in STOPWORDS:
+            continue
+        similar = _similar_title_terms(word, title_terms)
+        if similar:
+            # Real words can still be errors ("cloud" for "Claude") but are less likely to be
+            real_word = bool(dictionary) and _in_dictionary(word, dictionary)
+            flag(word, UNKNOWN_WORD_SCORE if real_word else TITLE_SIMILAR_SCORE, "close to a title word", similar)
+
+    # Captions often split an unfamiliar name into common words ("pie torch" for "PyTorch").
+    # Only pairs whose joined length could be within the edit limit of a title term are compared.
+    if title_terms:
+        min_length = max(5, min(len(term) - max(1, round(len(term) * 0.3)) for term in title_terms))
+        max_length = max(len(term) + max(1, round(len(term) * 0.3)) for term in title_terms)
+        checked = set()
+        first = None
+        for word in _words(transcription):
+            second = word.lower()
+            if first is not None:
+                joined = first + second
+                if (
+                    min_length <= len(joined) <= max_length and joined not in checked and joined not in counts
+                    and first not in title_terms and second not in title_terms
+                ):
+                    checked.add(joined)
+                    similar = _similar_title_terms(joined, title_terms)
+                    if similar:
+                        flag(f"{first} {second}", TITLE_SIMILAR_SCORE, "close to a title word when joined", similar)
+            first = second
+
+    for word, others in _clusters(counts).items():
+        dominant = max(others, key=counts.__getitem__)
+        if counts[dominant] > counts[word] and not (dictionary and _in_dictionary(word, dictionary)):
+            flag(word, CLUSTER_SCORE, "rare variant of a more common word", [dominant])
+
+    if dictionary:
+        for word, count in counts.items():
+            if count <= 2 and len(word) >= 4 and word not in STOPWORDS and not _in_dictionary(word, dictionary):
+                flag(word, UNKNOWN_WORD_SCORE, "not in the dictionary")
+
+    ranked = sorted(found.values(), key=lambda candidate: (-candidate["score"], counts.get(candidate["word"], 0)))
+    ranked = ranked[:max_candidates]
+
+    for candidate in ranked:
+        candidate["contexts"] = []
+    _attach_contexts(transcription, {candidate["word"]: candidate for candidate in ranked}, context_words)
+
+    for candidate in ranked:
+        candidate["similar"] = sorted(candidate["similar"])
+        del candidate["score"]
+    return ranked
+
+
+def format_candidates(candidates):
+    lines = []
+    for candidate in candidates:
+        line = f"- {candidate['word']} ({'; '.join(candidate['reasons'])}"
+        if candidate["similar"]:
+            line += f"; similar: {', '.join(candidate['similar'])}"
+        line += ")"
+        for context in candidate["contexts"]:
+            line += f"\n  \"...{context}...\""
+        lines.append(line)
+    return "\n".join(lines)
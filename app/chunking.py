@@ -0,0 +1,145 @@
+import math
+import re
+from collections import Counter
+
+from app.tokenizer import count_tokens
+
+STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "had", "her", "was", "one",
+    "our", "out", "has", "him", "his", "how", "its", "may", "new", "now", "old", "see", "two", "who",
+    "did", "get", "got", "let", "say", "she", "too", "use", "that", "this", "with", "have", "from",
+    "they", "will", "would", "there", "their", "what", "about", "which", "when", "make", "like",
+    "just", "into", "than", "then", "them", "these", "some", "could", "other", "been", "were",
+    "also", "more", "very", "your", "video", "really", "going", "know", "want", "okay", "yeah",
+}
+
+PARENT_BULLET_PATTERN = re.compile(r"^(\d+)\.\s+(.*)")
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.*)")
+
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def chunk_segments(transcript, max_tokens):
+    """Group a Transcript's segments into chunks of roughly max_tokens, keeping their time range."""
+    chunks = []
+    texts, tokens, start = [], 0, None
+    for segment in transcript:
+        text = segment.text
+        if start is None:
+            start = segment.start
+        texts.append(text)
+        tokens += count_tokens(text)
+        if tokens >= max_tokens:
+            chunks.append({"start": start, "end": segment.start + segment.duration, "text": " ".join(texts)})
+            texts, tokens, start = [], 0, None
+    if texts:
+        last = transcript[-1]
+        chunks.append({"start": start, "end": last.start + last.duration, "text": " ".join(texts)})
+    return chunks
+
+
+def _terms(text):
+    return [
+        word for word in re.findall(r"[a-z0-9']+", text.lower())
+        if len(word) > 2 and word not in STOPWORDS
+    ]
+
+
+def outline_bullets(outline):
+    """Split a numbered markdown outline into one text block per parent bullet, sub-bullets included."""
+    bullets = []
+    for line in (outline or "").splitlines():
+        match = PARENT_BULLET_PATTERN.match(line)
+        if match:
+            bullets.append(match.group(2))
+        elif bullets and line.strip():
+            bullets[-1] += " " + line.strip()
+    return bullets
+
+
+def align_bullets(bullets, chunks):
+    """Pick a start chunk for each bullet so starts never move backwards and total term overlap is maximal."""
+    chunk_terms = [set(_terms(chunk["text"])) for chunk in chunks]
+    document_frequency = Counter(term for terms in chunk_terms for term in terms)
+    idf = {term: math.log(1 + len(chunks) / count) for term, count in document_frequency.items()}
+
+    scores = []
+    for bullet in bullets:
+        terms = set(_terms(bullet))
+        scores.append([sum(idf[term] for term in terms & chunk) for chunk in chunk_terms])
+
+    # best[i][j]: best total score with bullet i starting at chunk j
+    best = [scores[0][:]]
+    back = [[0] * len(chunks)]
+    for i in range(1, len(bullets)):
+        row, pointers = [], []
+        running_best, running_index = float("-inf"), 0
+        for j in range(len(chunks)):
+            if best[i - 1][j] > running_best:
+                running_best, running_index = best[i - 1][j], j
+            row.append(scores[i][j] + running_best)
+            pointers.append(running_index)
+        best.append(row)
+        back.append(pointers)
+
+    starts = [max(range(len(chunks)), key=lambda j: best[-1][j])]
+    for i in range(len(bullets) - 1, 0, -1):
+        starts.append(back[i][starts[-1]])
+    starts.reverse()
+    starts[0] = 0
+    return starts
+
+
+def section_transcripts(transcript, outline, num_bullets, chunk_tokens):
+    """Return the transcript excerpt for each outline bullet (index 0 is bullet 1) and the
+    (first, last) chunk index of each aligned bullet's excerpt.
+
+    Each excerpt runs from the bullet's best-matching chunk through the chunk where the next
+    bullet starts, so boundary content is seen by both neighbours.
+    """
+    chunks = chunk_segments(transcript, chunk_tokens)
+    bullets = outline_bullets(outline)[:num_bullets]
+    if not chunks or not bullets:
+        return None
+
+    starts = align_bullets(bullets, chunks)
+    excerpts, bounds = [], []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(chunks) - 1
+        bounds.append((start, end))
+        excerpts.append("\n".join(
+            f"[{format_timestamp(chunk['start'])}] {chunk['text']}" for chunk in chunks[start:end + 1]
+        ))
+    # Bullets the outline text did not number still get the full transcript
+    excerpts.extend([transcript.text] * (num_bullets - len(excerpts)))
+    return excerpts, bounds
+
+
+def merge_vocabulary(vocabularies):
+    """Join vocabulary markdown written for separate chunks, keeping the first explanation of each term.
+
+    Terms are the markdown headings; text before a chunk's first heading is dropped, and a chunk
+    without any headings is kept whole.
+    """
+    seen, blocks = set(), []
+    for vocabulary in vocabularies:
+        sections = re.split(r"(?m)^(?=#{1,6}\s)", vocabulary or "")
+        if not any(HEADING_PATTERN.match(section) for section in sections):
+            if vocabulary and vocabulary.strip():
+                blocks.append(vocabulary.strip())
+            continue
+        for section in sections:
+            match = HEADING_PATTERN.match(section)
+            if not match:
+                continue
+            term = re.sub(r"[^a-z0-9]+", " ", match.group(1).lower()).strip()
+            if term not in seen:
+                seen.add(term)
+                blocks.append(section.strip())
+    return "\n\n".join(blocks)
@@ -1,12 +1,132 @@
+import os
+import logging
+from dotenv import load_dotenv
+
+# The one place the environment is loaded and logging is set up; every app module imports this first
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL)
+for noisy_logger in ("httpx", "urllib3", "asyncio"):
+    logging.getLogger(noisy_logger).setLevel(logging.WARNING)
+
+API_KEY = os.getenv("API_KEY")
+# Additional named keys, e.g. "phone=...,laptop=...", tracked separately in the usage ledger
+API_KEYS = os.getenv("API_KEYS", "")
+# Key names that may read every key's usage and jobs; other keys only see their own
+ADMIN_API_KEYS = os.getenv("ADMIN_API_KEYS", "default")
+# Bearer token a Prometheus scraper can send to /metrics instead of an API key
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+
 model_costs = {
     "gpt-4o-mini": {
         "input": 0.000150,
+        "cached_input": 0.000075,
         "output": 0.000600
     },
     "gpt-4o": {
         "input": 0.005,
+        "cached_input": 0.0025,
         "output": 0.015
     },
 }
 
-# Add other configurations as needed
\ No newline at end of file
+# Local state (caches, stores) lives under DATA_DIR
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Pipeline stage cache
+CACHE_PATH = os.getenv("CACHE_PATH", os.path.join(DATA_DIR, "stage_cache.sqlite3"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Transcript store: one compact file per video plus a full-text index over all of them
+TRANSCRIPTS_DIR = os.getenv("TRANSCRIPTS_DIR", os.path.join(DATA_DIR, "transcripts"))
+TRANSCRIPT_INDEX_PATH = os.getenv("TRANSCRIPT_INDEX_PATH", os.path.join(DATA_DIR, "transcript_index.sqlite3"))
+TRANSCRIPT_INDEX_CHUNK_TOKENS = int(os.getenv("TRANSCRIPT_INDEX_CHUNK_TOKENS", "100"))
+
+# Background jobs. JOB_WORKERS is per server process; any process can claim any queued job and
+# jobs whose process stopped sending heartbeats are handed to another one
+JOBS_PATH = os.getenv("JOBS_PATH", os.path.join(DATA_DIR, "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+
+# Usage ledger: tokens and dollars of every LLM call per API key, buffered and written every
+# USAGE_FLUSH_SECONDS (or once USAGE_FLUSH_ROWS calls are waiting)
+USAGE_PATH = os.getenv("USAGE_PATH", os.path.join(DATA_DIR, "usage.sqlite3"))
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "5"))
+USAGE_FLUSH_ROWS = int(os.getenv("USAGE_FLUSH_ROWS", "500"))
+# Rolling per-key spending limits in dollars (0 disables)
+USAGE_DAILY_LIMIT = float(os.getenv("USAGE_DAILY_LIMIT", "0"))
+USAGE_MONTHLY_LIMIT = float(os.getenv("USAGE_MONTHLY_LIMIT", "0"))
+
+# Server processes (uvicorn reads the same variable for --workers)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# OpenAI HTTP client
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+
+# Optional OpenAI-compatible local server (llama.cpp, Ollama, vLLM, ...). Models named
+# "local/<name>" are sent to it as <name> and cost nothing
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "")
+LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY", "")
+LOCAL_LLM_TIMEOUT_SECONDS = float(os.getenv("LOCAL_LLM_TIMEOUT_SECONDS", "600"))
+LOCAL_LLM_MAX_CONCURRENCY = int(os.getenv("LOCAL_LLM_MAX_CONCURRENCY", "2"))
+
+# Per-stage models, e.g. "errors=gpt-4o-mini,tldr=gpt-4o-mini,sections=gpt-4o". Stages not listed
+# use the request's model
+LLM_STAGE_MODELS = os.getenv("LLM_STAGE_MODELS", "")
+
+# YouTube
+YOUTUBE_BASE_URL = os.getenv("YOUTUBE_BASE_URL", "https://www.youtube.com")
+YOUTUBE_MAX_CONNECTIONS = int(os.getenv("YOUTUBE_MAX_CONNECTIONS", "10"))
+YOUTUBE_MAX_CONCURRENCY = int(os.getenv("YOUTUBE_MAX_CONCURRENCY", "5"))
+YOUTUBE_TIMEOUT_SECONDS = float(os.getenv("YOUTUBE_TIMEOUT_SECONDS", "10"))
+YOUTUBE_TIMEOUT_BUDGET_SECONDS = float(os.getenv("YOUTUBE_TIMEOUT_BUDGET_SECONDS", "30"))
+YOUTUBE_RETRIES = int(os.getenv("YOUTUBE_RETRIES", "2"))
+
+# Global LLM limits shared by every request in the process (0 tokens per minute disables the budget).
+# The concurrency limit adapts between the min and max: it grows while requests succeed and halves on 429s.
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", "8"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LIMITS_PATH = os.getenv("LIMITS_PATH", os.path.join(DATA_DIR, "limits.sqlite3"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "60"))
+
+# Transcription error detection: "candidates" sends the LLM only locally flagged words with
+# short excerpts, "full" sends the whole transcript
+TRANSCRIPTION_ERROR_MODE = os.getenv("TRANSCRIPTION_ERROR_MODE", "candidates")
+TRANSCRIPTION_ERROR_MAX_CANDIDATES = int(os.getenv("TRANSCRIPTION_ERROR_MAX_CANDIDATES", "40"))
+SPELLING_DICTIONARY_PATH = os.getenv("SPELLING_DICTIONARY_PATH", "/usr/share/dict/words")
+
+# Responses: gzip bodies of at least COMPRESSION_MIN_BYTES, and send JSON with at least
+# STREAMING_JSON_MIN_BYTES of text one field at a time
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1000"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+STREAMING_JSON_MIN_BYTES = int(os.getenv("STREAMING_JSON_MIN_BYTES", str(64 * 1024)))
+
+# Batch processing
+BATCH_MAX_CONCURRENT_VIDEOS = int(os.getenv("BATCH_MAX_CONCURRENT_VIDEOS", "3"))
+
+# Transcripts longer than SECTION_CHUNKING_MIN_TOKENS send each section summary only its
+# own excerpt, built from chunks of about TRANSCRIPT_CHUNK_TOKENS
+SECTION_CHUNKING_MIN_TOKENS = int(os.getenv("SECTION_CHUNKING_MIN_TOKENS", "8000"))
+TRANSCRIPT_CHUNK_TOKENS = int(os.getenv("TRANSCRIPT_CHUNK_TOKENS", "1000"))
+
+# Transcripts longer than MAP_REDUCE_MIN_TOKENS are too long to outline or mine for vocabulary
+# in one call. They are split into chunks of about MAP_REDUCE_CHUNK_TOKENS that are processed in
+# parallel; the partial outlines are then merged into one of at most MAP_REDUCE_MAX_SECTIONS sections.
+MAP_REDUCE_MIN_TOKENS = int(os.getenv("MAP_REDUCE_MIN_TOKENS", "60000"))
+MAP_REDUCE_CHUNK_TOKENS = int(os.getenv("MAP_REDUCE_CHUNK_TOKENS", "12000"))
+MAP_REDUCE_MAX_SECTIONS = int(os.getenv("MAP_REDUCE_MAX_SECTIONS", "15"))
+
+# Add other configurations as needed
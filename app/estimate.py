@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import math
+
+from app.config import (
+    SECTION_CHUNKING_MIN_TOKENS,
+    TRANSCRIPT_CHUNK_TOKENS,
+    MAP_REDUCE_MIN_TOKENS,
+    MAP_REDUCE_CHUNK_TOKENS
+)
+from app.llm import model_pricing
+from app.routing import LLM_STAGES, SUMMARY_STAGES, stage_model
+from app.services import (
+    OUTLINE_FUNCTIONS,
+    TRANSCRIPTION_ERROR_FUNCTIONS,
+    build_transcription_error_messages,
+    build_outline_messages,
+    build_merge_outline_messages,
+    build_summary_messages,
+    build_tldr_messages,
+    build_vocabulary_messages
+)
+from app.stages import video_details_stage, transcription_stage
+from app.tokenizer import count_tokens, count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Typical completion lengths per call; the prompts are measured, these have to be assumed
+EXPECTED_COMPLETION_TOKENS = {
+    "errors": 300,
+    "outline": 600,
+    "summary": 600,
+    "tldr": 120,
+    "vocabulary": 700,
+}
+# Outlines come back with roughly one section per this many transcript tokens
+TRANSCRIPT_TOKENS_PER_SECTION = 1500
+MIN_SECTIONS = 3
+MAX_SECTIONS = 12
+OUTLINE_TOKENS_PER_SECTION = 40
+# OpenAI only caches prompt prefixes of at least this many tokens
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+# Cheaper model to fall back to when a run would exceed its max_cost
+COST_DOWNGRADES = {"gpt-4o": "gpt-4o-mini"}
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, estimate, max_cost):
+        super().__init__(f"Estimated cost ${estimate['cost']:.4f} exceeds max_cost ${max_cost:.4f}")
+        self.estimate = estimate
+        self.max_cost = max_cost
+
+
+def _stage_estimate(model, calls, prompt_tokens, completion_tokens, cached_tokens=0):
+    costs = model_pricing(model)
+    cost = (prompt_tokens - cached_tokens) * costs["input"] / 1000
+    cost += cached_tokens * costs.get("cached_input", costs["input"]) / 1000
+    cost += completion_tokens * costs["output"] / 1000
+    return {
+        "model": model,
+        "calls": calls,
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "completion_tokens": completion_tokens,
+        "cost": cost,
+    }
+
+
+def estimate_pipeline(video_title, video_author, transcription, model, models=None):
+    """Predict tokens and dollars for each LLM stage of the YouTube notes pipeline.
+
+    Prompts are built with the same functions the pipeline uses and tokenized locally. Outputs
+    that do not exist yet (errors, outline, summaries) are sized from typical completions.
+    `models` overrides the model for individual stages, on top of LLM_STAGE_MODELS.
+    """
+    stages = {}
+    transcript_tokens = count_tokens(transcription)
+    sections = min(MAX_SECTIONS, max(MIN_SECTIONS, round(transcript_tokens / TRANSCRIPT_TOKENS_PER_SECTION)))
+
+    error_messages = build_transcription_error_messages(video_title, transcription)
+    if error_messages is None:
+        errors_tokens = count_tokens(json.dumps({"errors": []}))
+    else:
+        stages["errors"] = _stage_estimate(
+            stage_model("errors", model, models), 1,
+            count_message_tokens(error_messages) + count_tokens(json.dumps(TRANSCRIPTION_ERROR_FUNCTIONS)),
+            EXPECTED_COMPLETION_TOKENS["errors"]
+        )
+        errors_tokens = EXPECTED_COMPLETION_TOKENS["errors"] // 2
+
+    # Very long transcripts are outlined and mined for vocabulary chunk by chunk, and the partial
+    # outlines merged (counted here as a single merge call)
+    chunks = 1
+    if transcript_tokens >= MAP_REDUCE_MIN_TOKENS:
+        chunks = math.ceil(transcript_tokens / MAP_REDUCE_CHUNK_TOKENS)
+    outline_overhead = (
+        count_message_tokens(build_outline_messages(video_title, video_author, "", {}))
+        + errors_tokens + count_tokens(json.dumps(OUTLINE_FUNCTIONS))
+    )
+    outline_prompt = outline_overhead * chunks + transcript_tokens
+    outline_calls = chunks
+    if chunks > 1:
+        outline_prompt += (
+            count_message_tokens(build_merge_outline_messages(video_title, video_author, []))
+            + count_tokens(json.dumps(OUTLINE_FUNCTIONS)) + EXPECTED_COMPLETION_TOKENS["outline"] * chunks
+        )
+        outline_calls += 1
+    stages["outline"] = _stage_estimate(
+        stage_model("outline", model, models), outline_calls, outline_prompt,
+        EXPECTED_COMPLETION_TOKENS["outline"] * outline_calls
+    )
+
+    # Long transcripts send each section its excerpt; short ones send every section the whole
+    # transcript, which is then a shared prefix the provider can cache after the first section
+    chunked = transcript_tokens >= SECTION_CHUNKING_MIN_TOKENS
+    section_tokens = transcript_tokens // sections + TRANSCRIPT_CHUNK_TOKENS if chunked else transcript_tokens
+    outline_tokens = sections * OUTLINE_TOKENS_PER_SECTION
+    summary_tokens = EXPECTED_COMPLETION_TOKENS["summary"]
+    first_messages = build_summary_messages(video_title, video_author, "", {}, "", 1, None)
+    first_prompt = count_message_tokens(first_messages) + section_tokens + errors_tokens + outline_tokens
+    stages["first_summary"] = _stage_estimate(stage_model("first_summary", model, models), 1, first_prompt, summary_tokens)
+
+    other_sections = sections - 1
+    later_prompt = (
+        count_message_tokens(build_summary_messages(video_title, video_author, "", {}, "", 2, "x"))
+        + section_tokens + errors_tokens + outline_tokens + summary_tokens
+    )
+    # Everything before the final instruction is shared by all sections of an unchunked video
+    cached_prefix = 0 if chunked else first_prompt - count_message_tokens(first_messages[-1:])
+    if cached_prefix < MIN_CACHED_PREFIX_TOKENS:
+        cached_prefix = 0
+    stages["summaries"] = _stage_estimate(
+        stage_model("summaries", model, models), other_sections, later_prompt * other_sections,
+        summary_tokens * other_sections, cached_prefix * other_sections
+    )
+
+    combined_tokens = summary_tokens * sections
+    stages["tldr"] = _stage_estimate(
+        stage_model("tldr", model, models), 1,
+        count_message_tokens(build_tldr_messages("")) + combined_tokens,
+        EXPECTED_COMPLETION_TOKENS["tldr"]
+    )
+    vocabulary_prompt = count_message_tokens(build_vocabulary_messages("", {}, "")) + errors_tokens
+    if chunks > 1:
+        vocabulary_prompt = vocabulary_prompt * chunks + transcript_tokens
+    else:
+        vocabulary_prompt += transcript_tokens + combined_tokens
+    stages["vocabulary"] = _stage_estimate(
+        stage_model("vocabulary", model, models), chunks, vocabulary_prompt,
+        EXPECTED_COMPLETION_TOKENS["vocabulary"] * chunks
+    )
+
+    return {
+        "model": model,
+        "sections": sections,
+        "transcript_tokens": transcript_tokens,
+        "stages": stages,
+        "cost": sum(stage["cost"] for stage in stages.values()),
+    }
+
+
+async def estimate_video(video_id, model, models=None):
+    details = await video_details_stage(video_id)
+    transcription = await transcription_stage(video_id)
+    return await asyncio.to_thread(
+        estimate_pipeline, details["title"], details["channel"], transcription, model, models
+    )
+
+
+async def plan_within_budget(video_id, model, max_cost, models=None):
+    """Return the per-stage models that keep a run under max_cost, and their estimate.
+
+    The requested routing is tried first, then with the summary fan-out (the bulk of the calls)
+    moved to cheaper models, then with every stage moved. Raises BudgetExceeded if none of them fit.
+    """
+    models = models or {}
+
+    def downgraded(stages):
+        plan = dict(models)
+        for stage in stages:
+            current = stage_model(stage, model, models)
+            if current in COST_DOWNGRADES:
+                plan[stage] = COST_DOWNGRADES[current]
+        return plan
+
+    plans = [models]
+    for plan in (downgraded(SUMMARY_STAGES), downgraded(LLM_STAGES)):
+        if plan != plans[-1]:
+            plans.append(plan)
+    for plan in plans:
+        estimate = await estimate_video(video_id, model, plan)
+        if estimate["cost"] <= max_cost:
+            moved = [stage for stage in plan if plan[stage] != models.get(stage)]
+            if moved:
+                logger.info(f"Moved {', '.join(moved)} to cheaper models to stay under ${max_cost:.4f}")
+            return plan, estimate
+    raise BudgetExceeded(estimate, max_cost)
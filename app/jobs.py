@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+from app.config import JOBS_PATH, JOB_WORKERS, JOB_POLL_SECONDS, JOB_HEARTBEAT_SECONDS, JOB_STALE_SECONDS
+from app.pipeline import youtube_notes_pipeline, full_process
+from app.usage import current_api_key
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    """Persists jobs in SQLite so queued and in-flight work survives a restart and is shared by
+    every server process. Running jobs record the process that owns them and its last heartbeat."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    progress TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    owner TEXT,
+                    heartbeat_at REAL,
+                    api_key TEXT
+                )"""
+            )
+            # Job databases created before jobs had owners or API keys
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("heartbeat_at", "REAL"), ("api_key", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def create(self, video_id, model, api_key=None):
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "video_id": video_id,
+            "model": model,
+            "api_key": api_key,
+            "progress": {"completed_stages": [], "total_stages": len(youtube_notes_pipeline.stages), "timings": {}},
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._execute(
+            "INSERT INTO jobs (id, status, video_id, model, progress, created_at, updated_at, api_key) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job["id"], job["status"], video_id, model, json.dumps(job["progress"]), now, now, api_key),
+        )
+        return job
+
+    def get(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT id, status, video_id, model, progress, result, error, created_at, updated_at, api_key "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "video_id": row[2],
+            "model": row[3],
+            "api_key": row[9],
+            "progress": json.loads(row[4]),
+            "result": json.loads(row[5]) if row[5] else None,
+            "error": row[6],
+            "created_at": row[7],
+            "updated_at": row[8],
+        }
+
+    def claim_next(self, owner):
+        """Move the oldest queued job to running for `owner` and return its id, or None if none are queued."""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            # The write lock is taken before reading, so two processes can never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row:
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                    (owner, now, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def heartbeat(self, owner, job_ids):
+        """Mark `job_ids` as still being worked on by `owner`. Jobs left out go stale and are re-queued."""
+        if not job_ids:
+            return
+        placeholders = ", ".join("?" * len(job_ids))
+        self._execute(
+            f"UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = 'running' AND id IN ({placeholders})",
+            (time.time(), owner, *job_ids),
+        )
+
+    def set_progress(self, job_id, progress):
+        self._execute(
+            "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(progress), time.time(), job_id),
+        )
+
+    def complete(self, job_id, result):
+        self._execute(
+            "UPDATE jobs SET status = 'completed', result = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id),
+        )
+
+    def fail(self, job_id, error):
+        self._execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+            (error, time.time(), job_id),
+        )
+
+    def requeue(self, job_id):
+        self._execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL WHERE id = ? AND status = 'running'", (job_id,)
+        )
+
+    def release(self, owner):
+        """Put the jobs `owner` is running back in the queue, e.g. when its process shuts down."""
+        return self._execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL WHERE owner = ? AND status = 'running'", (owner,)
+        )
+
+    def requeue_stale(self, stale_seconds):
+        """Re-queue running jobs whose owner has not sent a heartbeat for `stale_seconds`."""
+        return self._execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL "
+            "WHERE status = 'running' AND COALESCE(heartbeat_at, updated_at) < ?",
+            (time.time() - stale_seconds,),
+        )
+
+
+class JobQueue:
+    """Bounded pool of asyncio workers draining full_process jobs from the shared store.
+
+    Workers claim jobs from the store rather than an in-memory queue, so with several server
+    processes a job submitted to one can run in any of them.
+    """
+
+    def __init__(self, store, workers):
+        self.store = store
+        self.workers = workers
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = None
+        self._tasks = []
+        # Jobs this process is working on; only these get heartbeats
+        self._running = set()
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        stale = await asyncio.to_thread(self.store.requeue_stale, JOB_STALE_SECONDS)
+        if stale:
+            logger.info(f"Re-queued {stale} jobs whose worker stopped responding")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        logger.info(f"Started {self.workers} job workers as {self.owner}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Hand unfinished jobs back so another process (or the next start) picks them up right away
+        released = await asyncio.to_thread(self.store.release, self.owner)
+        if released:
+            logger.info(f"Released {released} unfinished jobs")
+
+    async def submit(self, video_id, model):
+        job = await asyncio.to_thread(self.store.create, video_id, model, current_api_key.get())
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(f"Queued job {job['id']} for video {video_id}")
+        return job
+
+    async def _worker(self, worker_number):
+        while True:
+            try:
+                self._wakeup.clear()
+                job_id = await asyncio.to_thread(self.store.claim_next, self.owner)
+                if job_id is None:
+                    # Jobs submitted to another process only show up on the next poll
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # e.g. "database is locked" while other processes hold the job store; keep the worker alive
+                logger.exception(f"Job worker {worker_number} failed, retrying in {JOB_POLL_SECONDS}s")
+                await asyncio.sleep(JOB_POLL_SECONDS)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, self.owner, list(self._running))
+                stale = await asyncio.to_thread(self.store.requeue_stale, JOB_STALE_SECONDS)
+                if stale:
+                    logger.warning(f"Re-queued {stale} jobs whose worker stopped responding")
+                    self._wakeup.set()
+            except sqlite3.Error as e:
+                logger.error(f"Job heartbeat failed: {e}")
+
+    async def _run(self, job_id):
+        self._running.add(job_id)
+        try:
+            await self._process(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The job store failed while the job was ours; hand it back rather than leave it running
+            logger.exception(f"Job {job_id} could not be tracked in the job store, re-queueing it")
+            try:
+                await asyncio.to_thread(self.store.requeue, job_id)
+            except sqlite3.Error as e:
+                # Without heartbeats it goes stale and another worker re-queues it
+                logger.error(f"Re-queueing job {job_id} failed: {e}")
+        finally:
+            self._running.discard(job_id)
+
+    async def _process(self, job_id):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        progress = job["progress"]
+        # A re-queued job starts over
+        progress["completed_stages"] = []
+
+        # Progress is written in the background, one write at a time and in stage order
+        saves = []
+        save_lock = asyncio.Lock()
+
+        async def save_progress(snapshot):
+            async with save_lock:
+                # Progress is informational; a busy job store must not fail the run
+                try:
+                    await asyncio.to_thread(self.store.set_progress, job_id, snapshot)
+                except sqlite3.Error as e:
+                    logger.warning(f"Saving progress of job {job_id} failed: {e}")
+
+        def on_stage_complete(stage_name, run):
+            progress["completed_stages"].append(stage_name)
+            progress["timings"] = dict(run.timings)
+            snapshot = {**progress, "completed_stages": list(progress["completed_stages"])}
+            saves.append(asyncio.ensure_future(save_progress(snapshot)))
+
+        logger.info(f"Running job {job_id} for video {job['video_id']}")
+        # Charge the job's LLM calls to the key that submitted it
+        token = current_api_key.set(job["api_key"] or current_api_key.get())
+        try:
+            result = await full_process(job["video_id"], job["model"], on_stage_complete=on_stage_complete)
+        except asyncio.CancelledError:
+            # Shutting down: stop() hands the job back to the queue
+            for save in saves:
+                save.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            await asyncio.gather(*saves)
+            await asyncio.to_thread(self.store.fail, job_id, str(e))
+            return
+        finally:
+            current_api_key.reset(token)
+        await asyncio.gather(*saves)
+        try:
+            await asyncio.to_thread(self.store.complete, job_id, result)
+        except Exception as e:
+            logger.exception(f"Saving the result of job {job_id} failed")
+            await asyncio.to_thread(self.store.fail, job_id, f"Could not save result: {e}")
+            return
+        logger.info(f"Job {job_id} completed")
+
+
+job_queue = JobQueue(JobStore(JOBS_PATH), JOB_WORKERS)
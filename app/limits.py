@@ -0,0 +1,243 @@
+import asyncio
+import contextlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from app.config import (
+    LLM_MIN_CONCURRENCY,
+    LLM_INITIAL_CONCURRENCY,
+    LLM_MAX_CONCURRENCY,
+    LLM_TOKENS_PER_MINUTE,
+    LOCAL_LLM_MAX_CONCURRENCY,
+    LIMITS_PATH
+)
+from app.metrics import llm_concurrency_limit
+
+logger = logging.getLogger(__name__)
+
+
+class SharedLimitState:
+    """Rate-limit state in a small SQLite table, shared by every worker process on the host.
+
+    `get` and `update` run in a thread on one reused connection, so waiting for another process's
+    write lock never blocks the event loop.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS rate_limits (
+                    name TEXT PRIMARY KEY,
+                    value REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+        finally:
+            conn.close()
+
+    def _connection(self):
+        # Opened on first use so each worker process gets its own
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        return self._conn
+
+    def _get(self, name, default):
+        with self._conn_lock:
+            row = self._connection().execute("SELECT value FROM rate_limits WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def _update(self, name, default, update):
+        with self._conn_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT value, updated_at FROM rate_limits WHERE name = ?", (name,)).fetchone()
+                value, updated_at = row if row else (default, now)
+                new_value, result = update(value, updated_at, now)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (name, value, updated_at) VALUES (?, ?, ?)",
+                    (name, new_value, now),
+                )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    async def get(self, name, default):
+        return await asyncio.to_thread(self._get, name, default)
+
+    async def update(self, name, default, update):
+        """Atomically replace the value with `update(value, updated_at, now)[0]` and return the second item."""
+        return await asyncio.to_thread(self._update, name, default, update)
+
+
+class TokenBucket:
+    """Token-per-minute budget shared by all worker processes. Callers wait until enough budget has refilled."""
+
+    def __init__(self, state, name, tokens_per_minute):
+        self.state = state
+        self.name = name
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self._lock = asyncio.Lock()
+
+    def _available(self, tokens, updated_at, now):
+        return min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+    async def acquire(self, tokens):
+        if self.capacity <= 0:
+            return
+        # A single request larger than the whole budget only has to wait for a full bucket
+        tokens = min(tokens, self.capacity)
+
+        def take(value, updated_at, now):
+            available = self._available(value, updated_at, now)
+            if available >= tokens:
+                return available - tokens, 0.0
+            return available, (tokens - available) / self.rate
+
+        async with self._lock:
+            while True:
+                wait = await self.state.update(self.name, self.capacity, take)
+                if wait <= 0:
+                    return
+                logger.info(f"Token budget exhausted, waiting {wait:.1f}s")
+                await asyncio.sleep(wait)
+
+    async def adjust(self, tokens):
+        """Debit (or refund, if negative) the difference between estimated and actual usage."""
+        if self.capacity <= 0:
+            return
+        await self.state.update(
+            self.name, self.capacity,
+            lambda value, updated_at, now: (self._available(value, updated_at, now) - tokens, None)
+        )
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: one extra slot per window of successful calls, halved on rate limiting.
+
+    The limit is per process. A rate-limited response also pauses callers in every worker process
+    until the server says it is safe to continue; other processes' pauses are picked up within
+    PAUSE_REFRESH_SECONDS.
+    """
+
+    PAUSE_REFRESH_SECONDS = 1.0
+
+    def __init__(self, state, initial, minimum, maximum, name="llm", gauge=None):
+        self.state = state
+        self.name = name
+        self.gauge = gauge
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self._waiters = deque()
+        self._paused_until = 0.0
+        self._paused_checked_at = 0.0
+        if gauge:
+            gauge.set(int(self.limit))
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def _acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass a wake-up we were given but can no longer use on to the next waiter
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        await self._acquire()
+        try:
+            wait = await self.paused_until() - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield
+        finally:
+            self._release()
+
+    def _set_limit(self, limit):
+        self.limit = limit
+        if self.gauge:
+            self.gauge.set(int(limit))
+
+    def on_success(self):
+        if self.limit < self.maximum:
+            self._set_limit(min(self.maximum, self.limit + 1 / self.limit))
+            self._wake()
+
+    async def on_rate_limited(self, delay):
+        # 429s that arrive while we are already backing off belong to the same overload
+        if time.time() >= await self.paused_until():
+            self._set_limit(max(self.minimum, self.limit / 2))
+            logger.warning(f"Rate limited, {self.name} concurrency limit lowered to {int(self.limit)}")
+        await self.pause(delay)
+
+    async def paused_until(self):
+        now = time.time()
+        if now - self._paused_checked_at >= self.PAUSE_REFRESH_SECONDS:
+            self._paused_checked_at = now
+            shared = await self.state.get(f"{self.name}_paused_until", 0.0)
+            self._paused_until = max(self._paused_until, shared)
+        return self._paused_until
+
+    async def pause(self, delay):
+        self._paused_until = max(self._paused_until, time.time() + delay)
+        await self.state.update(
+            f"{self.name}_paused_until", 0.0, lambda value, updated_at, now: (max(value, now + delay), None)
+        )
+
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+
+
+def parse_duration(value):
+    """Parse OpenAI-style reset durations such as "1s", "6m0s" or "250ms" into seconds."""
+    matches = DURATION_PATTERN.findall(value or "")
+    if not matches:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in matches)
+
+
+limit_state = SharedLimitState(LIMITS_PATH)
+llm_limiter = AdaptiveLimiter(
+    limit_state, LLM_INITIAL_CONCURRENCY, LLM_MIN_CONCURRENCY, LLM_MAX_CONCURRENCY, gauge=llm_concurrency_limit
+)
+token_budget = TokenBucket(limit_state, "llm_tokens", LLM_TOKENS_PER_MINUTE)
+# A local server is bounded by its own hardware, so it gets a fixed concurrency limit and no token budget
+local_llm_limiter = AdaptiveLimiter(
+    limit_state, LOCAL_LLM_MAX_CONCURRENCY, LOCAL_LLM_MAX_CONCURRENCY, LOCAL_LLM_MAX_CONCURRENCY, name="local_llm"
+)
+local_token_budget = TokenBucket(limit_state, "local_llm_tokens", 0)
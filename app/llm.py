@@ -0,0 +1,302 @@
+import json
+import asyncio
+import logging
+import random
+import httpx
+
+from app.config import (
+    model_costs,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_TIMEOUT_SECONDS,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_KEEPALIVE_EXPIRY,
+    LOCAL_LLM_BASE_URL,
+    LOCAL_LLM_API_KEY,
+    LOCAL_LLM_TIMEOUT_SECONDS,
+    LOCAL_LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_SECONDS,
+    LLM_RETRY_MAX_SECONDS
+)
+from app.limits import (
+    llm_limiter,
+    token_budget,
+    local_llm_limiter,
+    local_token_budget,
+    parse_duration
+)
+from app.tokenizer import count_tokens, count_message_tokens
+from app.metrics import record_llm_usage, llm_retries, current_stage
+from app.usage import usage_ledger, current_api_key
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+FREE_MODEL_COSTS = {"input": 0.0, "cached_input": 0.0, "output": 0.0}
+
+
+class Backend:
+    """An OpenAI-compatible /chat/completions server with its own connection pool and limits.
+
+    `costs` maps model names to per-1K-token prices; None means the backend's models are free.
+    """
+
+    def __init__(self, name, base_url, api_key, timeout, max_connections, limiter, token_budget, costs=None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.limiter = limiter
+        self.token_budget = token_budget
+        self.costs = costs
+        self._client = None
+
+    def client(self):
+        """Return the backend's process-wide pooled client, creating it on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                # Local servers usually run without a key
+                headers={"Authorization": f"Bearer {self.api_key}"} if self.api_key else None,
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=min(self.max_connections, OPENAI_MAX_KEEPALIVE_CONNECTIONS),
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+                )
+            )
+            logger.info(f"Created {self.name} HTTP client (max_connections={self.max_connections})")
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+BACKENDS = {
+    "openai": Backend(
+        "openai", OPENAI_BASE_URL, OPENAI_API_KEY, OPENAI_TIMEOUT_SECONDS,
+        OPENAI_MAX_CONNECTIONS, llm_limiter, token_budget, costs=model_costs
+    ),
+}
+if LOCAL_LLM_BASE_URL:
+    BACKENDS["local"] = Backend(
+        "local", LOCAL_LLM_BASE_URL, LOCAL_LLM_API_KEY, LOCAL_LLM_TIMEOUT_SECONDS,
+        LOCAL_LLM_MAX_CONCURRENCY, local_llm_limiter, local_token_budget
+    )
+
+
+def resolve_model(model):
+    """Return the backend serving `model` and the model name to send it.
+
+    "local/llama3.1:8b" goes to the local server as "llama3.1:8b"; names without a backend prefix go to OpenAI.
+    """
+    prefix, _, name = model.partition("/")
+    if name and prefix in BACKENDS:
+        return BACKENDS[prefix], name
+    return BACKENDS["openai"], model
+
+
+def check_model(model):
+    """Raise ValueError unless some configured backend can serve (and price) `model`."""
+    if model.startswith("local/") and "local" not in BACKENDS:
+        raise ValueError(f"Model {model!r} needs a local server; set LOCAL_LLM_BASE_URL")
+    backend, name = resolve_model(model)
+    if backend.costs is not None and name not in backend.costs:
+        raise ValueError(f"Unknown model {model!r}")
+
+
+def model_pricing(model):
+    """Per-1K-token prices for `model`; models on a free backend (the local server) cost nothing."""
+    backend, name = resolve_model(model)
+    return FREE_MODEL_COSTS if backend.costs is None else backend.costs[name]
+
+
+def cached_prompt_tokens(usage):
+    return (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+
+def usage_cost(model, usage, costs=None):
+    """Dollars for one call's usage block, at `costs` or the backend's prices for `model`."""
+    # Prompt tokens served from the provider's prompt cache are billed at the cached input rate
+    costs = costs or model_pricing(model)
+    cached_tokens = cached_prompt_tokens(usage)
+    input_cost = (usage["prompt_tokens"] - cached_tokens) * costs["input"] / 1000
+    input_cost += cached_tokens * costs.get("cached_input", costs["input"]) / 1000
+    return input_cost + usage["completion_tokens"] * costs["output"] / 1000
+
+
+async def close_client():
+    for backend in BACKENDS.values():
+        await backend.close()
+
+
+def retry_after(headers):
+    """Seconds the server asked us to wait, from Retry-After or the rate-limit reset headers."""
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    resets = [
+        parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+        for kind in ("requests", "tokens")
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0"
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def _record_usage(model, usage):
+    record_llm_usage(model, usage)
+    usage_ledger.record(current_stage.get(), model, usage, usage_cost(model, usage))
+
+
+async def _observe_rate_limit_headers(backend, headers):
+    # Stop sending before the server starts rejecting once the current window is used up
+    delay = retry_after(headers)
+    if delay:
+        logger.info(f"Rate limit window exhausted, pausing {backend.name} requests for {delay:.1f}s")
+        await backend.limiter.pause(delay)
+
+
+def _is_quota_error(response):
+    # An exhausted account also answers 429, but retrying will not help
+    try:
+        return response.json().get("error", {}).get("code") == "insufficient_quota"
+    except (ValueError, AttributeError, httpx.ResponseNotRead):
+        return False
+
+
+async def _with_retries(backend, model, attempt, can_retry=lambda: True):
+    """Run `attempt` under the adaptive concurrency limit, retrying rate limits, server errors and
+    dropped connections with jittered exponential backoff (or the delay the server asked for)."""
+    for attempt_number in range(LLM_MAX_RETRIES + 1):
+        delay = None
+        try:
+            async with backend.limiter.slot():
+                result = await attempt()
+            backend.limiter.on_success()
+            return result
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            if status not in RETRY_STATUS_CODES or _is_quota_error(e.response):
+                raise
+            error, reason = e, str(status)
+            delay = retry_after(e.response.headers)
+            if status == 429:
+                await backend.limiter.on_rate_limited(delay or LLM_RETRY_BASE_SECONDS)
+        except httpx.TransportError as e:
+            error, reason = e, "transport"
+        if attempt_number == LLM_MAX_RETRIES or not can_retry():
+            raise error
+        if delay is None:
+            delay = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt_number))
+        else:
+            # Spread callers that were all told the same Retry-After
+            delay = min(LLM_RETRY_MAX_SECONDS, delay + random.uniform(0, LLM_RETRY_BASE_SECONDS))
+        llm_retries.inc(stage=current_stage.get(), model=model, reason=reason)
+        logger.warning(f"Chat completion failed ({error!r}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+def _estimated_usage(prompt_tokens, content):
+    # Not every OpenAI-compatible server reports usage, and callers price every response
+    completion_tokens = count_tokens(content)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+async def chat_completion(model, messages, **kwargs):
+    """POST to /chat/completions and return the decoded JSON response, which always has a `usage` block.
+
+    The request goes to the backend serving `model`, gated by that backend's concurrency limit and
+    token-per-minute budget.
+    """
+    # A run that is already under way stops as soon as its key runs out of quota
+    usage_ledger.check_quota(current_api_key.get())
+    backend, name = resolve_model(model)
+    payload = {"model": name, "messages": messages, **kwargs}
+    # Counting a long prompt takes milliseconds, so it happens off the event loop
+    estimated_tokens = await asyncio.to_thread(count_message_tokens, messages)
+    await backend.token_budget.acquire(estimated_tokens)
+
+    async def attempt():
+        response = await backend.client().post("/chat/completions", json=payload)
+        response.raise_for_status()
+        await _observe_rate_limit_headers(backend, response.headers)
+        return response
+
+    response = await _with_retries(backend, model, attempt)
+    data = response.json()
+    if not data.get("usage"):
+        content = "".join((choice.get("message") or {}).get("content") or "" for choice in data.get("choices", []))
+        data["usage"] = _estimated_usage(estimated_tokens, content)
+    usage = data["usage"]
+    await backend.token_budget.adjust(usage["total_tokens"] - estimated_tokens)
+    _record_usage(model, usage)
+    return data
+
+
+async def stream_chat_content(model, messages, on_delta, **kwargs):
+    """Stream a chat completion, calling on_delta with each content fragment.
+
+    Returns the full content and the usage block reported by the final chunk.
+    """
+    usage_ledger.check_quota(current_api_key.get())
+    backend, name = resolve_model(model)
+    payload = {
+        "model": name,
+        "messages": messages,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+        **kwargs
+    }
+    estimated_tokens = await asyncio.to_thread(count_message_tokens, messages)
+    await backend.token_budget.acquire(estimated_tokens)
+    parts = []
+    usage = None
+
+    async def attempt():
+        nonlocal usage
+        async with backend.client().stream("POST", "/chat/completions", json=payload) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()
+            await _observe_rate_limit_headers(backend, response.headers)
+            async for line in response.aiter_lines():
+                line = line.strip()
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                for choice in chunk.get("choices", []):
+                    delta = choice.get("delta", {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        on_delta(delta)
+
+    # Once fragments have reached on_delta a retry would repeat them, so only retry before the first one
+    await _with_retries(backend, model, attempt, can_retry=lambda: not parts)
+    content = "".join(parts)
+    if usage is None:
+        usage = _estimated_usage(estimated_tokens, content)
+    await backend.token_budget.adjust(usage["total_tokens"] - estimated_tokens)
+    _record_usage(model, usage)
+    return content, usage
@@ -1,35 +1,79 @@
+from secrets import compare_digest
+
 from fastapi import FastAPI, Depends, HTTPException, Security
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.security import HTTPBearer
 from fastapi.security.api_key import APIKeyHeader, APIKey
+from app.config import API_KEY, API_KEYS, METRICS_TOKEN
 from app.api import router as api_router
-from dotenv import load_dotenv
-import os
+from app.llm import close_client
+from app.utils import close_youtube_client
+from app.jobs import job_queue
+from app.metrics import render_metrics
+from app.responses import CompressionMiddleware
+from app.usage import usage_ledger, current_api_key, QuotaExceeded
 import logging
 
-load_dotenv()
-
-# Configure logging based on environment
-log_level = os.getenv("LOG_LEVEL", "INFO").upper()
-logging.basicConfig(level=log_level)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Personal Automation API", description="API for personal automations")
+app.add_middleware(CompressionMiddleware)
 
-API_KEY = os.getenv("API_KEY")
 API_KEY_NAME = "X-API-Key"
 
-logger.info(f"Loaded API Key from environment: pkl-**********************{API_KEY[-4:]}")
+# Key name -> key. Usage is recorded under the name, never the key itself
+api_keys = {"default": API_KEY} if API_KEY else {}
+for entry in API_KEYS.split(","):
+    name, _, key = (part.strip() for part in entry.partition("="))
+    if name and key:
+        api_keys[name] = key
+
+if not api_keys:
+    logger.warning("Neither API_KEY nor API_KEYS is set; every API request will be rejected")
 
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 
 async def get_api_key(api_key_header: str = Security(api_key_header)):
-    logger.info(f"Received API Key: {api_key_header}")
-    logger.info(f"Expected API Key: {API_KEY}")
-    if api_key_header == API_KEY:
-        return api_key_header
+    if api_key_header:
+        for name, key in api_keys.items():
+            if compare_digest(api_key_header, key):
+                current_api_key.set(name)
+                return name
     raise HTTPException(status_code=403, detail="Could not validate credentials")
 
+metrics_bearer = HTTPBearer(auto_error=False)
+
+async def get_metrics_access(api_key_header: str = Security(api_key_header), credentials=Security(metrics_bearer)):
+    # Scrapers can send METRICS_TOKEN as a bearer token; anything else needs an API key
+    if METRICS_TOKEN and credentials and compare_digest(credentials.credentials, METRICS_TOKEN):
+        return
+    await get_api_key(api_key_header)
+
+# Raised by an LLM call in the middle of a run once the key's quota is used up
+@app.exception_handler(QuotaExceeded)
+async def quota_exceeded_handler(request, e):
+    return JSONResponse({"detail": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+
 app.include_router(api_router, dependencies=[Depends(get_api_key)])
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False, dependencies=[Depends(get_metrics_access)])
+async def metrics_endpoint():
+    return render_metrics()
+
+@app.on_event("startup")
+async def startup_event():
+    await usage_ledger.start(api_keys)
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_queue.stop()
+    await usage_ledger.stop()
+    await close_client()
+    await close_youtube_client()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=1621)
\ No newline at end of file
+    from app.config import WEB_CONCURRENCY
+    # Several worker processes need the app as an import string so each can load its own copy
+    uvicorn.run("app.main:app", host="0.0.0.0", port=1621, workers=WEB_CONCURRENCY)
\ No newline at end of file
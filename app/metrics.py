@@ -0,0 +1,189 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# The pipeline stage currently executing, so LLM calls can be attributed to it
+current_stage = contextvars.ContextVar("current_stage", default="none")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 200000)
+COST_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, buckets, label_names=()):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def render(self):
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge", f"{self.name} {self._value}"]
+
+
+stage_duration = Histogram(
+    "pipeline_stage_duration_seconds", "Time spent in each pipeline stage.", LATENCY_BUCKETS, ("stage", "model")
+)
+stage_errors = Counter("pipeline_stage_errors_total", "Pipeline stage calls that raised.", ("stage", "model"))
+stage_cost = Histogram(
+    "pipeline_stage_cost_dollars", "Dollars spent per pipeline stage call.", COST_BUCKETS, ("stage", "model")
+)
+llm_requests = Counter("llm_requests_total", "Chat completion requests sent.", ("stage", "model"))
+llm_retries = Counter("llm_retries_total", "Chat completion requests retried.", ("stage", "model", "reason"))
+llm_concurrency_limit = Gauge("llm_concurrency_limit", "Current adaptive limit on in-flight chat completions.")
+llm_prompt_tokens = Histogram(
+    "llm_prompt_tokens", "Prompt tokens per chat completion.", TOKEN_BUCKETS, ("stage", "model")
+)
+llm_completion_tokens = Histogram(
+    "llm_completion_tokens", "Completion tokens per chat completion.", TOKEN_BUCKETS, ("stage", "model")
+)
+llm_cached_tokens = Counter(
+    "llm_cached_prompt_tokens_total", "Prompt tokens served from the provider prompt cache.", ("stage", "model")
+)
+cache_requests = Counter("stage_cache_requests_total", "Stage cache lookups.", ("stage", "result"))
+coalesced_calls = Counter(
+    "stage_coalesced_total", "Stage calls that joined an identical call already in flight.", ("stage",)
+)
+
+REGISTRY = [
+    stage_duration, stage_errors, stage_cost, llm_requests, llm_retries, llm_concurrency_limit,
+    llm_prompt_tokens, llm_completion_tokens, llm_cached_tokens, cache_requests, coalesced_calls,
+]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def record_llm_usage(model, usage):
+    stage = current_stage.get()
+    llm_requests.inc(stage=stage, model=model)
+    llm_prompt_tokens.observe(usage["prompt_tokens"], stage=stage, model=model)
+    llm_completion_tokens.observe(usage["completion_tokens"], stage=stage, model=model)
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    if cached_tokens:
+        llm_cached_tokens.inc(cached_tokens, stage=stage, model=model)
+
+
+def instrument(stage):
+    """Record latency, errors and (for functions returning a trailing float cost) dollars for a stage.
+
+    LLM calls made inside the wrapped function are attributed to `stage`.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def model_of(args, kwargs):
+            try:
+                return signature.bind_partial(*args, **kwargs).arguments.get("model", "none")
+            except TypeError:
+                return "none"
+
+        def record(model, start, result):
+            stage_duration.observe(time.perf_counter() - start, stage=stage, model=model)
+            if isinstance(result, tuple) and result and isinstance(result[-1], float):
+                stage_cost.observe(result[-1], stage=stage, model=model)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                model = model_of(args, kwargs)
+                token = current_stage.set(stage)
+                start = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception:
+                    stage_errors.inc(stage=stage, model=model)
+                    raise
+                finally:
+                    current_stage.reset(token)
+                record(model, start, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            model = model_of(args, kwargs)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                stage_errors.inc(stage=stage, model=model)
+                raise
+            record(model, start, result)
+            return result
+        return wrapper
+    return decorator
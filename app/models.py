@@ -1,11 +1,13 @@
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, HttpUrl, constr
 from typing import List, Optional
 
+from app.transcripts import VIDEO_ID_PATTERN
+
 class YouTubeURL(BaseModel):
     url: HttpUrl
 
 class UserTakes(BaseModel):
-    video_id: str
+    video_id: constr(regex=VIDEO_ID_PATTERN.pattern)
     takes: str
 
 # New models for structured outputs
@@ -0,0 +1,413 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from functools import partial
+
+from app.config import SECTION_CHUNKING_MIN_TOKENS, TRANSCRIPT_CHUNK_TOKENS, TRANSCRIPTION_ERROR_MODE
+from app.cache import prompt_hash, run_manifests
+from app.chunking import section_transcripts
+from app.tokenizer import count_tokens
+from app.routing import stage_model
+from app.services import PromptFragments
+from app.stages import (
+    video_details_stage,
+    transcript_segments_stage,
+    transcription_errors_stage,
+    outline_stage,
+    summary_stage,
+    tldr_stage,
+    vocabulary_stage
+)
+from app.prompts import (
+    TRANSCRIPTION_ERROR_SYSTEM_PROMPT,
+    TRANSCRIPTION_CANDIDATES_SYSTEM_PROMPT,
+    GENERATE_OUTLINE_SYSTEM_PROMPT,
+    MERGE_OUTLINES_SYSTEM_PROMPT,
+    GENERATE_SUMMARY_SYSTEM_PROMPT,
+    GENERATE_TLDR_SYSTEM_PROMPT,
+    GENERATE_VOCABULARY_SYSTEM_PROMPT
+)
+
+logger = logging.getLogger(__name__)
+
+SECTION_FAILED_PLACEHOLDER = "_The summary for section {bullet_number} could not be generated. Try the request again._"
+
+
+@dataclass
+class Stage:
+    """A pipeline step. `func` receives the run context and returns a (value, cost) tuple.
+
+    Stages with a `fingerprint` function are versioned: their fingerprint covers whatever that
+    function returns from the context (model, prompt hashes, settings) plus the values of every
+    dependency, and a run given the previous outputs reuses any stage whose fingerprint matches.
+    Stages that are cheap to recompute or too large to keep leave it unset.
+
+    Dependency values are hashed whole. A stage whose value is large but derived from other values
+    can set `digest`, called as digest(context, dep_digest), to stand in for its value instead.
+    """
+    name: str
+    func: object
+    deps: tuple = ()
+    fingerprint: object = None
+    digest: object = None
+
+
+@dataclass
+class PipelineResult:
+    results: dict = field(default_factory=dict)
+    costs: dict = field(default_factory=dict)
+    timings: dict = field(default_factory=dict)
+    fingerprints: dict = field(default_factory=dict)
+    reused: list = field(default_factory=list)
+    incomplete: set = field(default_factory=set)
+
+    @property
+    def total_cost(self):
+        return sum(self.costs.values())
+
+    def __getitem__(self, name):
+        return self.results[name]
+
+    def manifest(self):
+        """Fingerprinted outputs to pass as `previous` to a later run. Partial outputs are left out."""
+        return {
+            name: {"fingerprint": fingerprint, "value": self.results[name]}
+            for name, fingerprint in self.fingerprints.items()
+            if name not in self.incomplete
+        }
+
+
+def value_digest(value):
+    payload = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Pipeline:
+    """Runs stages as soon as their dependencies finish, so independent stages overlap."""
+
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        self._validate()
+
+    def _validate(self):
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a dependency cycle through '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def run(self, on_stage_complete=None, previous=None, **inputs):
+        """Run every stage. `previous` is a manifest from an earlier run of the same video; stages
+        whose fingerprint is unchanged take their value from it instead of running."""
+        previous = previous or {}
+        result = PipelineResult()
+        context = dict(inputs, incomplete=result.incomplete)
+        tasks = {}
+        digests = {}
+
+        def digest(name):
+            if name not in digests:
+                stage = self.stages.get(name)
+                if stage and stage.digest:
+                    digests[name] = value_digest(stage.digest(context, digest))
+                else:
+                    digests[name] = value_digest(context[name])
+            return digests[name]
+
+        async def run_stage(stage):
+            if stage.deps:
+                await asyncio.gather(*(tasks[dep] for dep in stage.deps))
+            start = time.perf_counter()
+            fingerprint = None
+            if stage.fingerprint:
+                fingerprint = value_digest([
+                    stage.name, stage.fingerprint(context), [digest(dep) for dep in stage.deps]
+                ])
+                result.fingerprints[stage.name] = fingerprint
+            earlier = previous.get(stage.name)
+            if fingerprint and earlier and earlier["fingerprint"] == fingerprint:
+                value, cost = earlier["value"], 0.0
+                result.reused.append(stage.name)
+            else:
+                value, cost = await stage.func(context)
+            result.timings[stage.name] = round(time.perf_counter() - start, 3)
+            result.costs[stage.name] = cost
+            result.results[stage.name] = value
+            context[stage.name] = value
+            if on_stage_complete:
+                on_stage_complete(stage.name, result)
+            return value
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+        try:
+            await asyncio.gather(*tasks.values())
+        except Exception:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+        logger.info(f"Pipeline stage timings (seconds): {result.timings}")
+        return result
+
+
+def build_summary_content(video_id, video_title, tldr, vocabulary, combined_summaries):
+    summary_content = f"# {video_title}\n\n"
+    summary_content += f"<iframe width=\"560\" height=\"315\" src=\"https://www.youtube.com/embed/{video_id}\" frameborder=\"0\" allow=\"accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture\" allowfullscreen></iframe>\n\n"
+    summary_content += f"{tldr}\n\n## Key Vocabulary\n\n{vocabulary}\n\n{combined_summaries}"
+    return summary_content
+
+
+async def generate_summaries_async(video_id, video_title, video_author, section_transcriptions, transcription_errors, outline, num_bullets, first_summary, model, section_emitter=None, fragments=None):
+    logger.info("Starting asynchronous summary generation")
+
+    errors = []
+    fragments = fragments or PromptFragments(video_title, video_author, transcription_errors, outline)
+
+    async def run_section(bullet_number):
+        on_delta = partial(section_emitter.delta, bullet_number) if section_emitter else None
+        transcription = section_transcriptions[bullet_number - 1]
+        try:
+            result = await summary_stage(video_id, video_title, video_author, transcription, transcription_errors, outline, bullet_number, first_summary, model, on_delta=on_delta, fragments=fragments)
+        except Exception as e:
+            # One section failing after its retries should not throw away the others
+            logger.error(f"Summary for bullet {bullet_number} of {video_id} failed: {e!r}")
+            errors.append(e)
+            result = (SECTION_FAILED_PLACEHOLDER.format(bullet_number=bullet_number), 0.0)
+            if on_delta:
+                on_delta(result[0])
+        if section_emitter:
+            section_emitter.done(bullet_number)
+        return result
+
+    tasks = []
+    for i in range(2, num_bullets + 1):
+        tasks.append(run_section(i))
+    results = await asyncio.gather(*tasks)
+    if tasks and len(errors) == len(tasks):
+        raise errors[0]
+    return results, bool(errors)
+
+
+# YouTube notes stages
+
+def _model(ctx, stage):
+    return stage_model(stage, ctx["model"], ctx.get("models"))
+
+
+def _prompt_fragments(ctx):
+    # Built once per run so the first summary and the section fan-out share one set of prompt pieces
+    if "prompt_fragments" not in ctx:
+        details = ctx["details"]
+        ctx["prompt_fragments"] = PromptFragments(details["title"], details["channel"], ctx["errors"], ctx["outline"]["outline"])
+    return ctx["prompt_fragments"]
+
+
+async def _details(ctx):
+    details = await video_details_stage(ctx["video_id"])
+    if details["title"] == "Error Fetching Title":
+        ctx["incomplete"].add("details")
+    return details, 0.0
+
+
+async def _segments(ctx):
+    return await transcript_segments_stage(ctx["video_id"]), 0.0
+
+
+async def _transcript(ctx):
+    # The Transcript already holds the joined text; no second copy is made
+    return ctx["segments"].text, 0.0
+
+
+async def _errors(ctx):
+    errors, cost = await transcription_errors_stage(ctx["video_id"], ctx["details"]["title"], ctx["transcript"], _model(ctx, "errors"))
+    # A failed call comes back as {}; a video without errors is {"errors": []}
+    if not errors:
+        ctx["incomplete"].add("errors")
+    return errors, cost
+
+
+async def _outline(ctx):
+    details = ctx["details"]
+    outline, num_bullets, cost = await outline_stage(
+        ctx["video_id"], details["title"], details["channel"], ctx["transcript"], ctx["errors"], _model(ctx, "outline"),
+        segments=ctx["segments"]
+    )
+    return {"outline": outline, "num_bullets": num_bullets}, cost
+
+
+async def _section_transcripts(ctx):
+    # Short transcripts are sent whole to every section; long ones only send each section its excerpt
+    num_bullets = ctx["outline"]["num_bullets"]
+    transcription = ctx["transcript"]
+    ctx["section_bounds"] = None
+    if await asyncio.to_thread(count_tokens, transcription) >= SECTION_CHUNKING_MIN_TOKENS:
+        sections = section_transcripts(ctx["segments"], ctx["outline"]["outline"], num_bullets, TRANSCRIPT_CHUNK_TOKENS)
+        if sections:
+            logger.info(f"Sending transcript excerpts to {num_bullets} sections instead of the full transcript")
+            excerpts, ctx["section_bounds"] = sections
+            return excerpts, 0.0
+    return [transcription] * max(num_bullets, 1), 0.0
+
+
+def _section_transcripts_digest(ctx, dep_digest):
+    # Every excerpt is a slice of the transcript, so its digest and the boundaries identify them all
+    return [dep_digest("transcript"), TRANSCRIPT_CHUNK_TOKENS, ctx["section_bounds"], len(ctx["section_transcripts"])]
+
+
+async def _first_summary(ctx):
+    details = ctx["details"]
+    section_emitter = ctx.get("section_emitter")
+    result = await summary_stage(
+        ctx["video_id"], details["title"], details["channel"], ctx["section_transcripts"][0], ctx["errors"],
+        ctx["outline"]["outline"], 1, None, _model(ctx, "first_summary"),
+        on_delta=partial(section_emitter.delta, 1) if section_emitter else None,
+        fragments=_prompt_fragments(ctx)
+    )
+    if section_emitter:
+        section_emitter.done(1)
+    return result
+
+
+async def _summaries(ctx):
+    details = ctx["details"]
+    remaining_summaries, partial_failure = await generate_summaries_async(
+        ctx["video_id"], details["title"], details["channel"], ctx["section_transcripts"], ctx["errors"],
+        ctx["outline"]["outline"], ctx["outline"]["num_bullets"], ctx["first_summary"], _model(ctx, "summaries"),
+        section_emitter=ctx.get("section_emitter"), fragments=_prompt_fragments(ctx)
+    )
+    if partial_failure:
+        ctx["incomplete"].add("summaries")
+    all_summaries = [ctx["first_summary"]] + [summary for summary, _ in remaining_summaries]
+    return "\n\n".join(all_summaries), sum(cost for _, cost in remaining_summaries)
+
+
+async def _tldr(ctx):
+    return await tldr_stage(ctx["video_id"], ctx["summaries"], _model(ctx, "tldr"))
+
+
+async def _vocabulary(ctx):
+    return await vocabulary_stage(
+        ctx["video_id"], ctx["transcript"], ctx["errors"], ctx["summaries"], _model(ctx, "vocabulary"),
+        segments=ctx["segments"]
+    )
+
+
+async def _document(ctx):
+    content = build_summary_content(
+        ctx["video_id"], ctx["details"]["title"], ctx["tldr"], ctx["vocabulary"], ctx["summaries"]
+    )
+    return content, 0.0
+
+
+def _llm_fingerprint(stage, *prompts):
+    return lambda ctx: [_model(ctx, stage), prompt_hash(*prompts)]
+
+
+youtube_notes_pipeline = Pipeline([
+    Stage("details", _details, fingerprint=lambda ctx: [ctx["video_id"]]),
+    Stage("segments", _segments),
+    Stage("transcript", _transcript, ("segments",)),
+    Stage(
+        "errors", _errors, ("details", "transcript"),
+        fingerprint=lambda ctx: [
+            _model(ctx, "errors"), TRANSCRIPTION_ERROR_MODE,
+            prompt_hash(TRANSCRIPTION_ERROR_SYSTEM_PROMPT, TRANSCRIPTION_CANDIDATES_SYSTEM_PROMPT)
+        ]
+    ),
+    Stage(
+        "outline", _outline, ("details", "segments", "transcript", "errors"),
+        fingerprint=_llm_fingerprint("outline", GENERATE_OUTLINE_SYSTEM_PROMPT, MERGE_OUTLINES_SYSTEM_PROMPT)
+    ),
+    Stage(
+        "section_transcripts", _section_transcripts, ("segments", "transcript", "outline"),
+        digest=_section_transcripts_digest
+    ),
+    Stage(
+        "first_summary", _first_summary, ("details", "errors", "outline", "section_transcripts"),
+        fingerprint=_llm_fingerprint("first_summary", GENERATE_SUMMARY_SYSTEM_PROMPT)
+    ),
+    Stage(
+        "summaries", _summaries, ("details", "errors", "outline", "section_transcripts", "first_summary"),
+        fingerprint=_llm_fingerprint("summaries", GENERATE_SUMMARY_SYSTEM_PROMPT)
+    ),
+    Stage("tldr", _tldr, ("summaries",), fingerprint=_llm_fingerprint("tldr", GENERATE_TLDR_SYSTEM_PROMPT)),
+    Stage(
+        "vocabulary", _vocabulary, ("segments", "transcript", "errors", "summaries"),
+        fingerprint=_llm_fingerprint("vocabulary", GENERATE_VOCABULARY_SYSTEM_PROMPT)
+    ),
+    Stage("document", _document, ("details", "tldr", "vocabulary", "summaries")),
+])
+
+
+# Top-level fields of each response, which `fields=` may select from
+SUMMARY_FIELDS = ("summary", "cost", "timings")
+FULL_PROCESS_FIELDS = (
+    "video_id", "summary", "transcription_errors", "transcription", "cost", "title", "file_name", "timings"
+)
+REGENERATE_FIELDS = FULL_PROCESS_FIELDS + ("reused", "regenerated")
+
+
+def summary_response(video_id, run):
+    return {"summary": run["document"], "cost": run.total_cost, "timings": run.timings}
+
+
+def full_process_response(video_id, run):
+    title = run["details"]['title']
+    file_name = f"{title.replace(':', '_')}.md"
+
+    return {
+        "video_id": video_id,
+        "summary": run["document"],
+        "transcription_errors": run["errors"],
+        "transcription": run["transcript"],
+        "cost": run.total_cost,
+        "title": title,
+        "file_name": file_name,
+        "timings": run.timings
+    }
+
+
+async def run_youtube_notes(video_id, model, on_stage_complete=None, previous=None, **inputs):
+    """Run the pipeline for a video and keep its fingerprinted outputs for `regenerate`."""
+    run = await youtube_notes_pipeline.run(
+        on_stage_complete=on_stage_complete, previous=previous, video_id=video_id, model=model, **inputs
+    )
+    await asyncio.to_thread(run_manifests.set, video_id, run.manifest())
+    return run
+
+
+async def full_process(video_id, model, on_stage_complete=None, models=None):
+    run = await run_youtube_notes(video_id, model, on_stage_complete=on_stage_complete, models=models)
+    return full_process_response(video_id, run)
+
+
+async def regenerate(video_id, model, models=None):
+    """Recompute only the stages whose fingerprint changed since the video's last run.
+
+    Editing one prompt, for example GENERATE_TLDR_SYSTEM_PROMPT, reruns just that stage (and the
+    document assembled from it); everything else is taken from the previous run.
+    """
+    previous = await asyncio.to_thread(run_manifests.get, video_id)
+    run = await run_youtube_notes(video_id, model, models=models, previous=previous)
+    response = full_process_response(video_id, run)
+    response["reused"] = run.reused
+    response["regenerated"] = [name for name in run.fingerprints if name not in run.reused]
+    return response
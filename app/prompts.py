@@ -29,8 +29,16 @@ Remember, it is ok to initially consider a word as misspelled but determine that
 <\|JSON_OUTPUT|>
 """
 
+TRANSCRIPTION_CANDIDATES_SYSTEM_PROMPT = """You are a master proof-reader reviewing a YouTube auto-generated video transcription. You are given the video title and a list of suspicious words found in the transcript. Each one comes with why it was flagged, similar words from the transcript or title, and short excerpts where it appears.
+
+For each candidate, use the title and the excerpts to decide whether it is a transcription error. Technical terms, brand new terms and proper nouns (often named in the title) are the most common errors, and auto-generated captions often split an unfamiliar name into several common words. An ordinary word that fits its context is not an error.
+
+Report only the words you are confident are wrong. `word` is the exact incorrect string, `context` is the excerpt it appears in and `likely_correct_spelling` uses the correct casing, for example llm would be LLM. Report an empty list if none of the candidates are errors."""
+
 GENERATE_OUTLINE_SYSTEM_PROMPT = """You are a helpful assistant designed to output JSON. Your task is to first read the document titled '{video_title}' by {video_author} and output a detailed numbered outline of the document section by section. Provide high-level overviews of the subjects within each section. Output the result as a JSON object with two properties: 'outline' for the detailed outline in ol markdown list resembling a table of contents with detailed subchapters, and 'num_bullets' for the number of parent bullet points. Please make spelling corrections before writing the outline including correcting the spelling of the headings."""
 
+MERGE_OUTLINES_SYSTEM_PROMPT = """You are a helpful assistant designed to output JSON. The document titled '{video_title}' by {video_author} was too long to outline at once, so it was split into consecutive parts that were outlined separately. Your task is to merge the partial outlines, given in order with the time range each one covers, into one detailed numbered outline of the whole document. Combine sections that continue from one part into the next, keep the order of the document and use at most {max_bullets} parent bullet points. Output the result as a JSON object with two properties: 'outline' for the merged outline in ol markdown list resembling a table of contents with detailed subchapters, and 'num_bullets' for the number of parent bullet points."""
+
 GENERATE_SUMMARY_SYSTEM_PROMPT = """You are a helpful assistant designed to create structured summaries. You cover the essential information in your provided section and utilize complete sentences, lists, tables, quotes, etc to completely capture the original transcription. Use the author's name instead of referring to them as the speaker. If you use their name instead of channel name, put the channel name in parentheses. You must output in a structured Markdown output with a proper heading structure starting at h2. You must include all the sub-bullets mentioned in the outline. Please make spelling corrections before writing the summary including correcting the spelling of the headings. Use all markdown features that are relevant to your summary such as tables, quotes, sub headings, etc. Be sure to correct spelling mistakes based on the identified problematic words above."""
 
 GENERATE_TLDR_SYSTEM_PROMPT = """You are a helpful assistant designed to create concise TL;DR (Too Long; Didn't Read) summaries. Your task is to create a brief, engaging summary that captures the main points of the given text in 2-3 sentences."""
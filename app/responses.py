@@ -0,0 +1,106 @@
+import json
+import zlib
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.config import COMPRESSION_MIN_BYTES, COMPRESSION_LEVEL, STREAMING_JSON_MIN_BYTES
+
+# Streams whose events must reach the client as they are sent; a compressor would hold them back
+UNCOMPRESSED_MEDIA_TYPES = {"text/event-stream", "application/x-ndjson"}
+
+
+def _encode_fields(content):
+    yield b"{"
+    for index, (key, value) in enumerate(content.items()):
+        prefix = "," if index else ""
+        yield f"{prefix}{json.dumps(str(key))}:".encode("utf-8")
+        yield json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=str).encode("utf-8")
+    yield b"}"
+
+
+class StreamingJSONResponse(StreamingResponse):
+    """A JSON object sent one top-level field at a time.
+
+    Each value is encoded separately, so a large payload (a long transcript next to the summary)
+    is never held as one serialized string and the first bytes go out before the last are encoded.
+    """
+
+    def __init__(self, content, status_code=200, headers=None):
+        super().__init__(_encode_fields(content), status_code=status_code, headers=headers, media_type="application/json")
+
+
+def json_response(content):
+    """JSONResponse for small objects, StreamingJSONResponse once its text fields reach STREAMING_JSON_MIN_BYTES.
+
+    Either way the dict is encoded directly rather than walked by FastAPI's jsonable_encoder first.
+    """
+    text_bytes = sum(len(value) for value in content.values() if isinstance(value, str))
+    if text_bytes >= STREAMING_JSON_MIN_BYTES:
+        return StreamingJSONResponse(content)
+    return JSONResponse(content)
+
+
+class CompressionMiddleware:
+    """Gzip responses for clients that accept it.
+
+    Bodies under `minimum_size`, responses that already set Content-Encoding and event streams
+    are sent as they are. Streamed bodies are compressed chunk by chunk.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_BYTES, level=COMPRESSION_LEVEL):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # Hold the headers until the first body chunk shows whether to compress
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                media_type = headers.get("content-type", "").split(";")[0].strip()
+                if not (
+                    "content-encoding" in headers or media_type in UNCOMPRESSED_MEDIA_TYPES
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                    headers["Content-Encoding"] = "gzip"
+                    headers.add_vary_header("Accept-Encoding")
+                    if more_body:
+                        del headers["Content-Length"]
+                    else:
+                        body = compressor.compress(body) + compressor.flush()
+                        headers["Content-Length"] = str(len(body))
+                        compressor = None
+                        message["body"] = body
+                await send(start)
+                start = None
+            elif compressor is None:
+                await send(message)
+                return
+
+            if compressor is not None:
+                body = compressor.compress(body)
+                if not more_body:
+                    body += compressor.flush()
+                message["body"] = body
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,36 @@
+from app.config import LLM_STAGE_MODELS
+from app.llm import check_model
+
+LLM_STAGES = ("errors", "outline", "first_summary", "summaries", "tldr", "vocabulary")
+SUMMARY_STAGES = ("first_summary", "summaries")
+# Names that route several stages at once
+STAGE_GROUPS = {"sections": SUMMARY_STAGES}
+
+
+def parse_stage_models(value):
+    """Parse "errors=gpt-4o-mini,sections=gpt-4o" into {stage: model}.
+
+    Raises ValueError for unknown stages and for models no configured backend can serve.
+    """
+    models = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        stage, separator, model = (part.strip() for part in item.partition("="))
+        if not separator or not model:
+            raise ValueError(f"Expected stage=model, got {item.strip()!r}")
+        if stage not in LLM_STAGES and stage not in STAGE_GROUPS:
+            raise ValueError(f"Unknown stage {stage!r}; expected one of {', '.join(LLM_STAGES + tuple(STAGE_GROUPS))}")
+        check_model(model)
+        for name in STAGE_GROUPS.get(stage, (stage,)):
+            models[name] = model
+    return models
+
+
+# Deployment-wide routing from the environment; per-request overrides take precedence
+configured_stage_models = parse_stage_models(LLM_STAGE_MODELS)
+
+
+def stage_model(stage, model, models=None):
+    """The model a stage runs on: the run's override, then LLM_STAGE_MODELS, then the run's model."""
+    return (models or {}).get(stage) or configured_stage_models.get(stage) or model
@@ -1,13 +1,21 @@
-import openai
 import json
+import asyncio
 import logging
+import httpx
+from pydantic import ValidationError
+from app.candidates import find_candidates, format_candidates
+from app.chunking import format_timestamp, merge_vocabulary
+from app.tokenizer import count_tokens
+from app.llm import chat_completion, stream_chat_content
 from app.utils import calculate_cost
 from app.prompts import (
     GENERATE_OUTLINE_SYSTEM_PROMPT,
+    MERGE_OUTLINES_SYSTEM_PROMPT,
     GENERATE_SUMMARY_SYSTEM_PROMPT,
     GENERATE_TLDR_SYSTEM_PROMPT,
     GENERATE_VOCABULARY_SYSTEM_PROMPT,
-    TRANSCRIPTION_ERROR_SYSTEM_PROMPT
+    TRANSCRIPTION_ERROR_SYSTEM_PROMPT,
+    TRANSCRIPTION_CANDIDATES_SYSTEM_PROMPT
 )
 from app.models import (
     TranscriptionErrorResponse,
@@ -15,28 +23,48 @@ from app.models import (
     SummaryResponse,
     TranscriptionError
 )
-from app.config import model_costs
+from app.config import (
+    model_costs,
+    TRANSCRIPTION_ERROR_MODE,
+    TRANSCRIPTION_ERROR_MAX_CANDIDATES,
+    MAP_REDUCE_CHUNK_TOKENS,
+    MAP_REDUCE_MAX_SECTIONS
+)
+from app.metrics import instrument
 
 logger = logging.getLogger(__name__)
 
-def generate_outline(video_title, video_author, transcription, transcription_errors, model):
-    logger.info("Starting outline generation")
-    conversation = [
+OUTLINE_FUNCTIONS = [
+    {
+        "name": "outline_response",
+        "description": "Generates an outline of the video content.",
+        "parameters": OutlineResponse.schema()
+    }
+]
+
+TRANSCRIPTION_ERROR_FUNCTIONS = [
+    {
+        "name": "transcription_error_response",
+        "description": "Parses transcription errors from the transcription.",
+        "parameters": TranscriptionErrorResponse.schema()
+    }
+]
+
+def build_outline_messages(video_title, video_author, transcription, transcription_errors):
+    return [
         {"role": "system", "content": GENERATE_OUTLINE_SYSTEM_PROMPT.format(video_title=video_title, video_author=video_author)},
         {"role": "system", "content": json.dumps(transcription_errors, indent=2)},
         {"role": "user", "content": transcription}
     ]
 
-    functions = [
-        {
-            "name": "outline_response",
-            "description": "Generates an outline of the video content.",
-            "parameters": OutlineResponse.schema()
-        }
-    ]
+@instrument("outline")
+async def generate_outline(video_title, video_author, transcription, transcription_errors, model):
+    logger.info("Starting outline generation")
+    conversation = build_outline_messages(video_title, video_author, transcription, transcription_errors)
+    functions = OUTLINE_FUNCTIONS
 
     try:
-        response = openai.ChatCompletion.create(
+        response = await chat_completion(
             model=model,
             messages=conversation,
             functions=functions,
@@ -51,41 +79,154 @@ def generate_outline(video_title, video_author, transcription, transcription_err
         return outline_response.outline, outline_response.num_bullets, total_cost
     except Exception as e:
         logger.error(f"Error generating outline: {e}")
-        return None, 0, 0.0
+        raise
 
-def generate_summary(video_title, video_author, transcription, transcription_errors, outline, bullet_number, first_summary, model):
-    logger.info(f"Starting summary generation for bullet {bullet_number}")
-    conversation_summary = [
-        {"role": "system", "content": GENERATE_SUMMARY_SYSTEM_PROMPT},
-        {"role": "system", "content": json.dumps(transcription_errors, indent=2)},
-        {"role": "user", "content": f"Using this outline as a reference to ensure you're covering all the points mentioned in the outline for the video titled '{video_title}' by {video_author}, your task is to create a detailed summary that DOES NOT exclude important details and examples mentioned in the source text. Let's start with bullet {bullet_number}.\n---\n\n## Video Outline\n{outline}\n\n## Video Transcription\n{transcription}\n\n"}
+def build_merge_outline_messages(video_title, video_author, partial_outlines):
+    parts = "\n\n".join(
+        f"## Part {number} ({format_timestamp(part['start'])} - {format_timestamp(part['end'])})\n{part['outline']}"
+        for number, part in enumerate(partial_outlines, 1)
+    )
+    system_prompt = MERGE_OUTLINES_SYSTEM_PROMPT.format(
+        video_title=video_title, video_author=video_author, max_bullets=MAP_REDUCE_MAX_SECTIONS
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": parts}
     ]
+
+@instrument("outline_merge")
+async def merge_outlines(video_title, video_author, partial_outlines, model):
+    conversation = build_merge_outline_messages(video_title, video_author, partial_outlines)
+    response = await chat_completion(
+        model=model,
+        messages=conversation,
+        functions=OUTLINE_FUNCTIONS,
+        function_call={"name": "outline_response"}
+    )
+
+    arguments = response['choices'][0]['message']['function_call']['arguments']
+    outline_response = OutlineResponse.parse_raw(arguments)
+    return outline_response.outline, outline_response.num_bullets, calculate_cost(response['usage'], model_costs, model)
+
+def _merge_groups(partial_outlines, max_tokens):
+    # Consecutive outlines are packed up to max_tokens, at least two per group so every round shrinks
+    groups, tokens = [[]], 0
+    for part in partial_outlines:
+        part_tokens = count_tokens(part["outline"])
+        if len(groups[-1]) >= 2 and tokens + part_tokens > max_tokens:
+            groups.append([])
+            tokens = 0
+        groups[-1].append(part)
+        tokens += part_tokens
+    return groups
+
+async def _unchanged(part):
+    return part["outline"], part["num_bullets"], 0.0
+
+async def generate_outline_map_reduce(video_title, video_author, chunks, transcription_errors, model):
+    """Outline a transcript too long for one call.
+
+    Each chunk (as returned by chunk_segments) is outlined in parallel, then neighbouring partial
+    outlines are merged a group at a time until one outline covers the whole transcript.
+    """
+    logger.info(f"Outlining {len(chunks)} transcript chunks separately")
+    results = await asyncio.gather(*(
+        generate_outline(video_title, video_author, chunk["text"], transcription_errors, model) for chunk in chunks
+    ))
+    total_cost = sum(cost for _, _, cost in results)
+    parts = [
+        {"start": chunk["start"], "end": chunk["end"], "outline": outline, "num_bullets": num_bullets}
+        for chunk, (outline, num_bullets, _) in zip(chunks, results)
+    ]
+
+    while len(parts) > 1:
+        groups = _merge_groups(parts, MAP_REDUCE_CHUNK_TOKENS)
+        logger.info(f"Merging {len(parts)} partial outlines into {len(groups)}")
+        merged = await asyncio.gather(*(
+            merge_outlines(video_title, video_author, group, model) if len(group) > 1 else _unchanged(group[0])
+            for group in groups
+        ))
+        total_cost += sum(cost for _, _, cost in merged)
+        parts = [
+            {"start": group[0]["start"], "end": group[-1]["end"], "outline": outline, "num_bullets": num_bullets}
+            for group, (outline, num_bullets, _) in zip(groups, merged)
+        ]
+
+    return parts[0]["outline"], parts[0]["num_bullets"], total_cost
+
+class PromptFragments:
+    """Summary prompt pieces that are identical across a video's section calls, built once.
+
+    Every section's messages reference the same errors JSON and, for sections sent the same
+    transcript, the same reference block, instead of each call holding its own copy.
+    """
+
+    def __init__(self, video_title, video_author, transcription_errors, outline):
+        self.video_title = video_title
+        self.video_author = video_author
+        self.outline = outline
+        self.errors_json = json.dumps(transcription_errors, indent=2)
+        self._prefixes = {}
+
+    def summary_prefix(self, transcription):
+        prefix = self._prefixes.get(transcription)
+        if prefix is None:
+            reference = f"## Video\n'{self.video_title}' by {self.video_author}\n\n## Video Outline\n{self.outline}\n\n## Video Transcription\n{transcription}\n\n"
+            prefix = self._prefixes[transcription] = (
+                {"role": "system", "content": GENERATE_SUMMARY_SYSTEM_PROMPT},
+                {"role": "system", "content": self.errors_json},
+                {"role": "user", "content": reference}
+            )
+        return prefix
+
+def build_summary_messages(video_title, video_author, transcription, transcription_errors, outline, bullet_number, first_summary, fragments=None):
+    # Everything that is identical across a video's section calls comes first so the provider can
+    # reuse its cached prompt prefix; only the final instruction names the bullet being written.
+    if fragments is None:
+        fragments = PromptFragments(video_title, video_author, transcription_errors, outline)
+    instruction = "Using the outline above as a reference to ensure you're covering all the points mentioned in the outline, your task is to create a detailed summary that DOES NOT exclude important details and examples mentioned in the source text. Let's start with bullet {bullet_number}."
+    messages = list(fragments.summary_prefix(transcription))
     if first_summary and bullet_number > 1:
-        conversation_summary.append({"role": "assistant", "content": first_summary})
-        conversation_summary.append({"role": "user", "content": f"Now, please summarize bullet {bullet_number} in a similar style."})
+        messages.append({"role": "user", "content": instruction.format(bullet_number=1)})
+        messages.append({"role": "assistant", "content": first_summary})
+        messages.append({"role": "user", "content": f"Now, please summarize bullet {bullet_number} in a similar style."})
+    else:
+        messages.append({"role": "user", "content": instruction.format(bullet_number=bullet_number)})
+    return messages
+
+@instrument("summary")
+async def generate_summary(video_title, video_author, transcription, transcription_errors, outline, bullet_number, first_summary, model, on_delta=None, fragments=None):
+    logger.info(f"Starting summary generation for bullet {bullet_number}")
+    conversation_summary = build_summary_messages(video_title, video_author, transcription, transcription_errors, outline, bullet_number, first_summary, fragments)
     
-    response = openai.ChatCompletion.create(model=model, messages=conversation_summary)
-    summary = response['choices'][0]['message']['content']
+    if on_delta:
+        summary, usage = await stream_chat_content(model, conversation_summary, on_delta)
+    else:
+        response = await chat_completion(model=model, messages=conversation_summary)
+        summary = response['choices'][0]['message']['content']
+        usage = response['usage']
     
     logger.info(f"Generated summary for bullet {bullet_number}")
-    return summary, calculate_cost(response['usage'], model_costs, model)
-
-def generate_tldr(complete_summary, model):
-    logger.info("Starting TL;DR generation")
-    system_prompt = GENERATE_TLDR_SYSTEM_PROMPT
+    return summary, calculate_cost(usage, model_costs, model)
 
+def build_tldr_messages(complete_summary):
     user_prompt = f"""Please create a TL;DR summary for the following text:
 
 {complete_summary}
 
 Your TL;DR should be 2-3 sentences long and capture the main points of the text."""
 
-    conversation = [
-        {"role": "system", "content": system_prompt},
+    return [
+        {"role": "system", "content": GENERATE_TLDR_SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt}
     ]
 
-    response = openai.ChatCompletion.create(
+@instrument("tldr")
+async def generate_tldr(complete_summary, model):
+    logger.info("Starting TL;DR generation")
+    conversation = build_tldr_messages(complete_summary)
+
+    response = await chat_completion(
         model=model,
         messages=conversation
     )
@@ -98,29 +239,30 @@ Your TL;DR should be 2-3 sentences long and capture the main points of the text.
 
     return tldr, cost
 
-def generate_vocabulary(transcription, transcription_errors, combined_summaries, model):
-    logger.info("Starting vocabulary generation")
-    system_prompt = GENERATE_VOCABULARY_SYSTEM_PROMPT
-
+def build_vocabulary_messages(transcription, transcription_errors, combined_summaries):
+    # Chunks of a long transcript are mined for vocabulary without the summary
+    summary_section = f"Summary:\n{combined_summaries}\n\n" if combined_summaries else ""
     user_prompt = f"""Please extract and explain key vocabulary from the following text. Focus on terms that are important for understanding the content, especially those that might be unfamiliar to a general audience.
 
 Transcription:
 {transcription}
 
-Summary:
-{combined_summaries}
-
-Potential transcription errors:
+{summary_section}Potential transcription errors:
 {json.dumps(transcription_errors, indent=2)}
 
 Please provide the vocabulary in a markdown format, with each term as a heading followed by its explanation."""
 
-    conversation = [
-        {"role": "system", "content": system_prompt},
+    return [
+        {"role": "system", "content": GENERATE_VOCABULARY_SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt}
     ]
 
-    response = openai.ChatCompletion.create(
+@instrument("vocabulary")
+async def generate_vocabulary(transcription, transcription_errors, combined_summaries, model):
+    logger.info("Starting vocabulary generation")
+    conversation = build_vocabulary_messages(transcription, transcription_errors, combined_summaries)
+
+    response = await chat_completion(
         model=model,
         messages=conversation
     )
@@ -133,13 +275,23 @@ Please provide the vocabulary in a markdown format, with each term as a heading
 
     return vocabulary, cost
 
-def generate_follow_up(video_title, transcription, errors, user_takes, model):
+async def generate_vocabulary_map_reduce(chunks, transcription_errors, model):
+    """Extract vocabulary from each chunk of a long transcript in parallel and merge duplicate terms."""
+    logger.info(f"Extracting vocabulary from {len(chunks)} transcript chunks separately")
+    results = await asyncio.gather(*(
+        generate_vocabulary(chunk["text"], transcription_errors, None, model) for chunk in chunks
+    ))
+    vocabulary = merge_vocabulary([vocabulary for vocabulary, _ in results])
+    return vocabulary, sum(cost for _, cost in results)
+
+@instrument("follow_up")
+async def generate_follow_up(video_title, transcription, errors, user_takes, model):
     logger.info("Starting follow-up generation")
     prompt = f"""
     You are an AI assistant tasked with generating follow-up content based on a user's takes on a YouTube video.
 
     Video Title: {video_title}
-    Transcription Errors: {', '.join(errors)}
+    Transcription Errors: {', '.join(error["word"] for error in (errors or {}).get("errors", []))}
 
     User's Takes:
     {' '.join(user_takes)}
@@ -153,7 +305,7 @@ def generate_follow_up(video_title, transcription, errors, user_takes, model):
     Please format the follow-up content in Markdown.
     """
 
-    response = openai.ChatCompletion.create(
+    response = await chat_completion(
         model=model,
         messages=[
             {"role": "system", "content": "You are a helpful AI assistant."},
@@ -163,17 +315,16 @@ def generate_follow_up(video_title, transcription, errors, user_takes, model):
         max_tokens=1000
     )
 
-    follow_up_content = response.choices[0].message['content'].strip()
-    cost = calculate_cost(response['usage'], model)
+    follow_up_content = response['choices'][0]['message']['content'].strip()
+    cost = calculate_cost(response['usage'], model_costs, model)
 
     logger.info(f"Generated follow-up content")
     return follow_up_content, cost
 
-def determine_transcription_errors(video_title, transcription, model):
-    try:
-        logger.info("Starting transcription error determination")
+def build_transcription_error_messages(video_title, transcription):
+    """Messages for the transcription error check, or None when candidate mode finds nothing to check."""
+    if TRANSCRIPTION_ERROR_MODE == "full":
         system_prompt = TRANSCRIPTION_ERROR_SYSTEM_PROMPT
-
         user_prompt = f"""<|VIDEO_TITLE|>
 {video_title}
 </|VIDEO_TITLE|>
@@ -181,21 +332,36 @@ def determine_transcription_errors(video_title, transcription, model):
 <|TRANSCRIPT|>
 {transcription}
 </|TRANSCRIPT|>"""
+    else:
+        # Only words flagged locally are sent, with a few words of context each
+        candidates = find_candidates(video_title, transcription, TRANSCRIPTION_ERROR_MAX_CANDIDATES)
+        logger.info(f"Found {len(candidates)} transcription error candidates")
+        if not candidates:
+            return None
+        system_prompt = TRANSCRIPTION_CANDIDATES_SYSTEM_PROMPT
+        user_prompt = f"""<|VIDEO_TITLE|>
+{video_title}
+</|VIDEO_TITLE|>
 
-        conversation = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+<|CANDIDATES|>
+{format_candidates(candidates)}
+</|CANDIDATES|>"""
 
-        functions = [
-            {
-                "name": "transcription_error_response",
-                "description": "Parses transcription errors from the transcription.",
-                "parameters": TranscriptionErrorResponse.schema()
-            }
-        ]
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+@instrument("transcription_errors")
+async def determine_transcription_errors(video_title, transcription, model):
+    try:
+        logger.info("Starting transcription error determination")
+        conversation = await asyncio.to_thread(build_transcription_error_messages, video_title, transcription)
+        if conversation is None:
+            return TranscriptionErrorResponse(errors=[]), 0.0
+        functions = TRANSCRIPTION_ERROR_FUNCTIONS
 
-        response = openai.ChatCompletion.create(
+        response = await chat_completion(
             model=model,
             messages=conversation,
             functions=functions,
@@ -208,6 +374,7 @@ def determine_transcription_errors(video_title, transcription, model):
         total_cost = calculate_cost(response['usage'], model_costs, model)
 
         return transcription_errors, total_cost
-    except Exception as e:
+    # Only a failed or unparseable LLM call is tolerated; quota and budget errors must reach the caller
+    except (httpx.HTTPError, KeyError, IndexError, TypeError, ValidationError) as e:
         logger.error(f"Error determining transcription errors: {e}")
         return None, 0.0
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+
+from app.metrics import coalesced_calls
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key.
+
+    The first caller starts the work; callers arriving while it is in flight wait for the same
+    result. The work is only cancelled once every waiter has gone away.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = {}
+
+    async def do(self, stage, key, fn):
+        """Return (result, leader). `leader` is False when the result came from another caller's call."""
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            call = {"task": asyncio.ensure_future(fn()), "waiters": 0}
+            self._calls[key] = call
+            call["task"].add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced[stage] = self.coalesced.get(stage, 0) + 1
+            coalesced_calls.inc(stage=stage)
+            logger.info(f"Coalesced concurrent {stage} call")
+
+        call["waiters"] += 1
+        try:
+            return await asyncio.shield(call["task"]), leader
+        except asyncio.CancelledError:
+            if call["waiters"] == 1 and not call["task"].done():
+                call["task"].cancel()
+            raise
+        finally:
+            call["waiters"] -= 1
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+
+from app.cache import stage_cache, make_key, prompt_hash
+from app.chunking import chunk_segments
+from app.tokenizer import count_tokens
+from app.config import TRANSCRIPTION_ERROR_MODE, MAP_REDUCE_MIN_TOKENS, MAP_REDUCE_CHUNK_TOKENS
+from app.singleflight import single_flight
+from app.transcripts import transcript_store
+from app.utils import get_video_details, get_transcript_segments
+from app.prompts import (
+    TRANSCRIPTION_ERROR_SYSTEM_PROMPT,
+    TRANSCRIPTION_CANDIDATES_SYSTEM_PROMPT,
+    GENERATE_OUTLINE_SYSTEM_PROMPT,
+    MERGE_OUTLINES_SYSTEM_PROMPT,
+    GENERATE_SUMMARY_SYSTEM_PROMPT,
+    GENERATE_TLDR_SYSTEM_PROMPT,
+    GENERATE_VOCABULARY_SYSTEM_PROMPT
+)
+from app.services import (
+    generate_outline,
+    generate_outline_map_reduce,
+    generate_summary,
+    generate_tldr,
+    generate_vocabulary,
+    generate_vocabulary_map_reduce,
+    determine_transcription_errors
+)
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages backed by the stage cache. Every key is derived from the stage's inputs,
+# so a cached output is only reused when nothing that feeds into it has changed.
+# Concurrent misses on the same key are coalesced so the work runs once. Cached and
+# coalesced results report a cost of 0.0 since this caller made no LLM call.
+
+
+async def _run_stage(stage, key, compute, cacheable=bool):
+    """Return (value, cost, fresh) for a stage, serving it from the cache or an in-flight call when possible.
+
+    `compute` returns (value, cost); values for which `cacheable(value)` is true are stored.
+    """
+    cached = await asyncio.to_thread(stage_cache.get, stage, key)
+    if cached is not None:
+        return cached, 0.0, False
+
+    async def compute_and_store():
+        value, cost = await compute()
+        if cacheable(value):
+            await asyncio.to_thread(stage_cache.set, stage, key, value)
+        return value, cost
+
+    (value, cost), leader = await single_flight.do(stage, key, compute_and_store)
+    if not leader:
+        return value, 0.0, False
+    return value, cost, True
+
+
+async def video_details_stage(video_id):
+    async def compute():
+        details = await get_video_details(video_id)
+        if details["title"] != "Error Fetching Title":
+            await asyncio.to_thread(transcript_store.set_details, video_id, details)
+        return details, 0.0
+
+    details, _, _ = await _run_stage(
+        "video_details", make_key("video_details", video_id), compute,
+        cacheable=lambda details: details["title"] != "Error Fetching Title"
+    )
+    return details
+
+
+async def transcript_segments_stage(video_id):
+    """Return the video's Transcript, shared by every caller that needs its text or segments."""
+    # Transcripts do not change once published, so the transcript store keeps them without a TTL
+    transcript = await asyncio.to_thread(transcript_store.load, video_id)
+    if transcript is not None:
+        return transcript
+
+    async def fetch_and_store():
+        transcript = await get_transcript_segments(video_id)
+        if transcript:
+            await asyncio.to_thread(transcript_store.save, video_id, transcript)
+        return transcript
+
+    transcript, _ = await single_flight.do("transcript_segments", video_id, fetch_and_store)
+    return transcript
+
+
+async def transcription_stage(video_id):
+    return (await transcript_segments_stage(video_id)).text
+
+
+async def transcription_errors_stage(video_id, video_title, transcription, model):
+    key = make_key(
+        "transcription_errors", video_id, model, TRANSCRIPTION_ERROR_MODE,
+        prompt_hash(TRANSCRIPTION_ERROR_SYSTEM_PROMPT, TRANSCRIPTION_CANDIDATES_SYSTEM_PROMPT),
+        video_title, prompt_hash(transcription)
+    )
+
+    async def compute():
+        errors, cost = await determine_transcription_errors(video_title, transcription, model)
+        return errors.dict() if errors else {}, cost
+
+    errors_dict, cost, _ = await _run_stage("transcription_errors", key, compute)
+    return errors_dict, cost
+
+
+def map_reduce_chunks(transcription, segments):
+    """Chunks for map-reduce processing when the transcript is too long for a single call, else None."""
+    if segments and count_tokens(transcription) >= MAP_REDUCE_MIN_TOKENS:
+        return chunk_segments(segments, MAP_REDUCE_CHUNK_TOKENS)
+    return None
+
+
+async def outline_stage(video_id, video_title, video_author, transcription, transcription_errors, model, segments=None):
+    chunks = await asyncio.to_thread(map_reduce_chunks, transcription, segments)
+    key = make_key(
+        "outline", video_id, model, prompt_hash(GENERATE_OUTLINE_SYSTEM_PROMPT),
+        video_title, video_author, prompt_hash(transcription), transcription_errors,
+        *(["map_reduce", MAP_REDUCE_CHUNK_TOKENS, prompt_hash(MERGE_OUTLINES_SYSTEM_PROMPT)] if chunks else [])
+    )
+
+    async def compute():
+        if chunks:
+            outline, num_bullets, cost = await generate_outline_map_reduce(
+                video_title, video_author, chunks, transcription_errors, model
+            )
+        else:
+            outline, num_bullets, cost = await generate_outline(
+                video_title, video_author, transcription, transcription_errors, model
+            )
+        return {"outline": outline, "num_bullets": num_bullets}, cost
+
+    result, cost, _ = await _run_stage("outline", key, compute, cacheable=lambda result: bool(result["outline"]))
+    return result["outline"], result["num_bullets"], cost
+
+
+async def summary_stage(video_id, video_title, video_author, transcription, transcription_errors, outline, bullet_number, first_summary, model, on_delta=None, fragments=None):
+    key = make_key(
+        "summary", video_id, model, prompt_hash(GENERATE_SUMMARY_SYSTEM_PROMPT),
+        video_title, video_author, prompt_hash(transcription), transcription_errors,
+        prompt_hash(outline), bullet_number, prompt_hash(first_summary)
+    )
+
+    async def compute():
+        return await generate_summary(
+            video_title, video_author, transcription, transcription_errors, outline,
+            bullet_number, first_summary, model, on_delta=on_delta, fragments=fragments
+        )
+
+    summary, cost, fresh = await _run_stage("summary", key, compute)
+    # Only a freshly generated summary was streamed to on_delta; send others in one piece
+    if on_delta and not fresh:
+        on_delta(summary)
+    return summary, cost
+
+
+async def tldr_stage(video_id, combined_summaries, model):
+    key = make_key(
+        "tldr", video_id, model, prompt_hash(GENERATE_TLDR_SYSTEM_PROMPT), prompt_hash(combined_summaries)
+    )
+
+    async def compute():
+        return await generate_tldr(combined_summaries, model)
+
+    tldr, cost, _ = await _run_stage("tldr", key, compute)
+    return tldr, cost
+
+
+async def vocabulary_stage(video_id, transcription, transcription_errors, combined_summaries, model, segments=None):
+    chunks = await asyncio.to_thread(map_reduce_chunks, transcription, segments)
+    key = make_key(
+        "vocabulary", video_id, model, prompt_hash(GENERATE_VOCABULARY_SYSTEM_PROMPT),
+        prompt_hash(transcription), transcription_errors, prompt_hash(combined_summaries),
+        *(["map_reduce", MAP_REDUCE_CHUNK_TOKENS] if chunks else [])
+    )
+
+    async def compute():
+        if chunks:
+            return await generate_vocabulary_map_reduce(chunks, transcription_errors, model)
+        return await generate_vocabulary(transcription, transcription_errors, combined_summaries, model)
+
+    vocabulary, cost, _ = await _run_stage("vocabulary", key, compute)
+    return vocabulary, cost
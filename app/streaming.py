@@ -0,0 +1,101 @@
+import asyncio
+import json
+import logging
+
+from fastapi.responses import StreamingResponse
+
+from app.pipeline import run_youtube_notes
+
+logger = logging.getLogger(__name__)
+
+# Keep caches and reverse proxies such as nginx from holding events back until the stream ends
+STREAMING_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    return StreamingResponse(events, media_type="text/event-stream", headers=STREAMING_HEADERS)
+
+
+class SectionEmitter:
+    """Forwards section deltas in bullet order.
+
+    Sections are generated concurrently, so deltas for later bullets are buffered until every
+    earlier bullet has finished streaming.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.current = 1
+        self.buffers = {}
+        self.started = set()
+        self.finished = set()
+
+    def _emit(self, bullet_number, content):
+        if bullet_number not in self.started:
+            self.started.add(bullet_number)
+            # Sections are joined with a blank line, matching the combined summaries
+            if bullet_number > 1:
+                content = "\n\n" + content
+        self.queue.put_nowait(sse_event("section", {"bullet": bullet_number, "content": content}))
+
+    def delta(self, bullet_number, content):
+        if bullet_number == self.current:
+            self._emit(bullet_number, content)
+        else:
+            self.buffers.setdefault(bullet_number, []).append(content)
+
+    def done(self, bullet_number):
+        self.finished.add(bullet_number)
+        while self.current in self.finished:
+            self.current += 1
+            for content in self.buffers.pop(self.current, []):
+                self._emit(self.current, content)
+
+
+async def stream_youtube_notes(video_id, model, build_response, models=None):
+    """Run the YouTube notes pipeline and yield Server-Sent Events as stages finish.
+
+    Events: `metadata` once video details are known, `section` for each summary fragment in
+    order, `tldr` and `vocabulary` when ready, and finally `done` with the same payload as the
+    non-streaming endpoint (or `error`).
+    """
+    queue = asyncio.Queue()
+    section_emitter = SectionEmitter(queue)
+
+    def on_stage_complete(stage_name, run):
+        if stage_name == "details":
+            queue.put_nowait(sse_event("metadata", {"video_id": video_id, **run["details"]}))
+        elif stage_name in ("tldr", "vocabulary"):
+            queue.put_nowait(sse_event(stage_name, {"content": run[stage_name]}))
+
+    async def produce():
+        try:
+            run = await run_youtube_notes(
+                video_id,
+                model,
+                on_stage_complete=on_stage_complete,
+                section_emitter=section_emitter,
+                models=models
+            )
+            queue.put_nowait(sse_event("done", build_response(video_id, run)))
+        except Exception as e:
+            logger.error(f"Streaming pipeline failed for video {video_id}: {e}")
+            queue.put_nowait(sse_event("error", {"detail": str(e)}))
+        finally:
+            queue.put_nowait(None)
+
+    task = asyncio.create_task(produce())
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        # Stop spending on the pipeline if the client goes away
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,37 @@
+import math
+import re
+
+# Splits text the way the OpenAI tokenizers pre-tokenize it: contractions, words with their
+# leading space, digit runs, punctuation runs and whitespace
+PIECE_PATTERN = re.compile(r"'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d+| ?[^\s\w]+|\s+")
+
+# Chat formatting adds a few tokens per message plus a few to prime the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+def _piece_tokens(piece):
+    word = piece.lstrip(" ")
+    if not word or word.isspace():
+        return 1
+    if word.isdigit():
+        # Numbers are split into groups of up to three digits
+        return math.ceil(len(word) / 3)
+    if word[0].isalpha():
+        # Common words are a single token; longer or rarer ones split into pieces of ~5 characters
+        return 1 if len(word) <= 7 else math.ceil(len(word) / 5)
+    return len(word)
+
+
+def count_tokens(text):
+    """Approximate the token count of `text` for OpenAI chat models, without a tokenizer download.
+
+    Close enough on English prose for cost estimates, not for enforcing context limits.
+    """
+    return sum(_piece_tokens(piece) for piece in PIECE_PATTERN.findall(text or ""))
+
+
+def count_message_tokens(messages):
+    return sum(
+        TOKENS_PER_MESSAGE + count_tokens(message.get("content") or "") for message in messages
+    ) + TOKENS_PER_REPLY
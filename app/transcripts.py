@@ -0,0 +1,276 @@
+import logging
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from app.chunking import chunk_segments
+from app.config import TRANSCRIPTS_DIR, TRANSCRIPT_INDEX_PATH, TRANSCRIPT_INDEX_CHUNK_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# File layout: header, then three uint32 columns (start ms, duration ms, end offset of each
+# segment's text in the transcript text), then the transcript text as UTF-8. All integers are
+# little-endian. Version 1 files stored byte offsets into the bare segment texts instead.
+MAGIC = b"YTTS"
+VERSION = 2
+HEADER = struct.Struct("<4sHI")
+VIDEO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
+def _column(values):
+    column = array("I", values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+class Segment:
+    """One caption of a Transcript. Its text is sliced from the transcript's shared buffer on access."""
+
+    __slots__ = ("_transcript", "_index")
+
+    def __init__(self, transcript, index):
+        self._transcript = transcript
+        self._index = index
+
+    @property
+    def text(self):
+        return self._transcript.segment_text(self._index)
+
+    @property
+    def start(self):
+        return self._transcript._starts[self._index] / 1000
+
+    @property
+    def duration(self):
+        return self._transcript._durations[self._index] / 1000
+
+
+class Transcript:
+    """A video's captions as one immutable object shared by every stage of a request.
+
+    `text` is the whole transcript (segment texts joined by spaces) and is the only copy of the
+    words: segments are views that slice it using per-segment offsets, with timings kept in
+    compact integer arrays instead of a dict per caption. `starts` and `durations` are read-only
+    views of those arrays.
+    """
+
+    __slots__ = ("_text", "_starts", "_durations", "_ends")
+
+    def __init__(self, text, starts, durations, ends):
+        self._text = text
+        self._starts = starts
+        self._durations = durations
+        self._ends = ends
+
+    @property
+    def text(self):
+        return self._text
+
+    @property
+    def starts(self):
+        return memoryview(self._starts).toreadonly()
+
+    @property
+    def durations(self):
+        return memoryview(self._durations).toreadonly()
+
+    @classmethod
+    def from_texts(cls, texts, starts, durations):
+        ends, offset = array("I"), -1
+        for text in texts:
+            offset += len(text) + 1
+            ends.append(offset)
+        return cls(" ".join(texts), starts, durations, ends)
+
+    def __len__(self):
+        return len(self._ends)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("segment index out of range")
+        return Segment(self, index)
+
+    def __iter__(self):
+        return (Segment(self, index) for index in range(len(self)))
+
+    def __str__(self):
+        return self._text
+
+    def segment_text(self, index):
+        begin = self._ends[index - 1] + 1 if index else 0
+        return self._text[begin:self._ends[index]]
+
+
+def encode_transcript(transcript):
+    return b"".join([
+        HEADER.pack(MAGIC, VERSION, len(transcript)),
+        _column(transcript.starts),
+        _column(transcript.durations),
+        _column(transcript._ends),
+        transcript.text.encode("utf-8"),
+    ])
+
+
+def decode_transcript(data):
+    """Rebuild a Transcript from `encode_transcript` output, decoding its text in one pass."""
+    magic, version, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version not in (1, VERSION):
+        raise ValueError(f"not a version {VERSION} transcript file")
+    if len(data) < HEADER.size + 12 * count:
+        raise ValueError("transcript file is truncated")
+    columns = array("I")
+    columns.frombytes(data[HEADER.size:HEADER.size + 12 * count])
+    if sys.byteorder == "big":
+        columns.byteswap()
+    starts, durations, ends = columns[:count], columns[count:2 * count], columns[2 * count:]
+    blob = data[HEADER.size + 12 * count:]
+    if version == 1:
+        texts = [blob[ends[index - 1] if index else 0:ends[index]].decode("utf-8") for index in range(count)]
+        return Transcript.from_texts(texts, starts, durations)
+    return Transcript(blob.decode("utf-8"), starts, durations, ends)
+
+
+def _fts_query(query):
+    # Quote every term so user input cannot use (or break) FTS5 query syntax; terms are ANDed
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+class TranscriptStore:
+    """Keeps fetched transcripts on disk and indexes them for full-text search.
+
+    Segments are stored one file per video in the compact format above.
+    A SQLite FTS5 table indexes ~TRANSCRIPT_INDEX_CHUNK_TOKENS windows of each transcript so
+    matches come back with the time they were said.
+    """
+
+    def __init__(self, directory, index_path, chunk_tokens):
+        self.directory = directory
+        self.index_path = index_path
+        self.chunk_tokens = chunk_tokens
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS transcripts (
+                    video_id TEXT PRIMARY KEY,
+                    title TEXT,
+                    channel TEXT,
+                    segments INTEGER NOT NULL DEFAULT 0,
+                    bytes INTEGER NOT NULL DEFAULT 0,
+                    stored_at REAL
+                )"""
+            )
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS transcript_fts USING fts5("
+                "text, video_id UNINDEXED, start UNINDEXED, tokenize='porter unicode61')"
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.index_path, timeout=30)
+
+    def _path(self, video_id):
+        # Video ids become file names, so anything else could escape the directory
+        if not VIDEO_ID_PATTERN.match(video_id):
+            raise ValueError(f"Invalid video ID: {video_id!r}")
+        return os.path.join(self.directory, f"{video_id}.bin")
+
+    def load(self, video_id):
+        """Return the stored Transcript for a video, or None if it has not been stored."""
+        path = self._path(video_id)
+        try:
+            with open(path, "rb") as f:
+                return decode_transcript(f.read())
+        except FileNotFoundError:
+            return None
+        except (ValueError, struct.error, UnicodeDecodeError) as e:
+            logger.error(f"Stored transcript for {video_id} is unreadable: {e}")
+            return None
+
+    def save(self, video_id, transcript):
+        data = encode_transcript(transcript)
+        path = self._path(video_id)
+        # Write then rename so concurrent readers never map a half-written file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        rows = [
+            (chunk["text"], video_id, chunk["start"])
+            for chunk in chunk_segments(transcript, self.chunk_tokens)
+        ]
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM transcript_fts WHERE video_id = ?", (video_id,))
+                conn.executemany("INSERT INTO transcript_fts (text, video_id, start) VALUES (?, ?, ?)", rows)
+                conn.execute(
+                    "INSERT INTO transcripts (video_id, segments, bytes, stored_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(video_id) DO UPDATE SET segments = excluded.segments, "
+                    "bytes = excluded.bytes, stored_at = excluded.stored_at",
+                    (video_id, len(transcript), len(data), time.time()),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        logger.info(f"Stored transcript for {video_id} ({len(transcript)} segments, {len(data)} bytes)")
+
+    def set_details(self, video_id, details):
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT INTO transcripts (video_id, title, channel) VALUES (?, ?, ?) "
+                    "ON CONFLICT(video_id) DO UPDATE SET title = excluded.title, channel = excluded.channel",
+                    (video_id, details["title"], details["channel"]),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def search(self, query, limit=20):
+        """Best-matching transcript windows for `query`, most relevant first."""
+        match = _fts_query(query)
+        if not match:
+            return []
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                """SELECT f.video_id, f.start, snippet(transcript_fts, 0, '[', ']', '...', 24),
+                          t.title, t.channel
+                   FROM transcript_fts f LEFT JOIN transcripts t ON t.video_id = f.video_id
+                   WHERE transcript_fts MATCH ?
+                   ORDER BY rank
+                   LIMIT ?""",
+                (match, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {
+                "video_id": video_id,
+                "title": title,
+                "channel": channel,
+                "start": start,
+                "url": f"https://www.youtube.com/watch?v={video_id}&t={int(start)}s",
+                "snippet": snippet,
+            }
+            for video_id, start, snippet, title, channel in rows
+        ]
+
+
+transcript_store = TranscriptStore(TRANSCRIPTS_DIR, TRANSCRIPT_INDEX_PATH, TRANSCRIPT_INDEX_CHUNK_TOKENS)
@@ -0,0 +1,317 @@
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import sqlite3
+import time
+from collections import defaultdict, deque
+
+from app.config import (
+    USAGE_PATH,
+    USAGE_FLUSH_SECONDS,
+    USAGE_FLUSH_ROWS,
+    USAGE_DAILY_LIMIT,
+    USAGE_MONTHLY_LIMIT
+)
+
+logger = logging.getLogger(__name__)
+
+# Name of the API key the current request authenticated with; LLM calls made for it are charged to it
+current_api_key = contextvars.ContextVar("current_api_key", default="none")
+
+HOUR = 3600
+DAY = 24 * HOUR
+GROUP_COLUMNS = ("api_key", "stage", "model")
+PERIODS = {"hour": "hour", "day": f"hour - hour % {DAY}", "total": "NULL"}
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, api_key, window, limit, retry_after):
+        super().__init__(f"API key {api_key!r} has used its {window} limit of ${limit:g}")
+        self.retry_after = retry_after
+
+
+class SpendingLimit:
+    """Rolling dollar limit per API key: what the key spent in the last `window` seconds.
+
+    Spending is summed in memory in per-minute slots, which drop out once they are older than the
+    window. Requests are refused while the sum is at or over the limit.
+    """
+
+    SLOT_SECONDS = 60
+
+    def __init__(self, name, limit, window):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        # api_key -> deque of [slot start, dollars], oldest first, and the running total of the deque
+        self._slots = {}
+        self._totals = {}
+
+    def _expire(self, api_key, now):
+        slots = self._slots.get(api_key)
+        # A slot counts until its last second has left the window
+        while slots and slots[0][0] + self.SLOT_SECONDS <= now - self.window:
+            self._totals[api_key] -= slots.popleft()[1]
+        if not slots:
+            self._slots.pop(api_key, None)
+            self._totals.pop(api_key, None)
+
+    def spend(self, api_key, cost, now=None):
+        if self.limit <= 0:
+            return
+        now = now or time.time()
+        slot = now - now % self.SLOT_SECONDS
+        slots = self._slots.setdefault(api_key, deque())
+        if slots and slots[-1][0] >= slot:
+            slots[-1][1] += cost
+        else:
+            slots.append([slot, cost])
+        self._totals[api_key] = self._totals.get(api_key, 0.0) + cost
+        self._expire(api_key, now)
+
+    def used(self, api_key, now=None):
+        now = now or time.time()
+        self._expire(api_key, now)
+        return max(0.0, self._totals.get(api_key, 0.0))
+
+    def check(self, api_key):
+        if self.limit <= 0:
+            return
+        now = time.time()
+        spent = self.used(api_key, now)
+        if spent < self.limit:
+            return
+        # Wait until enough of the oldest spending has left the window
+        retry_after = self.window
+        for slot, dollars in self._slots[api_key]:
+            spent -= dollars
+            if spent < self.limit:
+                retry_after = slot + self.SLOT_SECONDS + self.window - now
+                break
+        raise QuotaExceeded(api_key, self.name, self.limit, max(1, math.ceil(retry_after)))
+
+    def status(self, api_key):
+        return {"limit": self.limit, "used": round(self.used(api_key), 6)}
+
+    def replay(self, api_key, costs, now):
+        """Rebuild a key's spending from time-ordered (timestamp, cost) pairs, e.g. after a restart."""
+        if self.limit <= 0:
+            return
+        self._slots.pop(api_key, None)
+        self._totals.pop(api_key, None)
+        for timestamp, cost in costs:
+            if timestamp > now - self.window:
+                self.spend(api_key, cost, now=min(timestamp, now))
+
+
+class UsageLedger:
+    """Append-only record of every LLM call's tokens and dollars, per API key, stage and model.
+
+    Calls are buffered in memory and written in batches by a background task, so recording costs
+    nothing on the request path. Each batch also updates per-hour summaries, which are what
+    aggregation reads, so queries do not slow down as the raw ledger grows. The summaries are
+    shared by every worker process and re-seed the spending limits after each write.
+    """
+
+    def __init__(self, path, limits):
+        self.path = path
+        self.limits = limits
+        self._pending = []
+        self._seeded = set()
+        self._wakeup = None
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS usage_events (
+                    id INTEGER PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    api_key TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    cached_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    cost REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS usage_hourly (
+                    hour INTEGER NOT NULL,
+                    api_key TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    calls INTEGER NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    cached_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    cost REAL NOT NULL,
+                    PRIMARY KEY (hour, api_key, stage, model)
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_hourly_key ON usage_hourly (api_key, hour)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, stage, model, usage, cost):
+        """Buffer one LLM call for the current API key and charge it against the key's limits."""
+        api_key = current_api_key.get()
+        now = time.time()
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        self._pending.append(
+            (now, api_key, stage, model, usage["prompt_tokens"], cached_tokens, usage["completion_tokens"], cost)
+        )
+        for limit in self.limits:
+            limit.spend(api_key, cost, now)
+        if len(self._pending) >= USAGE_FLUSH_ROWS and self._wakeup is not None:
+            self._wakeup.set()
+
+    def check_quota(self, api_key):
+        """Raise QuotaExceeded if `api_key` has used up any of its rolling limits."""
+        for limit in self.limits:
+            limit.check(api_key)
+
+    def quota_status(self, api_key):
+        return {limit.name: limit.status(api_key) for limit in self.limits if limit.limit > 0}
+
+    def _load_spending(self, api_keys):
+        """(hour end, dollars) rows per key from the hourly summaries, covering the longest window."""
+        active = [limit for limit in self.limits if limit.limit > 0]
+        if not active:
+            return {}
+        since = time.time() - max(limit.window for limit in active) - HOUR
+        conn = self._connect()
+        try:
+            return {
+                api_key: conn.execute(
+                    "SELECT hour + ?, SUM(cost) FROM usage_hourly WHERE api_key = ? AND hour >= ? "
+                    "GROUP BY hour ORDER BY hour",
+                    (HOUR, api_key, since),
+                ).fetchall()
+                for api_key in api_keys
+            }
+        finally:
+            conn.close()
+
+    async def seed(self, api_keys):
+        """Rebuild the limits of `api_keys` from the shared summaries plus this process's unwritten calls.
+
+        Only the read happens in a thread; the limits and the buffer are only touched on the event loop.
+        Each hour is counted as spent at its end, so the limits err on the strict side.
+        """
+        self._seeded.update(api_keys)
+        spending = await asyncio.to_thread(self._load_spending, list(api_keys))
+        now = time.time()
+        for api_key, hours in spending.items():
+            pending = [(created_at, cost) for created_at, key, *_, cost in self._pending if key == api_key]
+            for limit in self.limits:
+                limit.replay(api_key, hours + pending, now)
+
+    def _write(self, rows):
+        hourly = defaultdict(lambda: [0, 0, 0, 0, 0.0])
+        for created_at, api_key, stage, model, prompt_tokens, cached_tokens, completion_tokens, cost in rows:
+            totals = hourly[(int(created_at) - int(created_at) % HOUR, api_key, stage, model)]
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += cached_tokens
+            totals[3] += completion_tokens
+            totals[4] += cost
+        conn = self._connect()
+        try:
+            conn.executemany(
+                "INSERT INTO usage_events (created_at, api_key, stage, model, prompt_tokens, cached_tokens, "
+                "completion_tokens, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.executemany(
+                "INSERT INTO usage_hourly (hour, api_key, stage, model, calls, prompt_tokens, cached_tokens, "
+                "completion_tokens, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (hour, api_key, stage, model) DO UPDATE SET "
+                "calls = calls + excluded.calls, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "cached_tokens = cached_tokens + excluded.cached_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, cost = cost + excluded.cost",
+                [(*key, *totals) for key, totals in hourly.items()],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    async def flush(self):
+        """Write buffered calls, then refresh the limits of seeded keys with other processes' spending."""
+        async with self._flush_lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except sqlite3.Error as e:
+                logger.error(f"Writing {len(rows)} usage records failed, will retry: {e}")
+                self._pending = rows + self._pending
+                return
+            if self._seeded:
+                await self.seed(self._seeded)
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=USAGE_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self, api_keys=()):
+        """Seed the limits of `api_keys` from the ledger, then start writing buffered calls."""
+        await self.seed(api_keys)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def aggregate(self, since, until=None, group_by=GROUP_COLUMNS, period="total", api_key=None):
+        """Sum calls, tokens and dollars from the hourly summaries, per period and `group_by` columns."""
+        columns = [column for column in group_by if column in GROUP_COLUMNS]
+        where, params = ["hour >= ?"], [since - since % HOUR]
+        if until is not None:
+            where.append("hour < ?")
+            params.append(until)
+        if api_key is not None:
+            where.append("api_key = ?")
+            params.append(api_key)
+        select = ", ".join([f"{PERIODS[period]} AS period", *columns])
+        group = ", ".join(["period", *columns])
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {select}, SUM(calls), SUM(prompt_tokens), SUM(cached_tokens), SUM(completion_tokens), "
+                f"SUM(cost) FROM usage_hourly WHERE {' AND '.join(where)} GROUP BY {group} ORDER BY {group}",
+                params,
+            ).fetchall()
+        finally:
+            conn.close()
+        fields = ["period", *columns, "calls", "prompt_tokens", "cached_tokens", "completion_tokens", "cost"]
+        results = [dict(zip(fields, row)) for row in rows]
+        if period == "total":
+            for result in results:
+                del result["period"]
+        return results
+
+
+usage_ledger = UsageLedger(USAGE_PATH, [
+    SpendingLimit("daily", USAGE_DAILY_LIMIT, DAY),
+    SpendingLimit("monthly", USAGE_MONTHLY_LIMIT, 30 * DAY),
+])
@@ -1,18 +1,29 @@
 import re
+import html
+import json
+import random
+import asyncio
 import logging
-import requests
-from bs4 import BeautifulSoup
+import httpx
 import time
-from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound  # Add these imports
+from xml.etree import ElementTree
 import urllib.parse  # Add this import
-import os  # Add this import
+import io
+from array import array
+from app.config import (
+    YOUTUBE_BASE_URL,
+    YOUTUBE_MAX_CONNECTIONS,
+    YOUTUBE_MAX_CONCURRENCY,
+    YOUTUBE_TIMEOUT_SECONDS,
+    YOUTUBE_TIMEOUT_BUDGET_SECONDS,
+    YOUTUBE_RETRIES
+)
+from app.metrics import instrument
+from app.llm import cached_prompt_tokens, usage_cost
+from app.transcripts import Transcript, VIDEO_ID_PATTERN
 
 logger = logging.getLogger(__name__)
 
-# Set log level based on environment
-log_level = os.getenv("LOG_LEVEL", "INFO").upper()
-logger.setLevel(getattr(logging, log_level, logging.INFO))
-
 def get_video_id(identifier):
     logger.info(f"Attempting to extract video ID from identifier: {identifier}")
     
@@ -20,7 +31,7 @@ def get_video_id(identifier):
     identifier = urllib.parse.unquote(identifier)
     
     # Check if the identifier is already a video ID
-    if re.match(r'^[a-zA-Z0-9_-]{11}$', identifier):
+    if VIDEO_ID_PATTERN.match(identifier):
         logger.info(f"Identifier is already a valid video ID: {identifier}")
         return identifier
     
@@ -34,7 +45,8 @@ def get_video_id(identifier):
     
     for pattern in patterns:
         match = re.search(pattern, identifier)
-        if match:
+        # Anything else could be a path or a query for another video, not an ID
+        if match and VIDEO_ID_PATTERN.match(match.group(0)):
             result = match.group(0)
             logger.info(f"Extracted video ID: {result}")
             return result
@@ -42,72 +54,264 @@ def get_video_id(identifier):
     logger.warning(f"Could not extract video ID from identifier: {identifier}")
     return None
 
-def get_video_details(video_id):
-    logger.info(f"Fetching video details for video ID: {video_id}")
-    url = f"https://www.youtube.com/watch?v={video_id}"
+WATCH_PAGE_CHUNK_SIZE = 64 * 1024
 
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
+# Patterns for the metadata we need from the watch page, in order of preference
+TITLE_PATTERNS = [
+    re.compile(r'<meta name="title" content="([^"]*)"'),
+    re.compile(r'"videoDetails":\{[^{}]*?"title":"((?:[^"\\]|\\.)*)"'),
+]
+CHANNEL_PATTERNS = [
+    re.compile(r'"ownerChannelName":"((?:[^"\\]|\\.)*)"'),
+    re.compile(r'"videoDetails":\{[^{}]*?"author":"((?:[^"\\]|\\.)*)"'),
+    re.compile(r'<link itemprop="name" content="([^"]*)"'),
+]
+HTML_TAG_PATTERN = re.compile(r'<[^>]*>')
+CONSENT_VALUE_PATTERN = re.compile(r'name="v" value="(.*?)"')
+PLAYER_RESPONSE_PATTERN = re.compile(r'ytInitialPlayerResponse\s*=\s*(?=\{)')
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+_youtube_client = None
+_youtube_semaphore = asyncio.Semaphore(YOUTUBE_MAX_CONCURRENCY)
 
-        details = {
-            "title": "Unknown Title",
-            "channel": "Unknown Channel"
-        }
+class TranscriptUnavailable(Exception):
+    pass
+
+def get_youtube_client():
+    """Return the process-wide pooled YouTube client, creating it on first use."""
+    global _youtube_client
+    if _youtube_client is None or _youtube_client.is_closed:
+        _youtube_client = httpx.AsyncClient(
+            headers={"Accept-Language": "en-US", "User-Agent": "Mozilla/5.0 (personal-automation-api)"},
+            timeout=httpx.Timeout(YOUTUBE_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=YOUTUBE_MAX_CONNECTIONS, max_keepalive_connections=YOUTUBE_MAX_CONNECTIONS),
+            follow_redirects=True
+        )
+    return _youtube_client
+
+async def close_youtube_client():
+    global _youtube_client
+    if _youtube_client is not None:
+        await _youtube_client.aclose()
+        _youtube_client = None
+
+async def _youtube_request(description, attempt):
+    """Run `attempt` under the YouTube concurrency limit, retrying transient failures with jittered
+    backoff until YOUTUBE_RETRIES or the YOUTUBE_TIMEOUT_BUDGET_SECONDS budget runs out."""
+    deadline = time.monotonic() + YOUTUBE_TIMEOUT_BUDGET_SECONDS
+    for attempt_number in range(YOUTUBE_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        try:
+            async with _youtube_semaphore:
+                return await asyncio.wait_for(attempt(get_youtube_client()), timeout=remaining)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 429 and e.response.status_code < 500:
+                raise
+            error = e
+        except (httpx.TransportError, asyncio.TimeoutError) as e:
+            error = e
+        delay = min(2 ** attempt_number + random.uniform(0, 1), deadline - time.monotonic())
+        if attempt_number == YOUTUBE_RETRIES or delay <= 0:
+            break
+        logger.warning(f"{description} failed ({error!r}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+    raise error
+
+def _decode_match(match):
+    value = match.group(1)
+    if match.re.pattern.startswith("<"):
+        return html.unescape(value)
+    return json.loads(f'"{value}"')
+
+async def _fetch_oembed_details(video_id):
+    # oEmbed returns a ~1KB JSON document with exactly the fields we need
+    params = {"url": f"https://www.youtube.com/watch?v={video_id}", "format": "json"}
+
+    async def attempt(client):
+        return await client.get(f"{YOUTUBE_BASE_URL}/oembed", params=params)
+
+    response = await _youtube_request(f"oEmbed lookup for {video_id}", attempt)
+    if response.status_code != 200:
+        logger.info(f"oEmbed lookup for {video_id} returned {response.status_code}")
+        return None
+    data = response.json()
+    if not data.get("title") or not data.get("author_name"):
+        return None
+    return {"title": data["title"], "channel": data["author_name"]}
+
+async def _stream_watch_page_details(video_id):
+    """Scan the watch page as it downloads and stop once title and channel are found.
+
+    Returns the details (or None) and the HTML read so far, for the full parser to fall back on.
+    """
+    url = f"{YOUTUBE_BASE_URL}/watch?v={video_id}"
+
+    async def attempt(client):
+        chunks = []
+        title = channel = None
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            tail = ""
+            async for chunk in response.aiter_text(WATCH_PAGE_CHUNK_SIZE):
+                chunks.append(chunk)
+                # Only search the new chunk plus enough overlap to catch matches split across chunks
+                window = tail + chunk
+                if title is None:
+                    title = next((_decode_match(m) for p in TITLE_PATTERNS if (m := p.search(window))), None)
+                if channel is None:
+                    channel = next((_decode_match(m) for p in CHANNEL_PATTERNS if (m := p.search(window))), None)
+                if title and channel:
+                    logger.info(f"Found video details after {sum(len(c) for c in chunks)} characters")
+                    return {"title": title, "channel": channel}, None
+                tail = window[-4096:]
+        return None, "".join(chunks)
+
+    return await _youtube_request(f"Watch page fetch for {video_id}", attempt)
+
+def _parse_watch_page_details(html_content):
+    # Only needed when the watch page has to be parsed, so kept out of startup
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    details = {
+        "title": "Unknown Title",
+        "channel": "Unknown Channel"
+    }
+
+    # Try to get title
+    meta_title = soup.find('meta', {'name': 'title'})
+    if meta_title and 'content' in meta_title.attrs:
+        details["title"] = meta_title['content']
+    else:
+        title_tag = soup.find('title')
+        if title_tag:
+            details["title"] = title_tag.string.split(' - YouTube')[0]
 
-        # Try to get title
-        meta_title = soup.find('meta', {'name': 'title'})
-        if meta_title and 'content' in meta_title.attrs:
-            details["title"] = meta_title['content']
-        else:
-            title_tag = soup.find('title')
-            if title_tag:
-                details["title"] = title_tag.string.split(' - YouTube')[0]
-
-        # Try multiple selectors for channel name
-        selectors = [
-            '#channel-name #text',
-            'yt-formatted-string[id="text"][class="ytd-channel-name"]',
-            'yt-formatted-string[class="ytd-channel-name"]',
-            'a[class="yt-simple-endpoint style-scope yt-formatted-string"]'
-        ]
-
-        for selector in selectors:
-            channel_element = soup.select_one(selector)
-            if channel_element:
-                details["channel"] = channel_element.text.strip()
-                logger.info(f"Found channel name using selector: {selector}")
-                break
-
-        if details["channel"] == "Unknown Channel":
-            logger.warning("Could not find channel name using any selector")
-            logger.debug(f"HTML content length: {len(soup.prettify())}")
+    # Try multiple selectors for channel name
+    selectors = [
+        '#channel-name #text',
+        'yt-formatted-string[id="text"][class="ytd-channel-name"]',
+        'yt-formatted-string[class="ytd-channel-name"]',
+        'a[class="yt-simple-endpoint style-scope yt-formatted-string"]'
+    ]
+
+    for selector in selectors:
+        channel_element = soup.select_one(selector)
+        if channel_element:
+            details["channel"] = channel_element.text.strip()
+            logger.info(f"Found channel name using selector: {selector}")
+            break
+
+    if details["channel"] == "Unknown Channel":
+        logger.warning("Could not find channel name using any selector")
+        if logger.isEnabledFor(logging.DEBUG):
             with open('debug_html_content.log', 'w', encoding='utf-8') as f:
-                f.write(soup.prettify())
-            logger.debug("Full HTML content saved to debug_html_content.log")
+                f.write(html_content)
+            logger.debug(f"Full HTML content ({len(html_content)} characters) saved to debug_html_content.log")
+
+    return details
+
+@instrument("video_details")
+async def get_video_details(video_id):
+    logger.info(f"Fetching video details for video ID: {video_id}")
+
+    try:
+        details = await _fetch_oembed_details(video_id)
+        if not details:
+            details, html_content = await _stream_watch_page_details(video_id)
+            if not details:
+                logger.info("Falling back to full watch page parsing")
+                # Parsing a full watch page is CPU-bound, keep it off the event loop
+                details = await asyncio.to_thread(_parse_watch_page_details, html_content)
 
         logger.info(f"Retrieved video details: {details}")
         return details
 
-    except requests.RequestException as e:
+    except (httpx.HTTPError, asyncio.TimeoutError, ValueError) as e:
         logger.error(f"Error fetching video details: {str(e)}")
         return {
             "title": "Error Fetching Title",
             "channel": "Error Fetching Channel"
         }
 
-def get_transcription(video_id: str) -> str:
+async def _fetch_captions_json(video_id):
+    url = f"{YOUTUBE_BASE_URL}/watch?v={video_id}"
+
+    async def attempt(client):
+        response = await client.get(url)
+        response.raise_for_status()
+        page = response.text
+        if 'action="https://consent.youtube.com/s"' in page:
+            # Accept the EU consent interstitial the same way a browser would, then reload
+            match = CONSENT_VALUE_PATTERN.search(page)
+            if not match:
+                raise TranscriptUnavailable("Could not accept the YouTube consent page")
+            client.cookies.set("CONSENT", "YES+" + match.group(1), domain=".youtube.com")
+            response = await client.get(url)
+            response.raise_for_status()
+            page = response.text
+        return page
+
+    page = await _youtube_request(f"Watch page fetch for {video_id}", attempt)
+    player_response = await asyncio.to_thread(_parse_player_response, page)
+    if 'captions' not in player_response:
+        raise TranscriptUnavailable("Transcripts are disabled or the video is unavailable")
+    captions = player_response['captions'].get('playerCaptionsTracklistRenderer')
+    if not captions or 'captionTracks' not in captions:
+        raise TranscriptUnavailable("No caption tracks found")
+    return captions
+
+def _parse_player_response(page):
+    """Decode the whole `ytInitialPlayerResponse` object assigned in the watch page's scripts."""
+    match = PLAYER_RESPONSE_PATTERN.search(page)
+    if not match:
+        raise TranscriptUnavailable("The watch page has no player response")
+    # raw_decode stops at the end of the object, wherever the script carries on after it
+    player_response, _ = json.JSONDecoder().raw_decode(page, match.end())
+    return player_response
+
+def _select_caption_track(caption_tracks, languages=('en',)):
+    # Prefer manually created captions over auto-generated ones, matching YouTubeTranscriptApi
+    for generated in (False, True):
+        for language in languages:
+            for track in caption_tracks:
+                if (track.get('kind', '') == 'asr') == generated and track['languageCode'] == language:
+                    return track
+    raise TranscriptUnavailable(f"No transcript in {', '.join(languages)}")
+
+def _parse_transcript_xml(xml_content):
+    # Stream captions straight into the Transcript's columns rather than building an element
+    # tree and a dict per caption first
+    texts, starts, durations = [], array("I"), array("I")
+    for _, element in ElementTree.iterparse(io.StringIO(xml_content)):
+        if element.tag == "text" and element.text is not None:
+            texts.append(HTML_TAG_PATTERN.sub('', html.unescape(element.text)))
+            starts.append(round(float(element.attrib['start']) * 1000))
+            durations.append(round(float(element.attrib.get('dur', '0.0')) * 1000))
+        element.clear()
+    return Transcript.from_texts(texts, starts, durations)
+
+@instrument("transcript")
+async def get_transcript_segments(video_id: str) -> Transcript:
     try:
-        transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
-        transcription = " ".join([entry['text'] for entry in transcript_list])
-        return transcription
-    except (TranscriptsDisabled, NoTranscriptFound) as e:
+        captions = await _fetch_captions_json(video_id)
+        track = _select_caption_track(captions['captionTracks'])
+
+        async def attempt(client):
+            response = await client.get(track['baseUrl'])
+            response.raise_for_status()
+            return response.text
+
+        xml_content = await _youtube_request(f"Transcript fetch for {video_id}", attempt)
+        return _parse_transcript_xml(xml_content)
+    except (TranscriptUnavailable, ElementTree.ParseError, ValueError) as e:
         logger.error(f"No transcript available for video ID {video_id}: {e}")
-        return ""
+        return Transcript.from_texts([], array("I"), array("I"))
+
+async def get_transcription(video_id: str) -> str:
+    return (await get_transcript_segments(video_id)).text
 
 def calculate_cost(usage, model_costs, model):
-    input_cost = usage.prompt_tokens * model_costs[model]["input"] / 1000
-    output_cost = usage.completion_tokens * model_costs[model]["output"] / 1000
-    return input_cost + output_cost
+    cached_tokens = cached_prompt_tokens(usage)
+    if cached_tokens:
+        logger.info(f"{cached_tokens} of {usage['prompt_tokens']} prompt tokens served from the prompt cache")
+    return usage_cost(model, usage, model_costs.get(model))
@@ -0,0 +1,111 @@
+"""Peak memory of a single YouTube notes request against local OpenAI and YouTube stand-ins.
+
+Each scenario runs in fresh processes. The stand-ins get a process of their own so their
+allocations are not counted. The measuring process imports the app and makes one small warm-up
+call, then runs full_process for one video and serializes the response the way the endpoint
+does. It reports the peak Python heap during the request (tracemalloc), the process's peak RSS
+and how much the request raised it.
+
+    python -m benchmarks.memory --sections 20 --segments 600 5000 20000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from benchmarks.mock_servers import MockOpenAI, MockYouTube, free_port, serve_in_thread
+
+
+def serve_mocks(sections, segments, openai_port, youtube_port):
+    mock_openai = MockOpenAI(sections, latency_ms=20, tokens_per_second=100_000, completion_tokens=300)
+    mock_youtube = MockYouTube(segments, latency_ms=0, page_padding_bytes=0)
+    mock_youtube.base_url = f"http://127.0.0.1:{youtube_port}"
+    serve_in_thread(mock_openai.app, openai_port)
+    serve_in_thread(mock_youtube.app, youtube_port)
+    threading.Event().wait()
+
+
+def measure(openai_port, youtube_port, results):
+    # Point the app at the stand-ins before it is imported
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "YOUTUBE_BASE_URL": f"http://127.0.0.1:{youtube_port}",
+        "DATA_DIR": tempfile.mkdtemp(prefix="memory-benchmark-"),
+    })
+    from app.pipeline import full_process
+    from app.stages import video_details_stage
+    logging.disable(logging.INFO)
+
+    async def run():
+        await video_details_stage("warmupvideo")
+        gc.collect()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = await full_process("memoryvideo", "gpt-4o-mini")
+        body = json.dumps(response)
+        elapsed = time.perf_counter() - start
+        _, heap_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {
+            "transcript_bytes": len(response["transcription"]),
+            "response_bytes": len(body),
+            "heap_peak": heap_peak,
+            "rss_peak": rss_peak * 1024,
+            "rss_growth": (rss_peak - rss_before) * 1024,
+            "seconds": elapsed,
+        }
+
+    results.put(asyncio.run(run()))
+
+
+def run_scenario(context, sections, segments):
+    openai_port, youtube_port = free_port(), free_port()
+    mocks = context.Process(target=serve_mocks, args=(sections, segments, openai_port, youtube_port), daemon=True)
+    mocks.start()
+    try:
+        time.sleep(2)
+        results = context.Queue()
+        worker = context.Process(target=measure, args=(openai_port, youtube_port, results))
+        worker.start()
+        result = results.get(timeout=600)
+        worker.join()
+    finally:
+        mocks.terminate()
+        mocks.join()
+    return {"segments": segments, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=20, help="Outline bullets returned by the mock LLM")
+    parser.add_argument("--segments", type=int, nargs="+", default=[600, 5000, 20000], help="Transcript segments per scenario")
+    args = parser.parse_args()
+
+    # Spawn so each measurement starts from a clean interpreter
+    context = multiprocessing.get_context("spawn")
+    mb = 1024 * 1024
+    header = f"{'segments':>9}{'transcript KB':>15}{'response KB':>13}{'heap peak MB':>14}{'RSS peak MB':>13}{'RSS growth MB':>15}{'seconds':>9}"
+    print(f"{args.sections} sections")
+    print(header)
+    print("-" * len(header))
+    for segments in args.segments:
+        r = run_scenario(context, args.sections, segments)
+        print(
+            f"{r['segments']:>9}{r['transcript_bytes'] / 1024:>15,.0f}{r['response_bytes'] / 1024:>13,.0f}"
+            f"{r['heap_peak'] / mb:>14.1f}{r['rss_peak'] / mb:>13.1f}{r['rss_growth'] / mb:>15.1f}{r['seconds']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Local stand-ins for the OpenAI chat completions API and YouTube watch pages/transcripts."""
+import asyncio
+import json
+import socket
+import threading
+import time
+from html import escape
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+
+
+class MockOpenAI:
+    """Answers /v1/chat/completions after a simulated delay.
+
+    Latency is `latency_ms` plus `completion_tokens / tokens_per_second`. Function calls for
+    the outline and transcription errors return well-formed arguments so the real pipeline runs.
+    With `max_concurrency` set, requests beyond that many in flight get a 429 with Retry-After.
+    """
+
+    def __init__(self, sections=5, latency_ms=200, tokens_per_second=200, completion_tokens=400, max_concurrency=0):
+        self.sections = sections
+        self.max_concurrency = max_concurrency
+        self.rate_limited = 0
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.chat_completions)
+
+    def reset(self):
+        self.calls = self.prompt_tokens = self.max_in_flight = self.rate_limited = 0
+
+    def _arguments(self, function_name):
+        if function_name == "outline_response":
+            outline = "\n".join(
+                f"{i}. Section {i}\n   - Detail {i}.1\n   - Detail {i}.2" for i in range(1, self.sections + 1)
+            )
+            return {"outline": outline, "num_bullets": self.sections}
+        return {"errors": [{"word": "pithon", "context": "writing pithon code", "likely_correct_spelling": "Python"}]}
+
+    async def chat_completions(self, request: Request):
+        body = await request.json()
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            self.rate_limited += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after-ms": "250"}
+            )
+        prompt_tokens = sum(len(message.get("content") or "") for message in body["messages"]) // 4
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": prompt_tokens + self.completion_tokens
+        }
+        duration = self.latency_ms / 1000 + self.completion_tokens / self.tokens_per_second
+        content = "## Mock Section\n\n" + "lorem " * self.completion_tokens
+
+        if body.get("stream"):
+            async def stream():
+                try:
+                    pieces = 10
+                    for i in range(pieces):
+                        await asyncio.sleep(duration / pieces)
+                        piece = content[i * len(content) // pieces:(i + 1) * len(content) // pieces]
+                        yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': piece}}]})}\n\n"
+                    yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+                    yield "data: [DONE]\n\n"
+                finally:
+                    self.in_flight -= 1
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self.in_flight -= 1
+        message = {"role": "assistant", "content": content}
+        function_call = body.get("function_call")
+        if function_call:
+            name = function_call["name"]
+            message = {
+                "role": "assistant",
+                "content": None,
+                "function_call": {"name": name, "arguments": json.dumps(self._arguments(name))}
+            }
+        return JSONResponse({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "model": body["model"],
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+
+class MockYouTube:
+    """Serves watch pages with title/channel metadata and caption tracks, plus timedtext transcripts."""
+
+    def __init__(self, segments=600, latency_ms=50, page_padding_bytes=500_000, oembed=True):
+        self.segments = segments
+        self.oembed_enabled = oembed
+        self.latency_ms = latency_ms
+        self.page_padding_bytes = page_padding_bytes
+        self.base_url = None
+        self.page_requests = 0
+        self.transcript_requests = 0
+        self.app = FastAPI()
+        self.app.get("/oembed")(self.oembed)
+        self.app.get("/watch")(self.watch)
+        self.app.get("/api/timedtext")(self.timedtext)
+
+    def reset(self):
+        self.page_requests = self.transcript_requests = 0
+
+    async def oembed(self, url: str):
+        self.page_requests += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        if not self.oembed_enabled:
+            return JSONResponse({"error": "Not Found"}, status_code=404)
+        video_id = url.split("v=")[-1]
+        return JSONResponse({"title": f"Benchmark Video {video_id}", "author_name": "Benchmark Channel", "type": "video"})
+
+    async def watch(self, v: str):
+        self.page_requests += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        title = f"Benchmark Video {v}"
+        captions = {
+            "playerCaptionsTracklistRenderer": {
+                "captionTracks": [{
+                    "baseUrl": f"{self.base_url}/api/timedtext?v={v}",
+                    "name": {"simpleText": "English (auto-generated)"},
+                    "languageCode": "en",
+                    "kind": "asr",
+                    "isTranslatable": False
+                }],
+                "translationLanguages": []
+            }
+        }
+        player_response = {
+            "captions": captions,
+            "videoDetails": {"videoId": v, "title": title, "author": "Benchmark Channel"}
+        }
+        # Real watch pages are mostly scripts and markup unrelated to the metadata we need
+        padding = "<script>var filler = '" + "x" * self.page_padding_bytes + "';</script>"
+        html = (
+            "<html><head>"
+            f"<title>{escape(title)} - YouTube</title>"
+            f"<meta name=\"title\" content=\"{escape(title)}\">"
+            "</head><body>"
+            f"{padding}"
+            f"<span itemprop=\"author\"><link itemprop=\"name\" content=\"Benchmark Channel\"></span>"
+            "<div id=\"channel-name\"><div id=\"text\">Benchmark Channel</div></div>"
+            f"<script>var ytInitialPlayerResponse = {json.dumps(player_response, separators=(',', ':'))};</script>"
+            "</body></html>"
+        )
+        return HTMLResponse(html)
+
+    async def timedtext(self, v: str):
+        self.transcript_requests += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        topics = ["python", "latency", "caching", "throughput", "pipelines", "concurrency"]
+        texts = []
+        for i in range(self.segments):
+            topic = topics[(i * len(topics)) // self.segments]
+            texts.append(
+                f'<text start="{i * 2.0:.1f}" dur="2.0">we talk about {topic} and pithon number {i}</text>'
+            )
+        xml = '<?xml version="1.0" encoding="utf-8" ?><transcript>' + "".join(texts) + "</transcript>"
+        return Response(xml, media_type="text/xml")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app, port):
+    """Start uvicorn for `app` on a daemon thread and wait until it accepts connections."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Server on port {port} did not start")
+        time.sleep(0.05)
+    return server
@@ -0,0 +1,169 @@
+"""End-to-end pipeline benchmark against local OpenAI and YouTube stand-ins.
+
+Starts the mock servers and the real FastAPI app on local ports, then drives
+/youtube_notes/full_process, /youtube_notes/generate_summary and a batch of concurrent
+full_process requests. Reports p50/p95 latency, throughput and LLM calls per video.
+Nothing leaves the machine and no API key is needed.
+
+    python -m benchmarks.pipeline --videos 5 --concurrency 5 --sections 8 --llm-latency-ms 300
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import string
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.mock_servers import MockOpenAI, MockYouTube, free_port, serve_in_thread
+
+API_KEY = "benchmark-api-key"
+
+
+def video_ids(prefix, count):
+    # Video ids are 11 characters; every scenario uses fresh ids so it starts cold
+    alphabet = string.ascii_letters
+    return [f"{prefix}{alphabet[i // 52 % 52]}{alphabet[i % 52]}".ljust(11, "x")[:11] for i in range(count)]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Scenario:
+    def __init__(self, name, videos, concurrency, request_factory, warm=False):
+        self.name = name
+        self.videos = videos
+        self.concurrency = concurrency
+        self.request_factory = request_factory
+        self.warm = warm
+
+
+async def run_scenario(client, scenario, mock_openai, mock_youtube):
+    if scenario.warm:
+        # Populate the stage cache outside the measured run
+        for video_id in scenario.videos:
+            await scenario.request_factory(client, video_id)
+    mock_openai.reset()
+    mock_youtube.reset()
+    semaphore = asyncio.Semaphore(scenario.concurrency)
+    latencies, failures = [], 0
+
+    async def one(video_id):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            response = await scenario.request_factory(client, video_id)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(video_id) for video_id in scenario.videos))
+    elapsed = time.perf_counter() - start
+    return {
+        "scenario": scenario.name,
+        "requests": len(scenario.videos),
+        "concurrency": scenario.concurrency,
+        "failures": failures,
+        "p50": statistics.median(latencies),
+        "p95": percentile(latencies, 95),
+        "throughput": len(scenario.videos) / elapsed,
+        "llm_calls_per_video": mock_openai.calls / len(scenario.videos),
+        "prompt_tokens_per_video": mock_openai.prompt_tokens / len(scenario.videos),
+        "max_llm_in_flight": mock_openai.max_in_flight,
+        "rate_limited": mock_openai.rate_limited,
+        "youtube_requests_per_video": (mock_youtube.page_requests + mock_youtube.transcript_requests) / len(scenario.videos),
+    }
+
+
+def print_results(results):
+    header = f"{'scenario':<24}{'reqs':>6}{'conc':>6}{'fail':>6}{'p50 s':>9}{'p95 s':>9}{'req/s':>9}{'llm/video':>11}{'prompt tok/video':>18}{'max llm':>9}{'429s':>7}{'yt/video':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['scenario']:<24}{r['requests']:>6}{r['concurrency']:>6}{r['failures']:>6}"
+            f"{r['p50']:>9.2f}{r['p95']:>9.2f}{r['throughput']:>9.2f}{r['llm_calls_per_video']:>11.1f}"
+            f"{r['prompt_tokens_per_video']:>18,.0f}{r['max_llm_in_flight']:>9}{r['rate_limited']:>7}{r['youtube_requests_per_video']:>10.1f}"
+        )
+
+
+async def full_process_request(client, video_id):
+    return await client.post(
+        "/youtube_notes/full_process",
+        params={"model": "gpt-4o-mini"},
+        json={"url": f"https://www.youtube.com/watch?v={video_id}"}
+    )
+
+
+async def generate_summary_request(client, video_id):
+    return await client.post("/youtube_notes/generate_summary", params={"model": "gpt-4o-mini", "video_id": video_id})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--videos", type=int, default=5, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=5, help="Concurrent requests in the batch scenario")
+    parser.add_argument("--sections", type=int, default=6, help="Outline bullets returned by the mock LLM")
+    parser.add_argument("--segments", type=int, default=600, help="Transcript segments per video")
+    parser.add_argument("--llm-latency-ms", type=int, default=200)
+    parser.add_argument("--tokens-per-second", type=int, default=400)
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument(
+        "--llm-rate-limit", type=int, default=0,
+        help="Answer 429 once this many LLM requests are in flight (0 disables)"
+    )
+    parser.add_argument("--youtube-latency-ms", type=int, default=50)
+    parser.add_argument("--no-oembed", action="store_true", help="Make the YouTube stand-in reject oEmbed lookups")
+    args = parser.parse_args()
+
+    mock_openai = MockOpenAI(
+        args.sections, args.llm_latency_ms, args.tokens_per_second, args.completion_tokens, args.llm_rate_limit
+    )
+    mock_youtube = MockYouTube(args.segments, args.youtube_latency_ms, oembed=not args.no_oembed)
+    openai_port, youtube_port, app_port = free_port(), free_port(), free_port()
+    mock_youtube.base_url = f"http://127.0.0.1:{youtube_port}"
+    serve_in_thread(mock_openai.app, openai_port)
+    serve_in_thread(mock_youtube.app, youtube_port)
+
+    # Point the app at the stand-ins before it is imported
+    os.environ.update({
+        "API_KEY": API_KEY,
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "YOUTUBE_BASE_URL": mock_youtube.base_url,
+        "DATA_DIR": tempfile.mkdtemp(prefix="pipeline-benchmark-"),
+    })
+    from app.main import app
+    logging.disable(logging.INFO)
+
+    serve_in_thread(app, app_port)
+
+    scenarios = [
+        Scenario("full_process", video_ids("fp", args.videos), 1, full_process_request),
+        Scenario("generate_summary", video_ids("gs", args.videos), 1, generate_summary_request),
+        Scenario("full_process concurrent", video_ids("cc", args.videos), args.concurrency, full_process_request),
+        Scenario("full_process cached", video_ids("ca", args.videos), 1, full_process_request, warm=True),
+    ]
+
+    async def run_all():
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{app_port}", headers={"X-API-Key": API_KEY}, timeout=600
+        ) as client:
+            return [await run_scenario(client, scenario, mock_openai, mock_youtube) for scenario in scenarios]
+
+    print(
+        f"{args.sections} sections, {args.segments} transcript segments, "
+        f"LLM {args.llm_latency_ms}ms + {args.completion_tokens} tokens @ {args.tokens_per_second} tok/s"
+    )
+    print_results(asyncio.run(run_all()))
+
+
+if __name__ == "__main__":
+    main()
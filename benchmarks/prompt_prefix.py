@@ -0,0 +1,126 @@
+"""Compare the legacy and stable-prefix section prompt layouts for one video.
+
+Offline (default) the script builds the messages for every section call of a synthetic video and
+projects how many prompt tokens the provider could serve from its prompt cache and what the
+section fan-out would cost. With --live it sends the calls to the configured OpenAI endpoint and
+reports the measured latency, cached tokens and cost.
+
+    python -m benchmarks.prompt_prefix --sections 10 --transcript-tokens 20000
+    python -m benchmarks.prompt_prefix --live --model gpt-4o-mini
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.config import model_costs
+from app.prompts import GENERATE_SUMMARY_SYSTEM_PROMPT
+from app.services import build_summary_messages
+from app.tokenizer import count_tokens
+from app.utils import calculate_cost, cached_prompt_tokens
+
+# Providers only cache prefixes of at least 1024 tokens, in 128 token increments
+MIN_CACHED_TOKENS = 1024
+CACHE_INCREMENT = 128
+
+
+def legacy_summary_messages(video_title, video_author, transcription, transcription_errors, outline, bullet_number, first_summary):
+    messages = [
+        {"role": "system", "content": GENERATE_SUMMARY_SYSTEM_PROMPT},
+        {"role": "system", "content": json.dumps(transcription_errors, indent=2)},
+        {"role": "user", "content": f"Using this outline as a reference to ensure you're covering all the points mentioned in the outline for the video titled '{video_title}' by {video_author}, your task is to create a detailed summary that DOES NOT exclude important details and examples mentioned in the source text. Let's start with bullet {bullet_number}.\n---\n\n## Video Outline\n{outline}\n\n## Video Transcription\n{transcription}\n\n"}
+    ]
+    if first_summary and bullet_number > 1:
+        messages.append({"role": "assistant", "content": first_summary})
+        messages.append({"role": "user", "content": f"Now, please summarize bullet {bullet_number} in a similar style."})
+    return messages
+
+
+def synthetic_video(sections, transcript_tokens):
+    words = ["kubernetes", "latency", "throughput", "cache", "pipeline", "python", "summary", "model"]
+    transcription = " ".join(words[i % len(words)] for i in range(transcript_tokens))[:transcript_tokens * 4]
+    outline = "\n".join(f"{i}. Section {i}\n   - Detail about {words[i % len(words)]}" for i in range(1, sections + 1))
+    errors = {"errors": [{"word": "kubernetis", "context": "running kubernetis pods", "likely_correct_spelling": "Kubernetes"}]}
+    first_summary = "## Section 1\n\n" + " ".join(words) * 40
+    return "Benchmark Video", "Benchmark Channel", transcription, errors, outline, first_summary
+
+
+def serialize(messages):
+    return "".join(f"<{message['role']}>{message['content']}" for message in messages)
+
+
+def projected_cached_tokens(prompt, previous_prompts):
+    shared = 0
+    for previous in previous_prompts:
+        length = 0
+        for a, b in zip(prompt, previous):
+            if a != b:
+                break
+            length += 1
+        shared = max(shared, length)
+    tokens = count_tokens(prompt[:shared])
+    if tokens < MIN_CACHED_TOKENS:
+        return 0
+    return tokens - tokens % CACHE_INCREMENT
+
+
+def offline_report(layout_name, build_messages, video, sections, model):
+    title, author, transcription, errors, outline, first_summary = video
+    previous, total_prompt, total_cached, total_cost = [], 0, 0, 0.0
+    for bullet_number in range(1, sections + 1):
+        messages = build_messages(title, author, transcription, errors, outline, bullet_number, first_summary if bullet_number > 1 else None)
+        prompt = serialize(messages)
+        prompt_tokens = count_tokens(prompt)
+        # Section 1 runs alone; sections 2..N are issued after it, so they can reuse its prefix and each other's
+        cached = projected_cached_tokens(prompt, previous)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": 800, "prompt_tokens_details": {"cached_tokens": cached}}
+        total_prompt += prompt_tokens
+        total_cached += cached
+        total_cost += calculate_cost(usage, model_costs, model)
+        previous.append(prompt)
+    print(f"{layout_name:>14}: prompt tokens {total_prompt:>9,}  cacheable {total_cached:>9,} ({total_cached / total_prompt:.0%})  projected cost ${total_cost:.4f}")
+
+
+async def live_report(layout_name, build_messages, video, sections, model):
+    from app.llm import chat_completion, close_client
+
+    title, author, transcription, errors, outline, _ = video
+    first_messages = build_messages(title, author, transcription, errors, outline, 1, None)
+    start = time.perf_counter()
+    response = await chat_completion(model=model, messages=first_messages)
+    first_summary = response['choices'][0]['message']['content']
+    usages = [response['usage']]
+
+    async def section(bullet_number):
+        messages = build_messages(title, author, transcription, errors, outline, bullet_number, first_summary)
+        return (await chat_completion(model=model, messages=messages))['usage']
+
+    usages += await asyncio.gather(*(section(i) for i in range(2, sections + 1)))
+    elapsed = time.perf_counter() - start
+    await close_client()
+    prompt = sum(usage["prompt_tokens"] for usage in usages)
+    cached = sum(cached_prompt_tokens(usage) for usage in usages)
+    cost = sum(calculate_cost(usage, model_costs, model) for usage in usages)
+    print(f"{layout_name:>14}: prompt tokens {prompt:>9,}  cached {cached:>9,} ({cached / prompt:.0%})  cost ${cost:.4f}  wall {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--transcript-tokens", type=int, default=20000)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--live", action="store_true", help="Send the calls to the OpenAI endpoint")
+    args = parser.parse_args()
+
+    video = synthetic_video(args.sections, args.transcript_tokens)
+    layouts = [("legacy", legacy_summary_messages), ("stable-prefix", build_summary_messages)]
+    print(f"{args.sections} section calls, ~{args.transcript_tokens:,} token transcript, {args.model}")
+    for name, build_messages in layouts:
+        if args.live:
+            asyncio.run(live_report(name, build_messages, video, args.sections, args.model))
+        else:
+            offline_report(name, build_messages, video, args.sections, args.model)
+
+
+if __name__ == "__main__":
+    main()
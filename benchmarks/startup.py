@@ -0,0 +1,116 @@
+"""Import time and cold-start time of the API server.
+
+Every run starts a fresh interpreter against an empty DATA_DIR, the way a container starts after
+an update. `import` is how long `import app.main` takes, and the slowest top-level packages (time
+spent in each package's own modules) come from `python -X importtime`. `ready` starts uvicorn and
+polls until /metrics answers, and `first request` is the first API call after that (the
+stage cache stats).
+
+    python -m benchmarks.startup --runs 5 --max-ready-ms 1000
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.mock_servers import free_port
+
+API_KEY = "benchmark-key"
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s+(\S+)")
+
+
+def _environment():
+    return {
+        **os.environ,
+        "API_KEY": API_KEY,
+        "OPENAI_API_KEY": "benchmark",
+        "DATA_DIR": tempfile.mkdtemp(prefix="startup-benchmark-"),
+        "LOG_LEVEL": "WARNING",
+    }
+
+
+def measure_import():
+    """Seconds to import app.main, and microseconds spent importing each top-level package's modules."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        env=_environment(), capture_output=True, text=True, check=True
+    )
+    packages = defaultdict(int)
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, name = match.groups()
+        packages[name.split(".")[0]] += int(self_us)
+        if name == "app.main":
+            total = int(cumulative_us)
+    return total / 1e6, packages
+
+
+def measure_ready(timeout=30):
+    """Seconds from starting uvicorn until /metrics answers, and until the first API call returns."""
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=_environment(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"Server was not ready after {timeout}s")
+                try:
+                    if client.get("/metrics", headers={"X-API-Key": API_KEY}).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.005)
+            ready = time.perf_counter() - start
+            client.get("/youtube_notes/cache/stats", headers={"X-API-Key": API_KEY}).raise_for_status()
+            first_request = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    return ready, first_request
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--top", type=int, default=8, help="Slowest top-level packages to list")
+    parser.add_argument("--max-ready-ms", type=float, help="Exit with status 1 if the median time to ready is longer")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    readiness = [measure_ready() for _ in range(args.runs)]
+
+    packages = defaultdict(list)
+    for _, run in imports:
+        for name, microseconds in run.items():
+            packages[name].append(microseconds / 1000)
+    print(f"{'median of':<16}{args.runs:>8} runs")
+    print(f"{'import app.main':<16}{statistics.median(seconds for seconds, _ in imports) * 1000:>8.0f} ms")
+    ready_ms = statistics.median(ready for ready, _ in readiness) * 1000
+    print(f"{'ready':<16}{ready_ms:>8.0f} ms")
+    print(f"{'first request':<16}{statistics.median(first for _, first in readiness) * 1000:>8.0f} ms")
+    print()
+    print("slowest packages to import (ms)")
+    slowest = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, milliseconds in slowest[:args.top]:
+        print(f"  {name:<20}{statistics.median(milliseconds):>8.1f}")
+
+    if args.max_ready_ms is not None and ready_ms > args.max_ready_ms:
+        print(f"\nReady after {ready_ms:.0f} ms, over the {args.max_ready_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Cost of the usage ledger: recording on the request path, batched writes and aggregation.
+
+Fills a fresh ledger with synthetic LLM calls spread over the last 90 days (several API keys,
+stages and models), then compares a 30-day per-key/stage/model breakdown read from the hourly
+summaries with the same query over the raw ledger.
+
+    python -m benchmarks.usage --calls 1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+API_KEYS = ("default", "phone", "laptop", "tablet", "shortcuts")
+STAGES = ("transcription_errors", "outline", "summary", "tldr", "vocabulary")
+MODELS = ("gpt-4o-mini", "gpt-4o")
+DAY = 24 * 3600
+BATCH = 500
+
+
+def timed(func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1_000_000, help="Synthetic LLM calls in the ledger")
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="usage-benchmark-")
+    from app.usage import usage_ledger, current_api_key
+
+    usage = {"prompt_tokens": 5000, "completion_tokens": 400, "prompt_tokens_details": {"cached_tokens": 1024}}
+    current_api_key.set("phone")
+    start = time.perf_counter()
+    for _ in range(100_000):
+        usage_ledger.record("summary", "gpt-4o-mini", usage, 0.001)
+    record_us = (time.perf_counter() - start) / 100_000 * 1e6
+    usage_ledger._pending = []
+
+    random.seed(0)
+    now = time.time()
+    write_seconds = 0.0
+    for offset in range(0, args.calls, BATCH):
+        rows = [
+            (
+                now - random.random() * 90 * DAY, random.choice(API_KEYS), random.choice(STAGES),
+                random.choice(MODELS), random.randint(500, 20000), 0, random.randint(50, 800), random.random() / 100
+            )
+            for _ in range(min(BATCH, args.calls - offset))
+        ]
+        start = time.perf_counter()
+        usage_ledger._write(rows)
+        write_seconds += time.perf_counter() - start
+
+    since = now - 30 * DAY
+    summary_seconds, summary = timed(lambda: usage_ledger.aggregate(since))
+    conn = sqlite3.connect(usage_ledger.path)
+    raw_seconds, raw = timed(lambda: conn.execute(
+        "SELECT api_key, stage, model, COUNT(*), SUM(prompt_tokens), SUM(cached_tokens), SUM(completion_tokens), "
+        "SUM(cost) FROM usage_events WHERE created_at >= ? GROUP BY api_key, stage, model",
+        (since,),
+    ).fetchall())
+    hourly_rows = conn.execute("SELECT COUNT(*) FROM usage_hourly").fetchone()[0]
+    conn.close()
+    asyncio.run(usage_ledger.stop())
+
+    print(f"{args.calls:,} calls in the ledger, {hourly_rows:,} hourly summary rows")
+    print(f"{'record (request path)':<32}{record_us:>10.2f} us per call")
+    print(f"{'batched write':<32}{write_seconds / args.calls * 1e6:>10.2f} us per call")
+    print(f"{'30-day breakdown, summaries':<32}{summary_seconds * 1000:>10.1f} ms")
+    print(f"{'30-day breakdown, raw ledger':<32}{raw_seconds * 1000:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
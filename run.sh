@@ -7,6 +7,7 @@ readonly IMAGE_NAME="personal-automation-api"
 readonly CONTAINER_NAME="personal-automation-api"
 readonly PORT=1621
 readonly ENV_FILE=".env"
+readonly DATA_VOLUME="personal-automation-data"
 
 # Helper functions
 log() { echo "$(date +'%Y-%m-%d %H:%M:%S') $*" >&2; }
@@ -30,6 +31,26 @@ run_container() {
                uvicorn app.main:app --host 0.0.0.0 --port "$PORT" --reload
 }
 
+# Production mode: no reload, one worker process per core (or WEB_CONCURRENCY), state kept in a volume
+run_production() {
+    local workers=${WEB_CONCURRENCY:-$(nproc)}
+    log "Starting $workers worker processes"
+    docker run -d --restart unless-stopped --name "$CONTAINER_NAME" \
+               -p "$PORT:$PORT" \
+               --env-file "$ENV_FILE" \
+               -e WEB_CONCURRENCY="$workers" \
+               -v "$DATA_VOLUME:/app/data" \
+               "$IMAGE_NAME"
+}
+
+start_production() {
+    build_image
+    stop_container
+    remove_container
+    run_production
+    log "API is running at http://localhost:$PORT"
+}
+
 start_container() {
     local detach_flag=${1:-}
     build_image
@@ -65,6 +86,8 @@ Commands:
   shell   - Execute a shell inside the running container
   cleanup - Clean up dangling Docker images
   start   - Build and run the Docker container with hot reloading
+  prod    - Build and run the container detached with one worker process per core
+            (set WEB_CONCURRENCY to override)
 
 Options:
   -d      - Run in detached mode (applicable to 'run' and 'start' commands)
@@ -91,6 +114,7 @@ main() {
         shell)   exec_shell ;;
         cleanup) cleanup_images ;;
         start)   start_container "$detach_flag" ;;
+        prod)    start_production ;;
         help)    display_help ;;
         *)       error "Unknown command: $cmd" ;;
     esac
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Module-level stores open SQLite files under DATA_DIR on import, so point them at a scratch
+# directory before any app module is loaded. No word list keeps candidate tests deterministic.
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="tests-")
+os.environ["SPELLING_DICTIONARY_PATH"] = ""
+os.environ.setdefault("OPENAI_API_KEY", "test")
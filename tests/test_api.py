@@ -0,0 +1,133 @@
+import pytest
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.testclient import TestClient
+
+import app.api as api
+from app.jobs import JobStore
+from app.pipeline import FULL_PROCESS_FIELDS, SUMMARY_FIELDS
+
+app = FastAPI()
+app.include_router(api.router)
+client = TestClient(app)
+BODY = {"url": "https://www.youtube.com/watch?v=abcdefghijk"}
+
+
+@pytest.fixture
+def no_pipeline(monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("pipeline should not run")
+
+    for name in ("full_process", "run_youtube_notes", "regenerate"):
+        monkeypatch.setattr(api, name, fail)
+
+
+def test_shape_selects_fields_and_drops_the_transcript():
+    shape = api.response_shape(FULL_PROCESS_FIELDS)(fields="title, transcription,cost", include_transcript=False)
+    assert shape({"title": "T", "transcription": "words", "cost": 0.1, "summary": "S"}) == {"title": "T", "cost": 0.1}
+
+
+def test_unknown_fields_are_rejected_by_the_dependency():
+    with pytest.raises(HTTPException) as error:
+        api.response_shape(SUMMARY_FIELDS)(fields="summary,title", include_transcript=True)
+    assert error.value.status_code == 400
+    assert error.value.detail == "Unknown fields: title"
+
+
+@pytest.mark.parametrize("path, params, body", [
+    ("/youtube_notes/full_process", {"model": "gpt-4o-mini", "fields": "bogus"}, BODY),
+    ("/youtube_notes/full_process", {"model": "gpt-4o-mini", "fields": "bogus", "stream": "true"}, BODY),
+    ("/youtube_notes/generate_summary", {"model": "gpt-4o-mini", "video_id": "abcdefghijk", "fields": "title"}, None),
+    ("/youtube_notes/regenerate", {"model": "gpt-4o-mini", "fields": "bogus"}, BODY),
+    ("/youtube_notes/batch", {"model": "gpt-4o-mini", "fields": "bogus"}, [BODY]),
+])
+def test_unknown_fields_fail_before_any_work(no_pipeline, path, params, body):
+    response = client.post(path, params=params, json=body)
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Unknown fields")
+
+
+@pytest.mark.parametrize("identifier, video_id", [
+    ("abcdefghijk", "abcdefghijk"),
+    ("https://www.youtube.com/watch?v=abcdefghijk&t=10s", "abcdefghijk"),
+    ("https://youtu.be/abcdefghijk", "abcdefghijk"),
+    ("https://www.youtube.com/watch?v=../../etc/passwd", None),
+    ("https://www.youtube.com/watch?v=%2E%2E%2Fx", None),
+])
+def test_only_youtube_video_ids_are_extracted(identifier, video_id):
+    assert api.get_video_id(identifier) == video_id
+
+
+@pytest.mark.parametrize("path, params, body", [
+    ("/youtube_notes/full_process", {"model": "gpt-4o-mini"}, {"url": "https://www.youtube.com/watch?v=../../x"}),
+    ("/youtube_notes/generate_outline", {"model": "gpt-4o-mini", "video_id": "../../x"}, None),
+    ("/youtube_notes/generate_summary", {"model": "gpt-4o-mini", "video_id": "abcdefghijk/.."}, None),
+    ("/youtube_notes/transcription_errors", {"model": "gpt-4o-mini", "video_id": "../x", "video_title": "T"}, None),
+])
+def test_invalid_video_ids_are_rejected(no_pipeline, path, params, body):
+    assert client.post(path, params=params, json=body).status_code == 400
+
+
+def test_follow_up_rejects_invalid_video_ids(no_pipeline):
+    response = client.post(
+        "/youtube_notes/generate_follow_up", params={"model": "gpt-4o-mini"}, json={"video_id": "../x", "takes": "t"}
+    )
+    assert response.status_code == 422
+
+
+def test_regenerate_uses_the_requested_stage_routing(monkeypatch):
+    calls = []
+
+    async def regenerate(video_id, model, models=None):
+        calls.append((video_id, model, models))
+        return {"title": "T"}
+
+    monkeypatch.setattr(api, "regenerate", regenerate)
+    response = client.post(
+        "/youtube_notes/regenerate", params={"model": "gpt-4o-mini", "stage_models": "tldr=gpt-4o"}, json=BODY
+    )
+    assert response.status_code == 200
+    assert calls == [("abcdefghijk", "gpt-4o-mini", api.parse_stage_models("tldr=gpt-4o"))]
+
+
+
+async def key_from_header(x_key: str = Header(...)):
+    # Stands in for main.get_api_key, which sets the calling key's name the same way
+    api.current_api_key.set(x_key)
+
+
+keyed_app = FastAPI()
+keyed_app.include_router(api.router, dependencies=[Depends(key_from_header)])
+keyed_client = TestClient(keyed_app)
+
+
+@pytest.fixture
+def jobs(monkeypatch, tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(api.job_queue, "store", store)
+    job = store.create("abcdefghijk", "gpt-4o-mini", api_key="phone")
+    store.complete(job["id"], {"title": "T"})
+    return job["id"]
+
+
+@pytest.mark.parametrize("path", ["/jobs/{}", "/jobs/{}/result"])
+def test_jobs_are_only_visible_to_their_key_and_admins(jobs, path):
+    path = path.format(jobs)
+    assert keyed_client.get(path, headers={"X-Key": "phone"}).status_code == 200
+    assert keyed_client.get(path, headers={"X-Key": "laptop"}).status_code == 404
+    assert keyed_client.get(path, headers={"X-Key": "default"}).status_code == 200
+
+
+def test_usage_is_limited_to_the_callers_key_unless_admin(monkeypatch):
+    queries = []
+
+    def aggregate(since, until, group_by, period, api_key):
+        queries.append(api_key)
+        return []
+
+    monkeypatch.setattr(api.usage_ledger, "aggregate", aggregate)
+    assert keyed_client.get("/usage", headers={"X-Key": "phone"}).status_code == 200
+    assert keyed_client.get("/usage", params={"api_key": "phone"}, headers={"X-Key": "phone"}).status_code == 200
+    assert keyed_client.get("/usage", params={"api_key": "laptop"}, headers={"X-Key": "phone"}).status_code == 403
+    assert keyed_client.get("/usage", headers={"X-Key": "default"}).status_code == 200
+    assert keyed_client.get("/usage", params={"api_key": "laptop"}, headers={"X-Key": "default"}).status_code == 200
+    assert queries == ["phone", "phone", None, "laptop"]
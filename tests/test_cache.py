@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+import app.cache as cache
+from app.cache import RunManifests, StageCache, make_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def entry_size(value):
+    return len(json.dumps(value).encode("utf-8"))
+
+
+def test_make_key_covers_every_input():
+    assert make_key("outline", "video", "gpt-4o") == make_key("outline", "video", "gpt-4o")
+    assert make_key("outline", "video", "gpt-4o") != make_key("outline", "video", "gpt-4o-mini")
+    assert make_key("outline", "video") != make_key("tldr", "video")
+
+
+def test_values_round_trip_and_count_hits_and_misses(tmp_path, clock):
+    stage_cache = StageCache(str(tmp_path / "cache.sqlite3"), 60, 10_000)
+    assert stage_cache.get("outline", "a") is None
+    stage_cache.set("outline", "a", {"outline": "1. Intro", "num_bullets": 1})
+    assert stage_cache.get("outline", "a") == {"outline": "1. Intro", "num_bullets": 1}
+
+    stats = stage_cache.stats()
+    assert stats["stages"]["outline"] == {"hits": 1, "misses": 1, "entries": 1, "bytes": stats["bytes"]}
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    stage_cache = StageCache(str(tmp_path / "cache.sqlite3"), 60, 10_000)
+    stage_cache.set("tldr", "a", "short")
+    clock.now += 59
+    assert stage_cache.get("tldr", "a") == "short"
+    clock.now += 2
+    assert stage_cache.get("tldr", "a") is None
+    assert stage_cache.stats()["entries"] == 0
+
+
+def test_values_larger_than_the_cap_are_not_stored(tmp_path, clock):
+    stage_cache = StageCache(str(tmp_path / "cache.sqlite3"), 60, 10)
+    stage_cache.set("summary", "a", "x" * 100)
+    assert stage_cache.get("summary", "a") is None
+    assert stage_cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted_over_the_cap(tmp_path, clock):
+    value = "x" * 100
+    stage_cache = StageCache(str(tmp_path / "cache.sqlite3"), 3600, 2 * entry_size(value))
+    stage_cache.set("summary", "a", value)
+    clock.now += 1
+    stage_cache.set("summary", "b", value)
+    clock.now += StageCache.ACCESS_UPDATE_SECONDS + 1
+    assert stage_cache.get("summary", "a") == value
+    clock.now += 1
+    stage_cache.set("summary", "c", value)
+
+    assert stage_cache.get("summary", "b") is None
+    assert stage_cache.get("summary", "a") == value
+    assert stage_cache.get("summary", "c") == value
+    assert stage_cache.stats()["bytes"] <= stage_cache.max_bytes
+
+
+def test_recent_hits_do_not_refresh_the_lru_position(tmp_path, clock):
+    value = "x" * 100
+    stage_cache = StageCache(str(tmp_path / "cache.sqlite3"), 3600, 2 * entry_size(value))
+    stage_cache.set("summary", "a", value)
+    clock.now += 1
+    stage_cache.set("summary", "b", value)
+    clock.now += 1
+    assert stage_cache.get("summary", "a") == value
+    clock.now += 1
+    stage_cache.set("summary", "c", value)
+
+    assert stage_cache.get("summary", "a") is None
+    assert stage_cache.get("summary", "b") == value
+
+
+def test_clear_drops_entries_and_counters(tmp_path, clock):
+    stage_cache = StageCache(str(tmp_path / "cache.sqlite3"), 60, 10_000)
+    stage_cache.set("outline", "a", "value")
+    stage_cache.get("outline", "a")
+    stage_cache.clear()
+    stats = stage_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (0, 0, 0)
+
+
+def test_run_manifests_keep_the_latest_run_per_video(tmp_path):
+    manifests = RunManifests(str(tmp_path / "cache.sqlite3"))
+    assert manifests.get("abcdefghijk") == {}
+    manifests.set("abcdefghijk", {"tldr": {"fingerprint": "1", "value": "old"}})
+    manifests.set("abcdefghijk", {"tldr": {"fingerprint": "2", "value": "new"}})
+    assert manifests.get("abcdefghijk") == {"tldr": {"fingerprint": "2", "value": "new"}}
+    manifests.clear()
+    assert manifests.get("abcdefghijk") == {}
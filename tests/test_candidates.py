@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+import app.services as services
+from app.candidates import edit_distance, find_candidates
+from app.usage import QuotaExceeded
+
+
+def by_word(candidates):
+    return {candidate["word"]: candidate for candidate in candidates}
+
+
+def test_edit_distance_stops_past_limit():
+    assert edit_distance("pytorch", "pytorh", 2) == 1
+    assert edit_distance("kitten", "sitting", 3) == 3
+    assert edit_distance("short", "much longer word", 2) == 3
+
+
+def test_near_miss_of_title_word_is_flagged():
+    candidates = by_word(find_candidates("Getting Started with PyTorch", "we will install pytorh first", 10))
+    assert candidates["pytorh"]["reasons"] == ["close to a title word"]
+    assert candidates["pytorh"]["similar"] == ["pytorch"]
+
+
+def test_split_title_word_is_flagged_as_pair():
+    candidates = by_word(find_candidates("Getting Started with PyTorch", "today we learn pie torch basics", 10))
+    assert "close to a title word when joined" in candidates["pie torch"]["reasons"]
+    assert candidates["pie torch"]["similar"] == ["pytorch"]
+    assert "pie torch" in candidates["pie torch"]["contexts"][0]
+
+
+def test_inflections_of_title_words_are_not_flagged():
+    assert find_candidates("Learning Kubernetes", "kubernetes runs containers, learning is fun", 10) == []
+
+
+def test_rare_variant_of_common_word_is_flagged():
+    transcription = "kubernetes " * 5 + "and then kubernetis once"
+    candidates = by_word(find_candidates("Cluster basics", transcription, 10))
+    assert candidates["kubernetis"]["reasons"] == ["rare variant of a more common word"]
+    assert candidates["kubernetis"]["similar"] == ["kubernetes"]
+    assert "kubernetes" not in candidates
+
+
+def test_results_are_capped_and_contexts_limited():
+    transcription = " ".join(["pytorh is here"] * 5 + ["kubernetes"] * 3 + ["kubernetis"])
+    candidates = find_candidates("PyTorch", transcription, 1, context_words=2)
+    assert [candidate["word"] for candidate in candidates] == ["pytorh"]
+    assert len(candidates[0]["contexts"]) <= 2
+    assert all("pytorh" in context for context in candidates[0]["contexts"])
+
+
+def llm_reply(arguments):
+    return {
+        "choices": [{"message": {"function_call": {"arguments": arguments}}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+    }
+
+
+def test_unparseable_error_replies_are_tolerated(monkeypatch):
+    async def chat_completion(**kwargs):
+        return llm_reply("not json")
+
+    monkeypatch.setattr(services, "chat_completion", chat_completion)
+    result = asyncio.run(services.determine_transcription_errors("PyTorch", "we install pytorh", "gpt-4o-mini"))
+    assert result == (None, 0.0)
+
+
+def test_quota_errors_are_not_swallowed(monkeypatch):
+    async def chat_completion(**kwargs):
+        raise QuotaExceeded("key", "daily", 1, 60)
+
+    monkeypatch.setattr(services, "chat_completion", chat_completion)
+    with pytest.raises(QuotaExceeded):
+        asyncio.run(services.determine_transcription_errors("PyTorch", "we install pytorh", "gpt-4o-mini"))
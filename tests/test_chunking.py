@@ -0,0 +1,44 @@
+from array import array
+
+from app.chunking import align_bullets, chunk_segments, section_transcripts
+from app.transcripts import Transcript
+
+
+def chunks_of(*texts):
+    return [{"start": i * 60.0, "end": (i + 1) * 60.0, "text": text} for i, text in enumerate(texts)]
+
+
+def test_bullets_start_at_their_best_matching_chunk():
+    chunks = chunks_of(
+        "welcome everyone to the show",
+        "installing python packages with pip",
+        "training neural networks on gpus",
+        "deploying models to production servers",
+    )
+    bullets = ["Installing packages with pip", "Training neural networks", "Deploying to production"]
+    assert align_bullets(bullets, chunks) == [0, 2, 3]
+
+
+def test_first_bullet_always_starts_at_the_beginning():
+    chunks = chunks_of("intro music", "python basics", "python advanced")
+    assert align_bullets(["Python advanced"], chunks)[0] == 0
+
+
+def test_starts_never_move_backwards():
+    chunks = chunks_of("databases intro", "caching layers", "databases again", "caching wrap up")
+    starts = align_bullets(["Databases", "Caching", "Databases", "Caching"], chunks)
+    assert starts == sorted(starts)
+    assert starts == [0, 1, 2, 3]
+
+
+def test_section_transcripts_returns_excerpts_and_bounds():
+    texts = ["intro to the talk", "python packaging with pip", "neural network training", "serving models"]
+    transcript = Transcript.from_texts(texts, array("I", [0, 60000, 120000, 180000]), array("I", [60000] * 4))
+    assert len(chunk_segments(transcript, 1)) == 4
+    outline = "1. Python packaging\n2. Neural network training\n3. Serving models"
+    excerpts, bounds = section_transcripts(transcript, outline, 4, 1)
+    assert bounds == [(0, 2), (2, 3), (3, 3)]
+    assert excerpts[0].startswith("[0:00] intro to the talk")
+    assert excerpts[2] == "[3:00] serving models"
+    # The unnumbered fourth bullet gets the whole transcript
+    assert excerpts[3] == transcript.text
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+import app.estimate as estimate
+from app.estimate import BudgetExceeded, plan_within_budget
+from app.routing import LLM_STAGES, stage_model
+
+# Dollars per stage, so a plan's cost is easy to read off
+STAGE_PRICES = {"gpt-4o": 1.0, "gpt-4o-mini": 0.1}
+
+
+@pytest.fixture(autouse=True)
+def fake_estimates(monkeypatch):
+    async def estimate_video(video_id, model, models=None):
+        cost = sum(STAGE_PRICES[stage_model(stage, model, models)] for stage in LLM_STAGES)
+        return {"model": model, "cost": cost}
+
+    monkeypatch.setattr(estimate, "estimate_video", estimate_video)
+
+
+def plan(model, max_cost, models=None):
+    return asyncio.run(plan_within_budget("abcdefghijk", model, max_cost, models))
+
+
+def test_requested_routing_is_kept_when_it_fits():
+    models, result = plan("gpt-4o", 10)
+    assert models == {}
+    assert result["cost"] == 6
+
+
+def test_summaries_move_to_a_cheaper_model_first():
+    models, result = plan("gpt-4o", 5)
+    assert models == {"first_summary": "gpt-4o-mini", "summaries": "gpt-4o-mini"}
+    assert result["cost"] == pytest.approx(4.2)
+
+
+def test_every_stage_moves_when_summaries_are_not_enough():
+    models, result = plan("gpt-4o", 1)
+    assert models == {stage: "gpt-4o-mini" for stage in LLM_STAGES}
+    assert result["cost"] == pytest.approx(0.6)
+
+
+def test_requested_overrides_are_kept_when_they_fit():
+    models, _ = plan("gpt-4o", 10, {"tldr": "gpt-4o-mini"})
+    assert models == {"tldr": "gpt-4o-mini"}
+
+
+def test_budget_exceeded_carries_the_cheapest_estimate():
+    with pytest.raises(BudgetExceeded) as error:
+        plan("gpt-4o", 0.5)
+    assert error.value.estimate["cost"] == pytest.approx(0.6)
+    assert error.value.max_cost == 0.5
+
+
+def test_models_without_a_cheaper_fallback_are_tried_once():
+    with pytest.raises(BudgetExceeded) as error:
+        plan("gpt-4o-mini", 0.1)
+    assert error.value.estimate["cost"] == pytest.approx(0.6)
@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import app.jobs as jobs
+from app.jobs import JobQueue, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def finished_runs(monkeypatch):
+    async def full_process(video_id, model, on_stage_complete=None):
+        on_stage_complete("details", type("Run", (), {"timings": {"details": 0.1}})())
+        return {"video_id": video_id, "summary": "notes"}
+
+    monkeypatch.setattr(jobs, "full_process", full_process)
+
+
+def run_claimed(queue, job_id):
+    assert queue.store.claim_next(queue.owner) == job_id
+    asyncio.run(queue._run(job_id))
+    return queue.store.get(job_id)
+
+
+def test_job_completes_and_records_progress(store, finished_runs):
+    queue = JobQueue(store, 1)
+    job = store.create("abcdefghijk", "gpt-4o-mini")
+    done = run_claimed(queue, job["id"])
+    assert done["status"] == "completed"
+    assert done["result"] == {"video_id": "abcdefghijk", "summary": "notes"}
+    assert done["progress"]["completed_stages"] == ["details"]
+
+
+def test_progress_write_failures_do_not_fail_the_job(store, finished_runs, monkeypatch):
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, "set_progress", locked)
+    queue = JobQueue(store, 1)
+    job = store.create("abcdefghijk", "gpt-4o-mini")
+    assert run_claimed(queue, job["id"])["status"] == "completed"
+
+
+def lock_once(monkeypatch, store, method):
+    original = getattr(store, method)
+
+    def locked(*args):
+        monkeypatch.setattr(store, method, original)
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, method, locked)
+
+
+def test_unsaved_result_fails_the_job(store, finished_runs, monkeypatch):
+    lock_once(monkeypatch, store, "complete")
+    queue = JobQueue(store, 1)
+    job = store.create("abcdefghijk", "gpt-4o-mini")
+    done = run_claimed(queue, job["id"])
+    assert done["status"] == "failed"
+    assert done["error"] == "Could not save result: database is locked"
+
+
+@pytest.mark.parametrize("methods", [("get",), ("complete", "fail")])
+def test_store_errors_put_the_job_back_in_the_queue(store, finished_runs, monkeypatch, methods):
+    for method in methods:
+        lock_once(monkeypatch, store, method)
+    queue = JobQueue(store, 1)
+    job = store.create("abcdefghijk", "gpt-4o-mini")
+    assert run_claimed(queue, job["id"])["status"] == "queued"
+    assert queue._running == set()
+
+
+def test_only_jobs_in_progress_get_heartbeats(store):
+    first, second = store.create("abcdefghijk", "m"), store.create("bcdefghijkl", "m")
+    store.claim_next("worker")
+    store.claim_next("worker")
+    store.heartbeat("worker", [first["id"]])
+    assert store.requeue_stale(-1) == 2
+    store.claim_next("worker")
+    store.claim_next("worker")
+    store._execute("UPDATE jobs SET heartbeat_at = 0")
+    store.heartbeat("worker", [first["id"]])
+    assert store.requeue_stale(60) == 1
+    assert store.get(second["id"])["status"] == "queued"
+    assert store.get(first["id"])["status"] == "running"
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from app.limits import AdaptiveLimiter, SharedLimitState, parse_duration
+
+
+def make_limiter(tmp_path, initial=4, minimum=1, maximum=8):
+    return AdaptiveLimiter(SharedLimitState(str(tmp_path / "limits.sqlite3")), initial, minimum, maximum)
+
+
+def test_limit_grows_by_one_slot_per_window_of_successes(tmp_path):
+    limiter = make_limiter(tmp_path)
+    # Each success adds 1 / limit, so four slots need about five successes to become five
+    for _ in range(4):
+        limiter.on_success()
+    assert int(limiter.limit) == 4
+    limiter.on_success()
+    assert int(limiter.limit) == 5
+
+
+def test_limit_never_exceeds_maximum(tmp_path):
+    limiter = make_limiter(tmp_path, initial=8)
+    limiter.on_success()
+    assert limiter.limit == 8
+
+
+def test_rate_limit_halves_once_per_pause(tmp_path):
+    async def main():
+        limiter = make_limiter(tmp_path, initial=8)
+        await limiter.on_rate_limited(5)
+        await limiter.on_rate_limited(5)
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.limit == 4
+
+
+def test_limit_never_drops_below_minimum(tmp_path):
+    async def main():
+        limiter = make_limiter(tmp_path, initial=2, minimum=2)
+        await limiter.on_rate_limited(0)
+        return limiter
+
+    assert asyncio.run(main()).limit == 2
+
+
+def test_slots_are_capped_at_the_limit(tmp_path):
+    async def main():
+        limiter = make_limiter(tmp_path, initial=2, maximum=2)
+        peak = 0
+
+        async def call():
+            nonlocal peak
+            async with limiter.slot():
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(call() for _ in range(6)))
+        return limiter, peak
+
+    limiter, peak = asyncio.run(main())
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+
+def test_pause_is_shared_between_limiters(tmp_path):
+    async def main():
+        state = SharedLimitState(str(tmp_path / "limits.sqlite3"))
+        first = AdaptiveLimiter(state, 4, 1, 8)
+        second = AdaptiveLimiter(state, 4, 1, 8)
+        await first.pause(0.2)
+        start = time.monotonic()
+        async with second.slot():
+            return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.15
+
+
+def test_parse_duration():
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("250ms") == 0.25
+    assert parse_duration("1h2s") == 3602
+    assert parse_duration("soon") is None
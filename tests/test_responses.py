@@ -0,0 +1,73 @@
+import gzip
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.responses import CompressionMiddleware
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100)
+LARGE = "word " * 200
+
+
+@app.get("/large", response_class=PlainTextResponse)
+async def large():
+    return LARGE
+
+
+@app.get("/small", response_class=PlainTextResponse)
+async def small():
+    return "tiny"
+
+
+@app.get("/stream")
+async def stream():
+    return StreamingResponse(iter([LARGE, LARGE]), media_type="text/plain")
+
+
+@app.get("/events")
+async def events():
+    return StreamingResponse(iter(["event: a\ndata: 1\n\n"] * 50), media_type="text/event-stream")
+
+
+client = TestClient(app)
+
+
+def get_raw(path, accept_encoding="gzip"):
+    # Read the body as sent, without the client decoding it
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_large_bodies_are_gzipped():
+    response, body = get_raw("/large")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-length"] == str(len(body))
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert gzip.decompress(body).decode() == LARGE
+
+
+def test_small_bodies_are_sent_as_they_are():
+    response, body = get_raw("/small")
+    assert "content-encoding" not in response.headers
+    assert body == b"tiny"
+
+
+def test_clients_without_gzip_get_plain_bodies():
+    response, body = get_raw("/large", accept_encoding="identity")
+    assert "content-encoding" not in response.headers
+    assert body.decode() == LARGE
+
+
+def test_streamed_bodies_are_compressed_chunk_by_chunk():
+    response, body = get_raw("/stream")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert gzip.decompress(body).decode() == LARGE * 2
+
+
+def test_event_streams_are_not_compressed():
+    response, body = get_raw("/events")
+    assert "content-encoding" not in response.headers
+    assert body.startswith(b"event: a")
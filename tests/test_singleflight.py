@@ -0,0 +1,77 @@
+import asyncio
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    async def main():
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "done"
+
+        results = await asyncio.gather(*(flight.do("stage", "key", work) for _ in range(3)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(main())
+    assert calls == 1
+    assert results == [("done", True), ("done", False), ("done", False)]
+    assert flight.coalesced == {"stage": 2}
+
+
+def test_cancelling_one_waiter_keeps_the_work_running():
+    async def main():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = False
+
+        async def work():
+            nonlocal cancelled
+            started.set()
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            return "done"
+
+        leader = asyncio.ensure_future(flight.do("stage", "key", work))
+        await started.wait()
+        follower = asyncio.ensure_future(flight.do("stage", "key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower, cancelled
+
+    result, cancelled = asyncio.run(main())
+    assert result == ("done", False)
+    assert not cancelled
+
+
+def test_work_is_cancelled_once_every_waiter_is_gone():
+    async def main():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.ensure_future(flight.do("stage", "key", work)) for _ in range(2)]
+        await started.wait()
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return flight
+
+    flight = asyncio.run(main())
+    assert flight._calls == {}
@@ -0,0 +1,57 @@
+from array import array
+
+import pytest
+
+from app.transcripts import HEADER, MAGIC, Transcript, TranscriptStore, decode_transcript, encode_transcript
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TranscriptStore(str(tmp_path / "transcripts"), str(tmp_path / "index.sqlite3"), 100)
+
+
+def make_transcript():
+    return Transcript.from_texts(["héllo there", "général", "kenobi"], array("I", [0, 1500, 3000]), array("I", [1500, 1500, 900]))
+
+
+def test_transcripts_round_trip():
+    transcript = decode_transcript(encode_transcript(make_transcript()))
+    assert transcript.text == "héllo there général kenobi"
+    assert [segment.text for segment in transcript] == ["héllo there", "général", "kenobi"]
+    assert [segment.start for segment in transcript] == [0, 1.5, 3]
+    assert list(transcript.durations) == [1500, 1500, 900]
+
+
+def test_version_1_files_are_still_readable():
+    texts = [text.encode("utf-8") for text in ("héllo there", "général", "kenobi")]
+    ends = array("I", [len(texts[0]), len(texts[0]) + len(texts[1]), sum(map(len, texts))])
+    data = b"".join([
+        HEADER.pack(MAGIC, 1, 3),
+        array("I", [0, 1500, 3000]).tobytes(), array("I", [1500, 1500, 900]).tobytes(), ends.tobytes(),
+        *texts,
+    ])
+    transcript = decode_transcript(data)
+    assert transcript.text == "héllo there général kenobi"
+    assert transcript[1].text == "général"
+
+
+def test_store_saves_loads_and_searches(store):
+    assert store.load("abcdefghijk") is None
+    store.save("abcdefghijk", make_transcript())
+    assert store.load("abcdefghijk").text == "héllo there général kenobi"
+    assert store.search("kenobi")[0]["video_id"] == "abcdefghijk"
+
+
+def test_truncated_files_are_unreadable(store, tmp_path):
+    store.save("abcdefghijk", make_transcript())
+    path = tmp_path / "transcripts" / "abcdefghijk.bin"
+    path.write_bytes(path.read_bytes()[:HEADER.size + 8])
+    assert store.load("abcdefghijk") is None
+
+
+@pytest.mark.parametrize("video_id", ["../../etc/passwd", "abc", "abcdefghij/", "abcdefghijk.bin"])
+def test_store_refuses_paths_that_are_not_video_ids(store, video_id):
+    with pytest.raises(ValueError):
+        store.load(video_id)
+    with pytest.raises(ValueError):
+        store.save(video_id, make_transcript())
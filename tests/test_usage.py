@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from app.usage import DAY, QuotaExceeded, SpendingLimit
+
+
+def test_spending_under_the_limit_is_allowed():
+    limit = SpendingLimit("daily", 1.0, DAY)
+    limit.spend("phone", 0.4)
+    limit.spend("phone", 0.5)
+    limit.check("phone")
+    assert limit.status("phone") == {"limit": 1.0, "used": 0.9}
+
+
+def test_reaching_the_limit_refuses_until_spending_leaves_the_window():
+    limit = SpendingLimit("daily", 1.0, DAY)
+    limit.spend("phone", 1.0, now=time.time() - 3600)
+    with pytest.raises(QuotaExceeded) as error:
+        limit.check("phone")
+    # The hour-old spending leaves the window in about 23 hours, not after paying off any debt
+    assert DAY - 3600 <= error.value.retry_after <= DAY - 3600 + 2 * SpendingLimit.SLOT_SECONDS
+
+
+def test_overspending_does_not_carry_into_the_next_window():
+    limit = SpendingLimit("daily", 0.01, DAY)
+    limit.spend("phone", 5.0, now=time.time() - DAY - 2 * SpendingLimit.SLOT_SECONDS)
+    limit.check("phone")
+    assert limit.used("phone") == 0
+
+
+def test_keys_are_limited_separately():
+    limit = SpendingLimit("daily", 1.0, DAY)
+    limit.spend("phone", 2.0)
+    limit.check("laptop")
+    with pytest.raises(QuotaExceeded):
+        limit.check("phone")
+
+
+def test_sub_cent_limits_are_shown_exactly():
+    limit = SpendingLimit("daily", 0.002, DAY)
+    limit.spend("phone", 0.003)
+    with pytest.raises(QuotaExceeded, match=r"\$0\.002"):
+        limit.check("phone")
+
+
+def test_zero_limit_is_disabled():
+    limit = SpendingLimit("daily", 0, DAY)
+    limit.spend("phone", 100.0)
+    limit.check("phone")
+    assert limit.used("phone") == 0
+
+
+def test_replay_rebuilds_the_window_from_history():
+    now = time.time()
+    limit = SpendingLimit("daily", 1.0, DAY)
+    limit.spend("phone", 0.7, now=now)
+    limit.replay("phone", [(now - 2 * DAY, 5.0), (now - 3600, 0.25), (now - 60, 0.25)], now)
+    assert limit.used("phone", now) == pytest.approx(0.5)
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from app.utils import TranscriptUnavailable, _parse_player_response, _select_caption_track
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def watch_page():
+    with open(os.path.join(FIXTURES, "watch_page.html"), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_player_response_is_decoded_as_a_whole():
+    player_response = _parse_player_response(watch_page())
+    tracks = player_response["captions"]["playerCaptionsTracklistRenderer"]["captionTracks"]
+    assert [track["vssId"] for track in tracks] == [".de", "a.en", ".en"]
+    assert player_response["videoDetails"]["author"] == "Deep Learning Demos"
+    assert player_response["videoDetails"]["shortDescription"].endswith(',"videoDetails": see below')
+
+
+def test_manual_english_captions_are_preferred():
+    player_response = _parse_player_response(watch_page())
+    track = _select_caption_track(player_response["captions"]["playerCaptionsTracklistRenderer"]["captionTracks"])
+    assert track["vssId"] == ".en"
+
+
+def test_pages_without_a_player_response_are_rejected():
+    with pytest.raises(TranscriptUnavailable):
+        _parse_player_response("<html><script>var ytInitialData = {};</script></html>")